@@ -0,0 +1,169 @@
+import csv
+import hashlib
+import os
+import threading
+import time
+
+"""
+Bulk import files
+
+The writer of 'python parse_datasets.py --import-files DIR' (make bulk-import): it takes the queries of the query
+generators and writes the nodes and relationships they would merge as CSV files for 'neo4j-admin database import',
+with an import.sh script running the import into an empty, stopped database. See write_import_files in
+parse_datasets.py.
+"""
+
+
+# Writer turning the generated queries into CSV files for 'neo4j-admin database import' instead of running them:
+# one file per node label and one per relationship type, each starting with its header, written as the batches come
+# in. Nodes are identified by their key property, node_keys maps the labels to it (NODE_KEYS in parse_datasets.py).
+# Only the node ids and the digests of the relationship keys are kept in memory, with the number of their last row:
+# when close is called the rows of a key written again are dropped but the last one, so each node and relationship is
+# written once with the values successive MERGE ... SET statements would leave (see unique_rows in parse_datasets.py).
+class BulkImportWriter:
+    def __init__(self, output_dir, data_version, node_keys):
+        self.output_dir = output_dir
+        self.data_version = data_version
+        self.node_keys = node_keys
+        os.makedirs(output_dir, exist_ok=True)
+        # File name -> (open file, csv writer, data keys of the columns) and the node labels or relationship
+        # types given to neo4j-admin for each file
+        self.files = {}
+        self.node_files = {}
+        self.relationship_files = {}
+        # File name -> {key: number of its last row}, and the number of rows written to each file
+        self.written = {}
+        self.file_rows = {}
+        self.rows = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, queries):
+        with self.lock:
+            for _, params, writes in queries:
+                if 'dataset' in writes:
+                    self.write_dataset(writes)
+                elif 'node' in writes:
+                    self.write_nodes(writes, params)
+                else:
+                    self.write_relationships(writes, params)
+
+    # Write the Dataset node the query would merge, enabled and switched to as the database only holds this version
+    def write_dataset(self, writes):
+        timestamp = round(time.time() * 1000)
+        row = {'dataset': writes['dataset'], 'enabled': True, 'source': writes['source'], 'timestamp': timestamp,
+               'data_version': self.data_version, 'activated': timestamp}
+        header = ['dataset:ID(Dataset)', 'enabled:boolean', 'source', 'timestamp:long', 'data_version',
+                  'activated:long']
+        self.node_files['nodes_Dataset.csv'] = 'Dataset'
+        self.write_rows('nodes_Dataset.csv', header, list(row), [row], lambda row: row['dataset'])
+
+    def write_nodes(self, writes, params):
+        label = writes['node']
+        key = self.node_keys[label]
+        props_to_keys = writes['properties']
+        data = [{**entry, 'dataset': params['dataset'], 'data_version': params['data_version']} for entry in params['data']]
+        columns = [props_to_keys[key]] + [column for prop, column in props_to_keys.items() if prop != key]
+        props = [key] + [prop for prop in props_to_keys if prop != key]
+        header = [f"{key}:ID({label})"] + [header_field(prop, data, column) for prop, column in zip(props[1:], columns[1:])]
+        file_name = f"nodes_{label}.csv"
+        self.node_files[file_name] = label
+        self.write_rows(file_name, header + ['dataset', 'data_version'], columns + ['dataset', 'data_version'], data,
+                        lambda row: row[columns[0]])
+
+    def write_relationships(self, writes, params):
+        relationship_type = writes['relationship']
+        (start_label, start_key), (end_label, end_key) = writes['start'], writes['end']
+        props_to_keys = writes['properties']
+        averaged = writes['averaged']
+        data = [{**entry, 'dataset': params['dataset']} for entry in params['data']]
+        columns = [start_key, end_key, 'dataset'] + list(props_to_keys.values()) + averaged
+        header = [f":START_ID({start_label})", f":END_ID({end_label})", 'dataset'] + \
+                 [header_field(prop, data, column) for prop, column in props_to_keys.items()] + \
+                 [header_field(prop, data, prop) for prop in averaged]
+        file_name = f"relationships_{relationship_type}.csv"
+        self.relationship_files[file_name] = relationship_type
+
+        # The relationship is identified by its nodes and the properties of the MERGE pattern, the averaged
+        # properties were already averaged over the whole query generator run (see DeduplicatingWriter).
+        # Relationships are too many to keep their keys in memory, a 128-bit BLAKE2b digest of the key is kept
+        # instead: unlike hash(), two different keys practically never get the same digest.
+        merge_columns = columns[:len(columns) - len(averaged)]
+        def relationship_key(row):
+            if row[start_key] is None or row[end_key] is None:
+                return None
+            key = repr(tuple(row[column] for column in merge_columns)).encode()
+            return hashlib.blake2b(key, digest_size=16).digest()
+
+        self.write_rows(file_name, header, columns, data, relationship_key)
+
+    # Write the rows of a file, recording the last row of each key. The rows with a null key are skipped.
+    def write_rows(self, file_name, header, columns, rows, row_key):
+        _, writer, _ = self.open_file(file_name, header, columns)
+        written = self.written.setdefault(file_name, {})
+        for row in rows:
+            key = row_key(row)
+            if key is None:
+                continue
+            written[key] = self.file_rows[file_name]
+            self.file_rows[file_name] += 1
+            writer.writerow([csv_value(row[column]) for column in columns])
+
+    def open_file(self, file_name, header, columns):
+        if file_name not in self.files:
+            file = open(os.path.join(self.output_dir, file_name), 'w', newline='')
+            writer = csv.writer(file)
+            writer.writerow(header)
+            self.files[file_name] = (file, writer, columns)
+            self.file_rows[file_name] = 0
+        return self.files[file_name]
+
+    # Rewrite a file with only the last row of each key
+    def drop_replaced_rows(self, file_name):
+        last_rows = set(self.written[file_name].values())
+        path = os.path.join(self.output_dir, file_name)
+        with open(path, newline='') as source, open(path + ".tmp", 'w', newline='') as target:
+            reader, writer = csv.reader(source), csv.writer(target)
+            writer.writerow(next(reader))
+            writer.writerows(row for n, row in enumerate(reader) if n in last_rows)
+        os.replace(path + ".tmp", path)
+
+    # Close the files and write import.sh, the neo4j-admin command importing them into an empty 'neo4j' database.
+    # It runs from the output directory with Neo4j stopped.
+    def close(self):
+        for file_name, (file, _, _) in self.files.items():
+            file.close()
+            if len(self.written[file_name]) < self.file_rows[file_name]:
+                self.drop_replaced_rows(file_name)
+            self.rows += len(self.written[file_name])
+
+        # Rows whose key is missing from the node files are skipped, as MATCH would not find their nodes
+        command = ["neo4j-admin database import full", "--overwrite-destination", "--skip-duplicate-nodes",
+                   "--skip-bad-relationships"]
+        command += [f"--nodes={label}={file_name}" for file_name, label in self.node_files.items()]
+        command += [f"--relationships={relationship_type}={file_name}"
+                    for file_name, relationship_type in self.relationship_files.items()]
+        command.append("neo4j")
+        with open(os.path.join(self.output_dir, "import.sh"), 'w') as file:
+            file.write('cd "$(dirname "$0")"\n' + " \\\n  ".join(command) + "\n")
+        print(f"Wrote {self.rows} rows to {len(self.files)} files in {self.output_dir}, "
+              f"import them with {os.path.join(self.output_dir, 'import.sh')}")
+
+
+# Header field of a CSV property column, typed after the first value of the column in data
+def header_field(prop, data, column):
+    value = next((row[column] for row in data if row[column] is not None), None)
+    if isinstance(value, bool):
+        return f"{prop}:boolean"
+    if isinstance(value, int):
+        return f"{prop}:long"
+    if isinstance(value, float):
+        return f"{prop}:double"
+    return prop
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value
@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    from parquet_reader import MIN_BATCH_ROWS, decoded_column_bytes, resolve_parquet_columns, stream_batch_rows
+except ImportError:
+    from datasets.parquet_reader import MIN_BATCH_ROWS, decoded_column_bytes, resolve_parquet_columns, stream_batch_rows
+
+"""
+Parquet compaction: with INGEST_COMPACT=true (see parse_datasets.py) the part files of each data type are rewritten
+into a few large files with only the columns the query generators read, so the ingest reads a few large files instead
+of hundreds of small ones. 'python parse_datasets.py --compact' (make compact-datasets) only runs the compaction.
+"""
+
+# Compaction settings, they can be overridden with environment variables.
+# INGEST_COMPACT_DIR: folder the compacted files and the compaction manifest are written to
+# INGEST_COMPACT_FILE_MB: decoded size of the columns kept in one compacted file
+INGEST_COMPACT_DIR = os.getenv("INGEST_COMPACT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "opentarget_compact"))
+INGEST_COMPACT_FILE_MB = int(os.getenv("INGEST_COMPACT_FILE_MB", 512))
+
+# Version of the compacted files, compacted again when it changes
+COMPACT_FORMAT = 1
+
+
+# Rewrite the part files of each data type of input_dir into a few files of about INGEST_COMPACT_FILE_MB of decoded
+# data in output_dir (INGEST_COMPACT_DIR by default), keeping only the columns read by the query generators of the data
+# type: data_type_columns maps each data type to load to these columns (None for every column), the other folders are
+# skipped. Each row group holds one streaming batch of memory_mb (see stream_batch_rows), so the reader decodes one
+# row group per batch. The compaction manifest records the input files of each data type with the settings it was
+# compacted with, and a data type whose input files and settings didn't change is not compacted again. The folders of
+# the data types that are gone from input_dir are removed. Returns output_dir.
+def compact_datasets(input_dir, data_type_columns, memory_mb, workers=1, output_dir=None):
+    output_dir = output_dir or INGEST_COMPACT_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, "compaction_manifest.json")
+    try:
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+
+    data_types = [data_type for data_type in sorted(os.listdir(input_dir))
+                  if data_type in data_type_columns and os.path.isdir(os.path.join(input_dir, data_type))]
+    for data_type in data_types:
+        data_type_path = os.path.join(input_dir, data_type)
+        files = sorted(file for file in os.listdir(data_type_path) if file.endswith(".parquet"))
+        entry = {
+            'format': COMPACT_FORMAT,
+            'columns': data_type_columns[data_type],
+            'memory_mb': memory_mb,
+            'file_mb': INGEST_COMPACT_FILE_MB,
+            'workers': workers,
+            'inputs': {file: [os.path.getsize(os.path.join(data_type_path, file)),
+                              os.path.getmtime(os.path.join(data_type_path, file))] for file in files},
+        }
+        previous = manifest.get(data_type)
+        if previous is not None and {key: previous.get(key) for key in entry} == entry and \
+                all(os.path.exists(os.path.join(output_dir, data_type, file)) for file in previous['outputs']):
+            print(f"Compaction of {data_type} is up to date ({len(files)} files in {len(previous['outputs'])})")
+            continue
+
+        start = time.perf_counter()
+        entry['outputs'] = compact_data_type(data_type_path, os.path.join(output_dir, data_type), files,
+                                             entry['columns'], memory_mb, workers)
+        manifest[data_type] = entry
+        with open(manifest_path + ".tmp", "w") as file:
+            json.dump(manifest, file, indent=1, sort_keys=True)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        size = sum(os.path.getsize(os.path.join(output_dir, data_type, file)) for file in entry['outputs'])
+        print(f"Compacted {data_type}: {len(files)} files into {len(entry['outputs'])}, "
+              f"{size / 1024 / 1024:.1f} MB in {time.perf_counter() - start:.1f}s")
+
+    for data_type in list(manifest):
+        if data_type not in data_types:
+            print(f"Removing the compacted files of {data_type}, it is gone from {input_dir}")
+            shutil.rmtree(os.path.join(output_dir, data_type), ignore_errors=True)
+            del manifest[data_type]
+    with open(manifest_path + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return output_dir
+
+
+# Rewrite the parquet files of a data type into compact-NNNNN.parquet files of output_path, replacing the ones there
+# once they are all written. A new file is started when the current one holds INGEST_COMPACT_FILE_MB of decoded data,
+# or less so that there is a file per worker process, or when the schema of the input changes. Returns the names of
+# the files written.
+def compact_data_type(data_type_path, output_path, files, columns, memory_mb, workers=1):
+    footers = [pq.read_metadata(os.path.join(data_type_path, file)) for file in files]
+    total_bytes = sum(decoded_column_bytes(metadata, resolve_parquet_columns(metadata.schema, columns))
+                      for metadata in footers)
+    file_bytes = INGEST_COMPACT_FILE_MB * 1024 * 1024
+    if workers > 1:
+        file_bytes = min(file_bytes, max(total_bytes // workers, 1))
+
+    temp_path = output_path + ".tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    outputs = []
+    writer = None
+    pending = []
+    written_bytes = 0
+    row_group_rows = MIN_BATCH_ROWS
+
+    # Write the pending batches in row groups of row_group_rows rows, keeping the rest pending unless it is the end
+    # of the file
+    def write_pending(final=False):
+        nonlocal pending
+        if not pending:
+            return
+        table = pa.Table.from_batches(pending)
+        rows = table.num_rows if final else table.num_rows // row_group_rows * row_group_rows
+        if rows:
+            writer.write_table(table.slice(0, rows), row_group_size=row_group_rows)
+        pending = table.slice(rows).to_batches() if rows < table.num_rows else []
+
+    def close_writer():
+        write_pending(final=True)
+        writer.close()
+
+    for file, metadata in zip(files, footers):
+        parquet_file = pq.ParquetFile(os.path.join(data_type_path, file))
+        column_paths = resolve_parquet_columns(parquet_file.schema, columns)
+        batch_rows = stream_batch_rows(metadata, memory_mb, column_paths)
+        row_bytes = decoded_column_bytes(metadata, column_paths) / max(metadata.num_rows, 1)
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=column_paths):
+            if writer is not None and (written_bytes >= file_bytes or not batch.schema.equals(writer.schema)):
+                close_writer()
+                writer = None
+            if writer is None:
+                outputs.append(f"compact-{len(outputs):05d}.parquet")
+                writer = pq.ParquetWriter(os.path.join(temp_path, outputs[-1]), batch.schema)
+                written_bytes = 0
+                row_group_rows = batch_rows
+            pending.append(batch)
+            written_bytes += batch.num_rows * row_bytes
+            write_pending()
+    if writer is not None:
+        close_writer()
+
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.replace(temp_path, output_path)
+    return outputs
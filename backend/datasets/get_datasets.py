@@ -1,9 +1,12 @@
-import wget
+import json
 import os
+import threading
 import time
-from urllib.parse import urlparse
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
+import pyarrow.parquet as pq
+import requests
+from requests.adapters import HTTPAdapter
 
 """
 This script downloads Open Target datasets from the Open Target FTP server.
@@ -16,33 +19,56 @@ Steps to add a new data type:
 The key is the name of the new data type and the value is a list containing the local directory path and the Open Target FTP server path.
 2. Ensure the URL and local directory are correct and have the appropriate read and write permissions.
 
-The script downloads files in parallel to try and speed up the process, particularly when there are retries.
-The ThreadPoolExecutor class from the concurrent.futures module is used to manage threads for parallel downloads.
-The 'max_workers' parameter determines the maximum number of threads used concurrently.
-
-The script has a retry mechanism, enabling it to retry a download if it fails.
-The 'max_retries' parameter determines the maximum number of retries allowed for each download.
-The 'delay' parameter specifies the time (in seconds) to wait before attempting the next retry.
+The files of all the data types are downloaded by a single scheduler (see download_datasets): one pool of
+DOWNLOAD_WORKERS threads shared by every data type, each thread reusing its own keep-alive HTTP session, so the number
+of open connections doesn't depend on the number of data types or files.
+A file is downloaded to '<file>.part' and renamed once complete. A failed or interrupted download is retried, up to
+DOWNLOAD_RETRIES times DOWNLOAD_RETRY_DELAY seconds apart, from the end of the partial file with an HTTP Range request,
+and the next run resumes the partial files left by an interrupted one the same way.
+The scheduler prints the throughput of each data type and of the whole download at the end.
+
+Every file listed on the server is verified before it is downloaded, in the same pool of threads: its size and
+Last-Modified date on the server (from a HEAD request) are compared with the ones recorded in the download manifest
+(DOWNLOAD_MANIFEST, download_manifest.json) when it was downloaded, and its parquet footer is read. Only the files that
+are missing, stale (changed on the server) or corrupt (truncated, or without a readable footer) are downloaded, so a
+startup with complete files downloads nothing and leaves the files, and therefore the ingest, untouched. A downloaded
+file without a readable footer is downloaded again.
+
+On startup the files are loaded into Neo4j while they are downloaded: get_datasets is given a DownloadFeed, which
+hands every completed file to the ingest right away, and the names of the data types to download first (the ones with
+node query generators).
 
 The 'paths' dictionary stores the local directory paths and corresponding Open Target FTP server paths for each dataset.
+The server is OPEN_TARGETS_URL, which can point to a mirror or to a local HTTP server serving the same layout.
 """
 
+# Download settings, they can be overridden with environment variables
+OPEN_TARGETS_URL = os.getenv("OPEN_TARGETS_URL", "https://ftp.ebi.ac.uk/pub/databases/opentargets/platform/latest")
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 8))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", 3))
+DOWNLOAD_RETRY_DELAY = float(os.getenv("DOWNLOAD_RETRY_DELAY", 5))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", 60))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_MANIFEST = os.getenv("DOWNLOAD_MANIFEST", os.path.join(os.path.dirname(os.path.abspath(__file__)), "download_manifest.json"))
+
 # Define a dictionary containing the project paths and Open Target paths for different data types
 paths = {
     # Key: data type name, Value: [local directory path, Open Target URL path]
-    "diseases": ["opentarget/diseases", "https://ftp.ebi.ac.uk/pub/databases/opentargets/platform/latest/output/etl/parquet/diseases/"],
-    "fda": ["opentarget/fda", "https://ftp.ebi.ac.uk/pub/databases/opentargets/platform/latest/output/etl/parquet/fda/significantAdverseDrugReactions/"],
-    "mechanismOfAction": ["opentarget/mechanismOfAction", "https://ftp.ebi.ac.uk/pub/databases/opentargets/platform/latest/output/etl/parquet/mechanismOfAction/"],
-    "molecules": ["opentarget/molecule", "https://ftp.ebi.ac.uk/pub/databases/opentargets/platform/latest/output/etl/parquet/molecule/"],
-    "mousePhenotypes": ["opentarget/mousePhenotypes", "https://ftp.ebi.ac.uk/pub/databases/opentargets/platform/latest/output/etl/parquet/mousePhenotypes/"],
-    "targets": ["opentarget/targets","https://ftp.ebi.ac.uk/pub/databases/opentargets/platform/latest/output/etl/parquet/targets/"],
-    "interactions": ["opentarget/interactions","https://ftp.ebi.ac.uk/pub/databases/opentargets/platform/latest/output/etl/parquet/interaction/"],
-    "baseExpressions": ["opentarget/baseExpressions","https://ftp.ebi.ac.uk/pub/databases/opentargets/platform/latest/output/etl/parquet/baselineExpression/"],
-    "pathways": ["opentarget/pathways","https://ftp.ebi.ac.uk/pub/databases/opentargets/platform/latest/output/etl/parquet/evidence/sourceId=reactome/"],
+    "diseases": ["opentarget/diseases", f"{OPEN_TARGETS_URL}/output/etl/parquet/diseases/"],
+    "fda": ["opentarget/fda", f"{OPEN_TARGETS_URL}/output/etl/parquet/fda/significantAdverseDrugReactions/"],
+    "mechanismOfAction": ["opentarget/mechanismOfAction", f"{OPEN_TARGETS_URL}/output/etl/parquet/mechanismOfAction/"],
+    "molecules": ["opentarget/molecule", f"{OPEN_TARGETS_URL}/output/etl/parquet/molecule/"],
+    "mousePhenotypes": ["opentarget/mousePhenotypes", f"{OPEN_TARGETS_URL}/output/etl/parquet/mousePhenotypes/"],
+    "targets": ["opentarget/targets", f"{OPEN_TARGETS_URL}/output/etl/parquet/targets/"],
+    "interactions": ["opentarget/interactions", f"{OPEN_TARGETS_URL}/output/etl/parquet/interaction/"],
+    "baseExpressions": ["opentarget/baseExpressions", f"{OPEN_TARGETS_URL}/output/etl/parquet/baselineExpression/"],
+    "pathways": ["opentarget/pathways", f"{OPEN_TARGETS_URL}/output/etl/parquet/evidence/sourceId=reactome/"],
     #"gwasTraitProfile": ["opentarget/gwasTraitProfile","https://ftp.ebi.ac.uk/pub/databases/opentargets/genetics/latest/d2v2g/"]
 }
 
-def get_datasets():
+# Download the datasets. With a feed (see DownloadFeed), each parquet file is handed to the ingest as soon as it is
+# complete, and the data types listed in 'first' are downloaded before the others.
+def get_datasets(feed=None, first=()):
     # Print the initial message when the program starts
     print("Starting the program...")
 
@@ -62,16 +88,13 @@ def get_datasets():
         # Get the latest data version from the downloaded newplatform.conf file
         latest_data_date = get_open_targets_version_from_file("newplatform.conf")
         print(f"Latest data version: {latest_data_date}")
-        # Get the number of CPU cores available
-        core_count = os.cpu_count()
         # If the latest data is newer than the current data, or the current data version is unknown, update the data
         if current_data_date is None or latest_data_date > current_data_date:
             print("Files being updated")
             # Delete existing parquet files before downloading new ones
             delete_existing_file()
             # Download new data
-            for key, values in paths.items():
-                get_datatype(key, values[0], values[1], max_retries=3, delay=5, max_workers=core_count)
+            download_datasets(paths, feed=feed, first=first)
 
         # If the current open targets files are up to date, validate the existing files
         else:
@@ -81,114 +104,359 @@ def get_datasets():
             if os.path.exists(new_platform_conf_path):
                 os.remove(new_platform_conf_path)
             print("Files are already up to date")
-            for key, values in paths.items():
-                get_datatype(key, values[0], values[1], max_retries=3, delay=5, max_workers=core_count)
+            download_datasets(paths, feed=feed, first=first)
 
     except Exception as e:
         print("Couldn't validate latest open targets version and update data." + str(e))
+    finally:
+        # The ingest reads the files left on disk for the data types that were not downloaded
+        if feed is not None:
+            feed.close()
+
+
+
+# HTTP session of the current download thread. Each thread keeps its session, and the keep-alive connections of its
+# pool, for all the files it downloads.
+sessions = threading.local()
+
+def get_session():
+    if not hasattr(sessions, 'session'):
+        session = requests.Session()
+        session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        sessions.session = session
+    return sessions.session
+
+
+# Download every data type of the paths dictionary with a single pool of max_workers threads (DOWNLOAD_WORKERS by
+# default): the file listings of the data types are fetched first, then all their files are verified and the missing,
+# stale or corrupt ones downloaded (see sync_file), whatever their data type, as threads become free. The files of the
+# data types whose local directory is named in 'first' are queued before the others. output_root is the directory the
+# local paths are relative to (the directory of this script by default), manifest_path the download manifest
+# (DOWNLOAD_MANIFEST by default). Each listing and completed file is passed to the feed, if any.
+# Prints and returns the throughput report (see print_download_report).
+def download_datasets(paths, max_workers=None, output_root=None, manifest_path=None, feed=None, first=()):
+    max_workers = max_workers or DOWNLOAD_WORKERS
+    output_root = output_root or os.path.dirname(os.path.abspath(__file__))
+    manifest_path = manifest_path or DOWNLOAD_MANIFEST
+    manifest = load_download_manifest(manifest_path)
+    start = time.perf_counter()
+    report = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="download") as executor:
+        listings = {name: executor.submit(list_datatype_files, name, os.path.join(output_root, project_path), ot_path)
+                    for name, (project_path, ot_path) in paths.items()}
+
+        # Prepare the download tasks of every data type, the ones of the 'first' data types at the front of the queue
+        futures = {}
+        report.update((name, {'files': 0, 'present': 0, 'downloaded': 0, 'refreshed': 0, 'failed': 0, 'bytes': 0,
+                              'resumed_bytes': 0, 'seconds': 0}) for name in paths)
+        for name in sorted(listings, key=lambda name: os.path.basename(paths[name][0]) not in first):
+            try:
+                links, output_dir = listings[name].result()
+            except Exception as e:
+                print(f"Downloading {name} files error: {e}")
+                report[name]['failed'] = 1
+                if feed is not None:
+                    feed.list_files(os.path.join(output_root, paths[name][0]), None)
+                continue
+            report[name]['files'] = len(links)
+            if feed is not None:
+                feed.list_files(output_dir, [os.path.basename(link) for link in links])
+            for link in links:
+                output_file = os.path.join(output_dir, os.path.basename(link))
+                key = os.path.relpath(output_file, output_root)
+                futures[executor.submit(sync_file, link, output_file, manifest.get(key))] = (name, key)
+
+        # Print the progress as the files are verified or downloaded, in any order
+        for completed, future in enumerate(as_completed(futures), start=1):
+            name, key = futures[future]
+            result = future.result()
+            stats = report[name]
+            stats['bytes'] += result['bytes']
+            stats['resumed_bytes'] += result['resumed_bytes']
+            stats['seconds'] = max(stats['seconds'], time.perf_counter() - start)
+            filename = os.path.basename(result['file'])
+            if feed is not None:
+                feed.file_done(result['file'])
+            if result['state'] == 'present':
+                stats['present'] += 1
+                if result['remote'] is not None:
+                    manifest[key] = result['remote']
+                continue
+            if result['success']:
+                stats['downloaded' if result['state'] == 'missing' else 'refreshed'] += 1
+                manifest[key] = result['remote']
+                state = "" if result['state'] == 'missing' else f" ({result['state']})"
+                print(f"[{completed}/{len(futures)}] Downloaded {name} {filename}{state}")
+            else:
+                stats['failed'] += 1
+                print(f"[{completed}/{len(futures)}] Failed to download {name} {filename} after {DOWNLOAD_RETRIES} retries.")
+
+    save_download_manifest(manifest_path, manifest)
+    print_download_report(report, time.perf_counter() - start)
+    return report
+
+
+# Files of a download handed to the ingest as they complete, so the ingest of a data type doesn't wait for the whole
+# download. download_datasets declares the files listed for each data type and reports each file once it is complete
+# (or failed, leaving the previous file if any), and get_datasets closes the feed when it is done. The ingest iterates
+# the files of a data type directory with files(), which waits for the next file until all of them are complete.
+class DownloadFeed:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.started = threading.Event()
+        # Data type directory name -> names of the files listed on the server, None if the listing failed
+        self.listed = {}
+        # Data type directory name -> names of the files completed, in order
+        self.completed = {}
+        self.closed = False
+
+    def list_files(self, output_dir, files):
+        with self.condition:
+            self.listed[os.path.basename(output_dir)] = files
+            self.condition.notify_all()
+        self.started.set()
+
+    def file_done(self, output_file):
+        with self.condition:
+            self.completed.setdefault(os.path.basename(os.path.dirname(output_file)), []).append(os.path.basename(output_file))
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.started.set()
+
+    # Wait until the first data type is listed or the download is over: platform.conf names the data version of the
+    # files by then
+    def wait_started(self):
+        self.started.wait()
+
+    def wait_closed(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed)
+
+    # Whether every file of a data type is complete. A data type that couldn't be listed has nothing to wait for, one
+    # that isn't downloaded is complete once the download is over.
+    def is_complete(self, data_type):
+        if self.closed or (data_type in self.listed and self.listed[data_type] is None):
+            return True
+        if data_type not in self.listed:
+            return False
+        return len(self.completed.get(data_type, [])) >= len(self.listed[data_type])
+
+    # Number of files listed and completed so far, for every data type
+    def progress(self):
+        with self.condition:
+            return (sum(len(files) for files in self.listed.values() if files is not None),
+                    sum(len(files) for files in self.completed.values()))
+
+    # Number of files of a data type directory still downloading, infinite while its files are not listed
+    def remaining(self, data_type_path):
+        data_type = os.path.basename(data_type_path)
+        with self.condition:
+            if self.is_complete(data_type):
+                return 0
+            if self.listed.get(data_type) is None:
+                return float('inf')
+            return len(self.listed[data_type]) - len(self.completed.get(data_type, []))
+
+    # Yield the names of the parquet files of a data type directory as they are completed. A failed download yields
+    # the previous file, if any. When the data type couldn't be listed the files found on disk are yielded at the end.
+    def files(self, data_type_path):
+        data_type = os.path.basename(data_type_path)
+        yielded = set()
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.completed.get(data_type, [])) > len(yielded)
+                                        or self.is_complete(data_type))
+                ready = [file for file in self.completed.get(data_type, []) if file not in yielded]
+                complete = self.is_complete(data_type)
+            for file in ready:
+                yielded.add(file)
+                if os.path.exists(os.path.join(data_type_path, file)):
+                    yield file
+            if complete and not ready:
+                break
+        if self.listed.get(data_type) is None:
+            for file in sorted(os.listdir(data_type_path)):
+                if file.endswith(".parquet") and file not in yielded:
+                    yield file
 
 
-
-def download_file(link, output_file, max_retries=3, delay=5):
-    # Download the specified file with a retry mechanism
+# Download manifest: the size and Last-Modified date on the server of every file downloaded, by path relative to the
+# directory of this script
+def load_download_manifest(manifest_path):
+    try:
+        with open(manifest_path, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        print(f"Ignoring unreadable download manifest: {e}")
+        return {}
+
+def save_download_manifest(manifest_path, manifest):
+    with open(manifest_path + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+# Verify a file against the server and its download manifest entry, and download it unless it is complete and up to
+# date (see local_file_state). Returns the download result (see download_file) with the state the file was found in,
+# and the size and Last-Modified date to record in the manifest under 'remote'.
+def sync_file(link, output_file, entry):
+    remote = remote_file_info(link)
+    state = local_file_state(output_file, entry, remote)
+    if state == 'present':
+        # A file downloaded before the manifest existed is recorded as it is on the server
+        return {'file': output_file, 'state': state, 'success': True, 'bytes': 0, 'resumed_bytes': 0,
+                'remote': entry or remote}
+    if state == 'stale' and os.path.exists(output_file + ".part"):
+        # The partial file may belong to the previous version of the file
+        os.remove(output_file + ".part")
+    result = download_file(link, output_file)
+    result['state'] = state
+    result['remote'] = remote or {'size': os.path.getsize(output_file) if result['success'] else None,
+                                  'last_modified': None}
+    return result
+
+# Size and Last-Modified date of a file on the server, from a HEAD request. None when the request fails.
+def remote_file_info(link):
+    try:
+        response = get_session().head(link, timeout=DOWNLOAD_TIMEOUT, allow_redirects=True)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"Could not check {link} on the server: {e}")
+        return None
+    size = response.headers.get('Content-Length')
+    return {'size': int(size) if size is not None else None, 'last_modified': response.headers.get('Last-Modified')}
+
+# State of a local file: 'missing', 'stale' when the file changed on the server since it was downloaded, 'corrupt'
+# when its size doesn't match the server's or the manifest's or its parquet footer can't be read, 'present' otherwise.
+# Without server information (remote is None) a local file is only checked against the manifest and its footer.
+def local_file_state(output_file, entry, remote):
+    if not os.path.exists(output_file):
+        return 'missing'
+    if remote is not None and entry is not None and \
+            (entry['size'], entry['last_modified']) != (remote['size'], remote['last_modified']):
+        return 'stale'
+    size = os.path.getsize(output_file)
+    if remote is not None and remote['size'] is not None and size != remote['size']:
+        return 'corrupt'
+    if entry is not None and entry['size'] is not None and size != entry['size']:
+        return 'corrupt'
+    if not valid_parquet_file(output_file):
+        return 'corrupt'
+    return 'present'
+
+# Check that a parquet file is complete: its footer, at the end of the file, can be read
+def valid_parquet_file(path):
+    try:
+        pq.read_metadata(path)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+# Get the links of the parquet files of a data type from the HTML listing of its Open Targets directory, and create
+# its local directory. Returns the links and the local directory.
+def list_datatype_files(name, output_dir, ot_path):
+    print(f"Starting to download {name} files...")
+    # Create the output directory if it doesn't exist
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Remove any leftover .wget files from previous runs
+    for file in os.listdir(output_dir):
+        if file.endswith(".wget"):
+            os.remove(os.path.join(output_dir, file))
+
+    response = get_session().get(ot_path, timeout=DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+
+    # Extract the file links from the HTML listing
+    links = []
+    for line in response.text.splitlines():
+        if 'href' in line:
+            start = line.find('href="') + 6
+            end = line.find('"', start)
+            link = line[start:end]
+            if link.endswith('.parquet'):
+                links.append(ot_path + link)
+    return links, output_dir
+
+
+# Download a file to '<output_file>.part' and rename it once complete. A download failing part way is retried from the
+# end of the partial file with a Range request, as is the partial file of an interrupted run. A server ignoring the
+# Range header sends the whole file, which then replaces the partial one.
+# Returns the file, whether it was downloaded, and the bytes downloaded and resumed (already on disk).
+def download_file(link, output_file, max_retries=None, delay=None):
+    max_retries = max_retries or DOWNLOAD_RETRIES
+    delay = DOWNLOAD_RETRY_DELAY if delay is None else delay
+    part_file = output_file + ".part"
+    result = {'file': output_file, 'success': False, 'bytes': 0, 'resumed_bytes': 0}
     retries = 0
     while retries < max_retries:
         try:
-            wget.download(link, out=output_file)
-            return True
-        except Exception as e:
+            offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+            headers = {'Range': f"bytes={offset}-"} if offset else {}
+            with get_session().get(link, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                if response.status_code == 416:
+                    # The partial file is not a prefix of the file on the server anymore, it is removed and the file
+                    # is downloaded again from the start by the next attempt
+                    if os.path.exists(part_file):
+                        os.remove(part_file)
+                    raise IOError(f"the range of the partial file is not satisfiable ({offset} bytes)")
+                response.raise_for_status()
+                if offset and response.status_code == 206:
+                    result['resumed_bytes'] += offset
+                    mode = 'ab'
+                else:
+                    offset = 0
+                    mode = 'wb'
+                with open(part_file, mode) as file:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        file.write(chunk)
+                        result['bytes'] += len(chunk)
+                # A connection closed early ends the response without an error, the rest of the file is requested
+                # again from where it stopped
+                expected = response.headers.get('Content-Length')
+                if expected is not None and os.path.getsize(part_file) < offset + int(expected):
+                    raise IOError(f"connection closed after {os.path.getsize(part_file)} of {offset + int(expected)} bytes")
+            if output_file.endswith(".parquet") and not valid_parquet_file(part_file):
+                os.remove(part_file)
+                raise IOError("the downloaded file has no valid parquet footer")
+            os.replace(part_file, output_file)
+            result['success'] = True
+            return result
+        except (requests.RequestException, OSError) as e:
             retries += 1
             if retries == max_retries:
                 print(f"Failed to download {link} due to error: {e}")
-                return False
             else:
                 print(f"Retrying {link} after error: {e}")
                 time.sleep(delay)
+    return result
 
 
-def get_datatype(name, project_path, ot_path, max_retries=3, delay=5, max_workers=5):
-    try:
-        print(f"Starting to download {name} files...")
-
-        url = ot_path
-
-        # Get the current script's directory instead of the working directory
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        output_dir = os.path.join(current_dir, project_path)
-
-         # Create the output directory if it doesn't exist
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        
-        # Remove any leftover .wget files from previous runs
-        for file in os.listdir(output_dir):
-            if file.endswith(".wget"):
-                os.remove(os.path.join(output_dir, file))
-
-        # Download the HTML file containing the list of files to download
-        html_content = wget.download(url, out=output_dir, bar=None)
-
-        # Extract the file links from the HTML file
-        links = []
-        with open(os.path.join(output_dir, html_content), 'r') as f:
-            for line in f:
-                if 'href' in line:
-                    start = line.find('href="') + 6
-                    end = line.find('"', start)
-                    link = line[start:end]
-                    if link.endswith('.parquet'):
-                        links.append(url + link)
-
-       # Prepare the download tasks for each file link
-        tasks = []
-        existing_files_count = 0
-        for n, link in enumerate(links):
-            filename = os.path.basename(link)
-            output_file = os.path.join(output_dir, filename)
-            if os.path.exists(output_file):
-                existing_files_count += 1
-            else:
-                tasks.append((link, output_file, max_retries, delay))
-
-        if existing_files_count == len(links):
-            print(f"All {name} files are present. Skipping...")
-        elif existing_files_count > 0:
-            print(f"{existing_files_count}/{len(links)} {name} files are present. Downloading missing files...")
-
-
-        # Initialize the count of completed files
-        completed_files = 0
-        # Calculate the total number of files to download
-        total_files = len(tasks)
-        # Create a ThreadPoolExecutor to download files in parallel
-        # The 'max_workers' parameter determines the maximum number of threads that can be used concurrently
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit each download task to the ThreadPoolExecutor
-            # A future object represents the result of a computation that may not have completed yet
-            # Create a dictionary (futures) that maps each future to its corresponding task (input arguments)
-            futures = {executor.submit(download_file, *task): task for task in tasks}
-            # The 'as_completed' function returns an iterator that yields futures as they complete
-            for future in as_completed(futures):
-                # Get the input arguments (task) of the completed future
-                task = futures[future]
-                # Unpack the task arguments to get the link and output_file
-                link, output_file, _, _ = task
-                # Get the result (True or False) of the completed future
-                success = future.result()
-                # Increment the completed files counter
-                completed_files += 1
-                # Extract the filename from the link
-                filename = os.path.basename(link)
-                # Print the progress and status based on the success of the download
-                if success:
-                    print(f"\n[{completed_files}/{total_files}] Downloaded {name} {filename}")
-                else:
-                    print(f"\n[{completed_files}/{total_files}] Failed to download {name} {filename} after {max_retries} retries.")
+# Print the files, megabytes and throughput of each data type and of the whole download. The throughput of a data
+# type is measured until its last file completed, as the data types are downloaded at the same time.
+def print_download_report(report, elapsed):
+    print(f"\n{'Data type':20s} {'files':>6s} {'present':>8s} {'refreshed':>9s} {'failed':>7s} {'MB':>9s} "
+          f"{'resumed MB':>10s} {'seconds':>8s} {'MB/s':>7s}")
+    for name, stats in report.items():
+        megabytes = stats['bytes'] / 1024 / 1024
+        print(f"{name:20s} {stats['files']:6d} {stats['present']:8d} {stats['refreshed']:9d} {stats['failed']:7d} "
+              f"{megabytes:9.1f} {stats['resumed_bytes'] / 1024 / 1024:10.1f} {stats['seconds']:8.1f} "
+              f"{megabytes / stats['seconds'] if stats['seconds'] else 0:7.1f}")
+    total = sum(stats['bytes'] for stats in report.values()) / 1024 / 1024
+    downloaded = sum(stats['downloaded'] + stats['refreshed'] for stats in report.values())
+    print(f"Downloaded {downloaded} files, {total:.1f} MB in "
+          f"{elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} MB/s)")
 
-        print("Files downloaded successfully!")
-
-    except Exception as e:
-        print("Downloading files error: " + str(e))
 
 def get_open_targets_version_from_file(file_name):
     try:
@@ -229,38 +497,38 @@ def download_latest_conf_file():
     try:
 
         # Specify the URL
-        url = 'https://ftp.ebi.ac.uk/pub/databases/opentargets/platform/latest/conf/'
+        url = f"{OPEN_TARGETS_URL}/conf/"
 
         # Get the current script's directory instead of the working directory
         output_dir = os.path.dirname(os.path.abspath(__file__))
 
-        # Use wget to retrieve the HTML content of the page
-        html_content = wget.download(url, out=output_dir)
+        # Retrieve the HTML content of the page
+        response = get_session().get(url, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
 
         # Extract the link to the file on the page
         link = ''
-        with open(os.path.join(output_dir, html_content), 'r') as f:
-            for line in f:
-                if 'href' in line:
-                    start = line.find('href="') + 6
-                    end = line.find('"', start)
-                    link = line[start:end]
-                    if link.endswith('.conf'):
-                        link = url + link
-                        break
+        for line in response.text.splitlines():
+            if 'href' in line:
+                start = line.find('href="') + 6
+                end = line.find('"', start)
+                link = line[start:end]
+                if link.endswith('.conf'):
+                    link = url + link
+                    break
 
         # Download the file
         filename = os.path.basename(link)
         output_file = os.path.join(output_dir, "new" + filename)
-        wget.download(link, out=output_file)
+        response = get_session().get(link, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        with open(output_file, 'wb') as file:
+            file.write(response.content)
 
         #shutil.move(output_file, os.path.join(output_dir, 'platform.conf'))
 
         print(f"File {output_file} -- saved!")
 
-        # Delete the HTML file
-        os.remove(os.path.join(output_dir, html_content))
-
     except Exception as e:
         print("Downloading file error: " + str(e))
 
@@ -0,0 +1,113 @@
+import argparse
+import os
+import time
+
+try:
+    import parse_datasets
+except ImportError:
+    from datasets import parse_datasets
+
+"""
+Ingest scaling benchmarks
+
+- 'python ingest_benchmark.py --workers 1,2,4,8' runs every query generator over the input directory without writing
+  to Neo4j, once for each number of worker processes (INGEST_WORKERS), and prints how the decode and transform
+  throughput scales with it.
+- 'python ingest_benchmark.py --edge-writers 1,2,4,8' writes the relationships of the edge generators into the Neo4j
+  database of NEO4J_DOCKER_URL once for each number of edge writers (INGEST_EDGE_WRITERS) and prints the write
+  throughput. The nodes must already be loaded.
+
+The input directory is the 'opentarget' folder by default, a folder written by synthetic_datasets.py can be given
+with --input-dir.
+"""
+
+
+# Run every query generator over the input directory without writing to Neo4j, once for each worker count, and print
+# how the decode and transform throughput scales with the number of worker processes
+def benchmark_workers(input_dir, worker_counts):
+    if parse_datasets.data_version is None:
+        parse_datasets.data_version = "benchmark"
+    # Measure the decoding, not the ingest cache
+    parse_datasets.INGEST_CACHE = False
+
+    results = []
+    for workers in worker_counts:
+        counts = {'batches': 0, 'rows': 0}
+
+        def count_rows(queries):
+            counts['batches'] += 1
+            counts['rows'] += sum(len(params.get('data', [])) for _, params, _ in queries)
+
+        start = time.perf_counter()
+        parse_datasets.schedule_query_generators(input_dir, 1, workers=workers, writer=count_rows)
+        elapsed = time.perf_counter() - start
+        results.append((workers, counts['batches'], counts['rows'], elapsed))
+
+    print("\nworkers  batches       rows   seconds    rows/s  speedup")
+    for workers, batches, rows, elapsed in results:
+        print(f"{workers:7d} {batches:8d} {rows:10d} {elapsed:9.2f} {rows / elapsed:9.0f} {results[0][3] / elapsed:8.2f}")
+
+
+# Write the relationships of the edge generators into Neo4j once for each number of edge writers and print the write
+# throughput. The relationships are deleted before each run, so every run creates them, and the last run leaves them
+# loaded.
+def benchmark_edge_writers(input_dir, writer_counts):
+    parse_datasets.ensure_neo4j_connection()
+    parse_datasets.set_dataset_name()
+    tasks = [task for task in parse_datasets.find_ingest_tasks(input_dir)
+             if getattr(task['query_generator'], 'requires', [])]
+
+    # Find the relationship types and datasets written without writing them
+    written = set()
+    def record_relationships(queries):
+        written.update((writes['relationship'], params['dataset']) for _, params, writes in queries
+                       if 'relationship' in writes)
+    for task in tasks:
+        parse_datasets.generate_queries(task['data_type'], task['data_type_path'], task['query_generator'],
+                                        writer=record_relationships)
+
+    results = []
+    for writers in writer_counts:
+        for relationship_type, dataset in sorted(written):
+            parse_datasets.db.cypher_query(f"""
+            CALL apoc.periodic.iterate(
+                'MATCH ()-[rel:{relationship_type} {{dataset: $dataset}}]->() RETURN rel',
+                'DELETE rel',
+                {{params: {{dataset: $dataset}}, batchSize: 10000}}
+            )
+            """, params={'dataset': dataset})
+
+        # Only the time spent writing is counted, not the decoding
+        counts = {'rows': 0, 'seconds': 0}
+        def timed_writer(queries):
+            start = time.perf_counter()
+            parse_datasets.execute_queries(queries, edge_writers=writers)
+            counts['seconds'] += time.perf_counter() - start
+            counts['rows'] += sum(len(params.get('data', [])) for _, params, writes in queries
+                                  if 'relationship' in writes)
+        for task in tasks:
+            parse_datasets.generate_queries(task['data_type'], task['data_type_path'], task['query_generator'],
+                                            writer=timed_writer)
+        results.append((writers, counts['rows'], counts['seconds']))
+
+    print("\nwriters       rows   seconds    rows/s  speedup")
+    for writers, rows, elapsed in results:
+        print(f"{writers:7d} {rows:10d} {elapsed:9.2f} {rows / elapsed:9.0f} {results[0][2] / elapsed:8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark how the ingest scales with its workers and edge writers")
+    parser.add_argument("--input-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "opentarget"),
+                        help="folder of the data type folders (default: opentarget)")
+    parser.add_argument("--workers", metavar="N,N,...",
+                        help="benchmark decoding and transformation with these worker counts")
+    parser.add_argument("--edge-writers", metavar="N,N,...",
+                        help="benchmark writing the relationships into Neo4j with these numbers of edge writers")
+    args = parser.parse_args()
+
+    if args.workers:
+        benchmark_workers(args.input_dir, [int(n) for n in args.workers.split(",")])
+    if args.edge_writers:
+        benchmark_edge_writers(args.input_dir, [int(n) for n in args.edge_writers.split(",")])
+    if not args.workers and not args.edge_writers:
+        parser.error("give --workers or --edge-writers")
@@ -0,0 +1,170 @@
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+"""
+Ingest cache
+
+The queries the query generators of parse_datasets.py produced from each parquet file, kept so a reload of unchanged
+files skips decoding and transforming them. Settings, which can be overridden with environment variables:
+INGEST_CACHE_DIR: folder of the cache entries
+INGEST_CACHE_MB, INGEST_CACHE_DAYS: the least recently used entries are removed above this size, and the entries not
+used for this many days
+The cache is used unless INGEST_CACHE (in parse_datasets.py) is false.
+"""
+
+INGEST_CACHE_DIR = os.getenv("INGEST_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest_cache"))
+INGEST_CACHE_MB = int(os.getenv("INGEST_CACHE_MB", 4096))
+INGEST_CACHE_DAYS = float(os.getenv("INGEST_CACHE_DAYS", 30))
+
+
+# Ingest cache: the queries a query generator produced from a parquet file, stored in INGEST_CACHE_DIR so a reload of
+# unchanged files skips decoding and transforming them, e.g. after the Neo4j database was cleared. Each entry is a
+# directory named after the hash of the file contents, the query generator version and the data version. It holds
+# index.json, with the queries and parameters of every batch, and an Arrow IPC file with the 'data' entries of each
+# query, which is memory-mapped when the entry is read. An entry is only added once its file is fully transformed.
+INGEST_CACHE_FORMAT = 1
+
+# Path of the cache entry of a file, given the hash of its contents, read by a query generator for a data version
+def ingest_cache_entry(file_hash, query_generator, data_version):
+    key = f"{INGEST_CACHE_FORMAT} {query_generator.__name__} {generator_version(query_generator)} {data_version} " \
+          f"{file_hash}"
+    return os.path.join(INGEST_CACHE_DIR, hashlib.sha256(key.encode()).hexdigest()[:32])
+
+# Version of a query generator: a hash of its source and of the source of every function of its module it calls,
+# directly or not, and of the module values it reads (NODE_KEYS, data_version...). Changing the generator or any helper
+# it uses gives new cache entries.
+def generator_version(query_generator):
+    digest = hashlib.sha256()
+    seen = set()
+    module_globals = query_generator.__globals__
+
+    def add(function):
+        seen.add(function.__name__)
+        digest.update(inspect.getsource(function).encode())
+        for name in sorted(code_names(function.__code__)):
+            value = module_globals.get(name)
+            if inspect.isfunction(value) and value.__module__ == query_generator.__module__:
+                if name not in seen:
+                    add(value)
+            elif isinstance(value, (str, int, float, dict, list, tuple)):
+                digest.update(f"{name}={value!r}".encode())
+
+    add(query_generator)
+    return digest.hexdigest()[:16]
+
+# Global names used by a code object and the functions and comprehensions defined in it
+def code_names(code):
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if inspect.iscode(constant):
+            names |= code_names(constant)
+    return names
+
+# Start a new cache entry, written to a temporary directory until commit_cache_writer
+def new_cache_writer(entry):
+    path = f"{entry}.tmp-{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(path, exist_ok=True)
+    return {'entry': entry, 'path': path, 'batches': [], 'failed': False}
+
+# Add the queries of a batch to a cache entry. An entry whose data can't be stored in Arrow (e.g. a column mixing
+# types) is given up, the file is then transformed again next time.
+def cache_queries(cache, rows_in, queries):
+    if cache['failed']:
+        return
+    batch = {'rows_in': rows_in, 'queries': []}
+    try:
+        for query, params, writes in queries:
+            data_file = None
+            if 'data' in params:
+                data_file = f"{len(cache['batches'])}-{len(batch['queries'])}.arrow"
+                table = pa.Table.from_pylist(params['data'])
+                with ipc.new_file(os.path.join(cache['path'], data_file), table.schema) as writer:
+                    writer.write_table(table)
+            params = {key: value for key, value in params.items() if key != 'data'}
+            batch['queries'].append({'query': query, 'params': params, 'writes': writes, 'data': data_file})
+    except (pa.ArrowException, OSError) as e:
+        print(f"Not caching {os.path.basename(cache['entry'])}: {e}")
+        cache['failed'] = True
+        return
+    cache['batches'].append(batch)
+
+def commit_cache_writer(cache):
+    if cache['failed']:
+        remove_cache_entry(cache['path'])
+        return
+    with open(os.path.join(cache['path'], "index.json"), "w") as file:
+        json.dump(cache['batches'], file)
+    try:
+        os.replace(cache['path'], cache['entry'])
+    except OSError:
+        # Another worker cached the same file first
+        remove_cache_entry(cache['path'])
+
+# Read the batches of a cache entry, yielding the rows read and the queries of each batch. The Arrow files are
+# memory-mapped, so only the entries converted to Cypher parameters are held in memory.
+def read_cached_queries(entry, metrics):
+    start = time.perf_counter()
+    with open(os.path.join(entry, "index.json")) as file:
+        batches = json.load(file)
+    os.utime(entry)
+    for batch in batches:
+        queries = []
+        for cached in batch['queries']:
+            writes = {key: tuple(value) if key in ('start', 'end') else value for key, value in cached['writes'].items()}
+            params = dict(cached['params'])
+            if cached['data'] is not None:
+                with pa.memory_map(os.path.join(entry, cached['data'])) as source:
+                    params['data'] = table_rows(ipc.open_file(source).read_all())
+            queries.append((cached['query'], params, writes))
+        metrics['read_seconds'] += time.perf_counter() - start
+        yield batch['rows_in'], queries
+        start = time.perf_counter()
+
+# Same as table.to_pylist(), converting the string columns and the numeric columns without nulls through numpy, which
+# is several times faster
+def table_rows(table):
+    columns = []
+    for column in table.combine_chunks().columns:
+        column = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        if pa.types.is_string(column.type) or (column.null_count == 0 and (
+                pa.types.is_integer(column.type) or pa.types.is_floating(column.type) or pa.types.is_boolean(column.type))):
+            columns.append(column.to_numpy(zero_copy_only=False).tolist())
+        else:
+            columns.append(column.to_pylist())
+    return [dict(zip(table.column_names, row)) for row in zip(*columns)]
+
+def remove_cache_entry(path):
+    for file in os.listdir(path):
+        os.remove(os.path.join(path, file))
+    os.rmdir(path)
+
+# Remove the cache entries not used for INGEST_CACHE_DAYS, then the least recently used ones until the cache is
+# within INGEST_CACHE_MB. Entries being written are left alone.
+def evict_ingest_cache():
+    if not os.path.isdir(INGEST_CACHE_DIR):
+        return
+    entries = []
+    for name in os.listdir(INGEST_CACHE_DIR):
+        path = os.path.join(INGEST_CACHE_DIR, name)
+        if '.tmp-' in name or not os.path.isdir(path):
+            continue
+        size = sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+        entries.append((os.path.getmtime(path), size, path))
+
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for used, size, path in entries:
+        if time.time() - used < INGEST_CACHE_DAYS * 86400 and total <= INGEST_CACHE_MB * 1024 * 1024:
+            break
+        remove_cache_entry(path)
+        total -= size
+        removed += 1
+    if removed:
+        print(f"Removed {removed} ingest cache entries, {total / 1024 / 1024:.0f} MB left")
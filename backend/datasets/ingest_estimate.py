@@ -0,0 +1,146 @@
+import json
+import os
+
+try:
+    from parquet_reader import PAYLOAD_EXPANSION, parquet_footer
+except ImportError:
+    from datasets.parquet_reader import PAYLOAD_EXPANSION, parquet_footer
+
+"""
+Ingest estimate: 'python parse_datasets.py --estimate' (make estimate-ingest) estimates the duration, peak memory,
+entries and payload of a reload without decoding any data, from the parquet footers of every input file and a cost
+model of each query generator calibrated from the file metrics of the last ingest report.
+"""
+
+
+# Cost model of each query generator, calibrated from the file metrics of an ingest report. Rates per generator:
+# - kept: rows passed to the generator per parquet row (its row filter)
+# - entries: entries generated per row passed
+# - entry_bytes: payload bytes per entry
+# - transform_rate: seconds to read and transform a decoded byte, from the files not read from the ingest cache
+# - write_rate: seconds to write an entry, from the files written to Neo4j
+# A rate is None when the report has no file to calibrate it on.
+def ingest_cost_models(report):
+    totals = {}
+    for metrics in report.get('files', []):
+        # Reports written before the parquet figures were recorded can't be calibrated on
+        if not metrics.get('file_rows'):
+            continue
+        total = totals.setdefault(metrics['generator'], dict.fromkeys([
+            'file_rows', 'rows_in', 'rows_out', 'payload_bytes', 'decoded_bytes', 'transform_seconds',
+            'written_rows', 'write_seconds'], 0))
+        for key in ('file_rows', 'rows_in', 'rows_out', 'payload_bytes'):
+            total[key] += metrics[key]
+        if metrics.get('cache') != 'hit':
+            total['decoded_bytes'] += metrics['decoded_bytes']
+            total['transform_seconds'] += metrics['read_seconds'] + metrics['transform_seconds']
+        if metrics['batches']:
+            total['written_rows'] += metrics['rows_out']
+            total['write_seconds'] += metrics['write_seconds']
+
+    def rate(value, per):
+        return value / per if per else None
+
+    return {
+        generator: {
+            'kept': rate(total['rows_in'], total['file_rows']),
+            'entries': rate(total['rows_out'], total['rows_in']),
+            'entry_bytes': rate(total['payload_bytes'], total['rows_out']),
+            'transform_rate': rate(total['transform_seconds'], total['decoded_bytes']),
+            'write_rate': rate(total['write_seconds'], total['written_rows']),
+        }
+        for generator, total in totals.items()
+    }
+
+
+# Dry run of an ingest: estimate the entries, payload, peak memory and duration of every ingest task (see
+# find_ingest_tasks in parse_datasets.py) from the parquet footers of its files and the cost models calibrated from
+# the ingest report at report_path (see ingest_cost_models), without decoding any data or connecting to Neo4j. The
+# entries of the node generators are the nodes they merge, the entries of the edge generators the relationships. The
+# memory of a generator is the largest record batch of memory_mb it holds, with its Cypher parameters (see
+# stream_batch_rows), times the batches held at the same time with 'workers', 'concurrency' and up to queue_size
+# batches waiting to be written. The duration is the sum of the generators' read, transform and write time, the read
+# and transform time divided between the worker processes. Returns the estimate of each generator.
+def estimate_ingest(tasks, report_path, memory_mb, workers=1, concurrency=1, stream=True, queue_size=4):
+    try:
+        with open(report_path) as file:
+            report = json.load(file)
+    except (FileNotFoundError, ValueError):
+        print(f"No ingest report in {report_path}, only the parquet figures are estimated")
+        report = {}
+    models = ingest_cost_models(report)
+
+    estimates = []
+    for task in tasks:
+        query_generator = task['query_generator']
+        footers = [parquet_footer(os.path.join(task['data_type_path'], file), memory_mb, query_generator)
+                   for file in sorted(os.listdir(task['data_type_path'])) if file.endswith(".parquet")]
+        estimate = {
+            'generator': task['name'],
+            'writes': 'nodes' if getattr(query_generator, 'creates', []) else 'relationships',
+            'files': len(footers),
+            'rows': sum(footer['rows'] for footer in footers),
+            'row_groups': sum(footer['row_groups'] for footer in footers),
+            'io_bytes': sum(footer['io_bytes'] for footer in footers),
+            'decoded_bytes': sum(footer['decoded_bytes'] for footer in footers),
+            'memory_mb': max((batch_memory_mb(footer, stream) for footer in footers), default=0),
+            'entries': None, 'payload_bytes': None, 'transform_seconds': None, 'write_seconds': None,
+        }
+        model = models.get(query_generator.__name__)
+        if model is not None:
+            estimate['entries'] = round(estimate['rows'] * model['kept'] * model['entries'])
+            estimate['payload_bytes'] = round(estimate['entries'] * (model['entry_bytes'] or 0))
+            if model['transform_rate'] is not None:
+                estimate['transform_seconds'] = estimate['decoded_bytes'] * model['transform_rate'] / \
+                    max(1, min(workers, len(footers)))
+            if model['write_rate'] is not None:
+                estimate['write_seconds'] = estimate['entries'] * model['write_rate']
+        estimates.append(estimate)
+
+    print_ingest_estimate(estimates, report, workers, concurrency, queue_size)
+    return estimates
+
+
+# Memory held by a record batch of a parquet file and the Cypher parameters built from it, in MB
+def batch_memory_mb(footer, stream):
+    if footer['rows'] == 0:
+        return 0
+    rows = min(footer['rows'], footer['batch_rows']) if stream else footer['rows']
+    return rows * max(1.0, footer['decoded_bytes'] / footer['rows']) * PAYLOAD_EXPANSION / 1024 / 1024
+
+
+# Print the estimate of each generator and the totals of the ingest
+def print_ingest_estimate(estimates, report, workers, concurrency, queue_size):
+    def figure(value, scale=1, digits=0):
+        return "?" if value is None else f"{value / scale:.{digits}f}"
+
+    print(f"\n{'Query generator':64s} {'files':>5s} {'rows':>11s} {'entries':>11s} {'payload MB':>10s} "
+          f"{'memory MB':>9s} {'transform s':>11s} {'write s':>8s}")
+    for estimate in estimates:
+        print(f"{estimate['generator']:64s} {estimate['files']:5d} {estimate['rows']:11d} "
+              f"{figure(estimate['entries']):>11s} {figure(estimate['payload_bytes'], 1024 * 1024, 1):>10s} "
+              f"{estimate['memory_mb']:9.0f} {figure(estimate['transform_seconds'], 1, 1):>11s} "
+              f"{figure(estimate['write_seconds'], 1, 1):>8s}")
+
+    def total(key, writes=None):
+        values = [estimate[key] for estimate in estimates if writes is None or estimate['writes'] == writes]
+        return None if None in values else sum(values)
+
+    # Each worker process holds a batch, and up to queue_size decoded batches wait to be written
+    batches_held = concurrency * (workers + queue_size if workers > 1 else 1)
+    peak_mb = max((estimate['memory_mb'] for estimate in estimates), default=0) * batches_held
+    seconds = [total('transform_seconds'), total('write_seconds')]
+    print(f"\nInput: {sum(e['files'] for e in estimates)} files read, {total('io_bytes') / 1024 / 1024:.0f} MB "
+          f"compressed, {total('decoded_bytes') / 1024 / 1024:.0f} MB decoded")
+    print(f"Nodes: {figure(total('entries', 'nodes'))}, relationships: {figure(total('entries', 'relationships'))}, "
+          f"payload: {figure(total('payload_bytes'), 1024 * 1024)} MB")
+    print(f"Peak memory: {peak_mb:.0f} MB of record batches and parameters ({batches_held} held at a time)")
+    rss = [metrics['max_rss_mb'] for metrics in report.get('files', []) if metrics.get('max_rss_mb')]
+    if rss:
+        print(f"  the last ingest peaked at {max(rss):.0f} MB resident")
+    print(f"Duration: {figure(seconds[0], 1, 1)}s reading and transforming, {figure(seconds[1], 1, 1)}s writing, "
+          f"{figure(None if None in seconds else sum(seconds), 1, 1)}s in total with a concurrency of 1")
+    uncalibrated = [estimate['generator'] for estimate in estimates
+                    if estimate['transform_seconds'] is None or estimate['write_seconds'] is None]
+    if uncalibrated:
+        print(f"Not calibrated by the ingest report ('?'): {', '.join(uncalibrated)}")
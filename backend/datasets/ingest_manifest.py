@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import threading
+
+"""
+Ingest manifest: the parquet files loaded into Neo4j with their size, modification time and content hash, and the
+query generators that read them. It is saved next to platform.conf each time a query generator is done with a file,
+which makes it the checkpoint of the ingest: a re-ingest, or an interrupted one, only runs the query generators on
+the files they didn't read in their current version (see schedule_query_generators in parse_datasets.py).
+INGEST_MANIFEST, the path of the manifest, can be overridden with an environment variable.
+"""
+
+INGEST_MANIFEST = os.getenv("INGEST_MANIFEST", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest_manifest.json"))
+manifest_lock = threading.Lock()
+
+
+def new_ingest_manifest(data_version):
+    return {'data_version': data_version, 'files': {}}
+
+# Load the ingest manifest, None if there is none. An unreadable manifest or the manifest of another data version
+# gives an empty one, so every file is loaded again.
+def load_ingest_manifest(data_version):
+    try:
+        with open(INGEST_MANIFEST, "r") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        print(f"Ignoring unreadable ingest manifest: {e}")
+        return new_ingest_manifest(data_version)
+    if manifest.get('data_version') != data_version:
+        print(f"Ignoring ingest manifest of data version {manifest.get('data_version')}")
+        return new_ingest_manifest(data_version)
+    return manifest
+
+def save_ingest_manifest(manifest):
+    with open(INGEST_MANIFEST + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(INGEST_MANIFEST + ".tmp", INGEST_MANIFEST)
+
+# Size, modification time and SHA-256 of a file. The hash of the previous fingerprint is reused when the size and
+# modification time didn't change, so unchanged files are not read again.
+def file_fingerprint(file_path, previous=None):
+    stat = os.stat(file_path)
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if previous is not None and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime:
+        fingerprint['hash'] = previous['hash']
+        return fingerprint
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    fingerprint['hash'] = digest.hexdigest()
+    return fingerprint
+
+# Fingerprint the parquet files of the tasks' data types. Returns a dictionary of 'data type/file name' -> fingerprint.
+def fingerprint_task_files(tasks, manifest):
+    fingerprints = {}
+    for task in tasks:
+        for file in sorted(os.listdir(task['data_type_path'])):
+            key = f"{task['data_type']}/{file}"
+            if file.endswith(".parquet") and key not in fingerprints:
+                fingerprints[key] = file_fingerprint(os.path.join(task['data_type_path'], file), manifest['files'].get(key))
+    return fingerprints
+
+# Split the ingest tasks into the ones to run, whose query generator didn't read every input file in its current
+# version, and the ones to skip. The tasks to run get the list of files left to read. Prints which tasks are run or
+# skipped and why. Returns the tasks to run and the fingerprints of the input files.
+def select_changed_tasks(input_dir, tasks, manifest):
+    fingerprints = fingerprint_task_files(tasks, manifest)
+    selected = []
+    for task in tasks:
+        generator_name = task['query_generator'].__name__
+        reasons = []
+        task['files'] = []
+        task_files = [key for key in fingerprints if key.split('/')[0] == task['data_type']]
+        for key in task_files:
+            entry = manifest['files'].get(key)
+            if entry is None:
+                reasons.append(f"{key} is new")
+            elif entry['hash'] != fingerprints[key]['hash']:
+                reasons.append(f"{key} changed")
+            elif generator_name not in entry['generators']:
+                reasons.append(f"{key} was not read by it")
+            else:
+                continue
+            task['files'].append(key.split('/')[1])
+        if reasons and getattr(task['query_generator'], 'averaged_over_files', False):
+            task['files'] = [key.split('/')[1] for key in task_files]
+        if reasons:
+            more = f" and {len(reasons) - 3} more" if len(reasons) > 3 else ""
+            done = len(task_files) - len(task['files'])
+            resumed = f" ({done} files already done)" if done else ""
+            print(f"Running {task['name']}{resumed}: {', '.join(reasons[:3])}{more}")
+            selected.append(task)
+        else:
+            print(f"Skipping {task['name']}: its {len(task_files)} input files are unchanged")
+
+    forget_removed_files(input_dir, manifest)
+
+    # Keep the new modification time of the files whose content didn't change
+    for key, fingerprint in fingerprints.items():
+        entry = manifest['files'].get(key)
+        if entry is not None and entry['hash'] == fingerprint['hash']:
+            entry.update(fingerprint)
+    with manifest_lock:
+        save_ingest_manifest(manifest)
+    return selected, fingerprints
+
+# Data of the removed files stays in Neo4j, it is only dropped from the manifest
+def forget_removed_files(input_dir, manifest):
+    for key in list(manifest['files']):
+        if not os.path.exists(os.path.join(input_dir, key)):
+            print(f"{key} was removed, its data is kept in Neo4j")
+            del manifest['files'][key]
+
+# Yield the files of a task as they are downloaded, skipping the ones its query generator already read in their
+# current version according to the manifest. The downloaded files are fingerprinted once, for all their tasks.
+# The files of a generator declared with @averaged_over_files are only skipped until one of them has to be read, the
+# skipped ones are then yielded too.
+fingerprint_lock = threading.Lock()
+
+def feed_task_files(task, feed, manifest, fingerprints):
+    generator_name = task['query_generator'].__name__
+    averaged = getattr(task['query_generator'], 'averaged_over_files', False)
+    skipped = []
+    reading = False
+    for file in feed.files(task['data_type_path']):
+        if manifest is not None and not (averaged and reading):
+            key = f"{task['data_type']}/{file}"
+            with fingerprint_lock:
+                if key not in fingerprints:
+                    fingerprints[key] = file_fingerprint(os.path.join(task['data_type_path'], file),
+                                                         manifest['files'].get(key))
+            entry = manifest['files'].get(key)
+            if entry is not None and entry['hash'] == fingerprints[key]['hash'] and generator_name in entry['generators']:
+                skipped.append(file)
+                continue
+        if averaged and skipped:
+            yield from skipped
+            skipped = []
+        reading = True
+        yield file
+    if skipped:
+        print(f"Skipped {len(skipped)} files of {task['name']} already loaded")
+
+# Record a file as read by the query generator of a task (the checkpoint of the file) and save the manifest
+def record_ingested_file(manifest, task, key, fingerprints):
+    generator_name = task['query_generator'].__name__
+    with manifest_lock:
+        entry = manifest['files'].get(key)
+        if entry is None or entry['hash'] != fingerprints[key]['hash']:
+            entry = manifest['files'][key] = {**fingerprints[key], 'generators': []}
+        if generator_name not in entry['generators']:
+            entry['generators'].append(generator_name)
+        save_ingest_manifest(manifest)
+
+# Record the query generators of the tasks as having read their current files, without running them
+def record_ingest_manifest(tasks, data_version):
+    manifest = new_ingest_manifest(data_version)
+    fingerprints = fingerprint_task_files(tasks, manifest)
+    for task in tasks:
+        for key in fingerprints:
+            if key.split('/')[0] == task['data_type']:
+                record_ingested_file(manifest, task, key, fingerprints)
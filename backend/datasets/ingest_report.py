@@ -0,0 +1,127 @@
+import csv
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+"""
+Ingest report: the metrics of every file processed by the query generators of an ingest, and the start time and
+duration of each generator. It is filled by generate_queries and schedule_query_generators (see parse_datasets.py),
+and written to INGEST_REPORT at the end of an ingest. Settings, which can be overridden with environment variables:
+INGEST_REPORT: JSON file the per-generator and per-file metrics of an ingest are written to, with a CSV of the file
+metrics next to it
+INGEST_PROGRESS: print a progress line updated after each batch written
+INGEST_TRACE_MEMORY: trace the Python allocations to report the peak memory of each file (slows the ingest down)
+"""
+
+INGEST_REPORT = os.getenv("INGEST_REPORT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest_report.json"))
+INGEST_PROGRESS = os.getenv("INGEST_PROGRESS", "false").lower() == "true"
+INGEST_TRACE_MEMORY = os.getenv("INGEST_TRACE_MEMORY", "false").lower() == "true"
+
+ingest_report = {'generators': {}, 'files': []}
+ingest_report_lock = threading.Lock()
+
+# Counters of the writes of an ingest file: the batches written and failed, and the update counters of their
+# transactions
+WRITE_COUNTERS = ['batches', 'failed_batches', 'nodes_created', 'relationships_created', 'properties_set']
+
+
+def clear_ingest_report():
+    with ingest_report_lock:
+        ingest_report['generators'] = {}
+        ingest_report['files'] = []
+        ingest_report.pop('wall_seconds', None)
+
+def record_generator_timings(timings, wall_time):
+    with ingest_report_lock:
+        ingest_report['wall_seconds'] = round(wall_time, 3)
+        for name, (start, end) in timings.items():
+            ingest_report['generators'][name] = {'start_seconds': round(start, 3), 'seconds': round(end - start, 3)}
+
+# Metrics of a file processed by a query generator. The time is split into reading the parquet file, running the
+# query generator and writing its queries; rows_in is the number of rows the generator received and rows_out the
+# number of entries it generated, payload_bytes their estimated encoded size (see payload_bytes). The write counters
+# are the ones returned by the writer (see execute_queries in parse_datasets.py). With INGEST_TRACE_MEMORY
+# peak_traced_mb is the peak of the Python allocations while the file was processed, max_rss_mb is the peak resident
+# memory of the process so far.
+def new_file_metrics(data_type, generator_name, file):
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    return {
+        'data_type': data_type, 'generator': generator_name, 'file': file, 'started': time.perf_counter(),
+        'read_seconds': 0, 'transform_seconds': 0, 'write_seconds': 0, 'rows_in': 0, 'rows_out': 0,
+        'payload_bytes': 0, 'cache': None, 'file_rows': 0, 'decoded_bytes': 0, **dict.fromkeys(WRITE_COUNTERS, 0),
+    }
+
+# Complete the metrics of a file and add them to the ingest report. The metrics of a file processed by a worker
+# process are completed with the memory figures of the worker.
+def finish_file_metrics(metrics, worker_metrics=None, report=True):
+    metrics['seconds'] = time.perf_counter() - metrics.pop('started', time.perf_counter())
+    peaks = [tracemalloc.get_traced_memory()[1] / 1024 / 1024] if tracemalloc.is_tracing() else []
+    rss = [resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024]
+    if worker_metrics is not None:
+        peaks += [worker_metrics['peak_traced_mb']] if worker_metrics['peak_traced_mb'] is not None else []
+        rss.append(worker_metrics['max_rss_mb'])
+    metrics['peak_traced_mb'] = round(max(peaks), 1) if peaks else None
+    metrics['max_rss_mb'] = round(max(rss), 1)
+    for key in ('seconds', 'read_seconds', 'transform_seconds', 'write_seconds'):
+        metrics[key] = round(metrics[key], 3)
+
+    if not report:
+        return
+    if INGEST_PROGRESS:
+        print()
+    if metrics['failed_batches']:
+        print(f"{metrics['failed_batches']} batches of {metrics['generator']} failed to write for {metrics['file']}, "
+              f"the file will be loaded again by the next ingest")
+    with ingest_report_lock:
+        ingest_report['files'].append(metrics)
+
+# Progress line of a file, rewritten after each batch with INGEST_PROGRESS
+def print_progress(metrics, file_number, file_count):
+    if not INGEST_PROGRESS:
+        return
+    elapsed = time.perf_counter() - metrics['started']
+    print(f"\r{metrics['generator']} file {file_number}/{file_count}: {metrics['rows_in']} rows in, "
+          f"{metrics['rows_out']} entries out, {metrics['batches']} batches written "
+          f"({metrics['rows_out'] / max(elapsed, 1e-9):.0f} entries/s)", end='', flush=True)
+
+# Write the ingest report of a data version to INGEST_REPORT as JSON, and the file metrics as CSV next to it
+def write_ingest_report(data_version, path=None):
+    path = path or INGEST_REPORT
+    with ingest_report_lock:
+        if not ingest_report['files']:
+            return
+        report = {'data_version': data_version, **ingest_report}
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+        with open(os.path.splitext(path)[0] + ".csv", "w", newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(report['files'][0]))
+            writer.writeheader()
+            writer.writerows(report['files'])
+    print(f"Wrote the ingest report to {path}")
+
+
+def count_query_entries(queries, metrics):
+    for _, params, _ in queries:
+        metrics['rows_out'] += len(params.get('data', []))
+        metrics['payload_bytes'] += payload_bytes(params)
+
+# Estimated size of the 'data' parameter of a query once encoded, from the JSON size of its first entries
+def payload_bytes(params, sample_size=100):
+    data = params.get('data')
+    if not data:
+        return 0
+    sample = data[:sample_size]
+    return int(len(json.dumps(sample, default=str)) * len(data) / len(sample))
+
+def add_write_counters(totals, counters):
+    if counters is None:
+        totals['failed_batches'] += 1
+        return
+    totals['batches'] += 1
+    totals['nodes_created'] += counters.nodes_created
+    totals['relationships_created'] += counters.relationships_created
+    totals['properties_set'] += counters.properties_set
@@ -0,0 +1,92 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+"""
+Ingest scheduler: the query generators of parse_datasets.py are run as the tasks of a small DAG. Each task declares
+the node labels its query generator creates and the node labels its relationships require (@graph_labels), an edge
+generator depends on the generators creating its labels, and a task starts as soon as its dependencies are done.
+See schedule_query_generators in parse_datasets.py for the tasks.
+"""
+
+
+# A task depends on every task creating a node label its relationships need (declared with @graph_labels)
+def ingest_task_dependencies(tasks):
+    for task in tasks:
+        requires = set(getattr(task['query_generator'], 'requires', []))
+        task['depends'] = {
+            other['name'] for other in tasks
+            if requires & set(getattr(other['query_generator'], 'creates', []))
+        }
+
+
+# Run the tasks as a DAG by calling run_task with each of them. A task starts as soon as the tasks it depends on are
+# done, up to 'concurrency' tasks at a time, each on its own thread and therefore its own Neo4j session (neomodel
+# keeps one connection per thread), and two tasks sharing a lock (the node labels whose relationships they write)
+# never run at the same time. With a concurrency of 1 the tasks run one after the other on this thread, in their
+# order. The ready tasks are started in the order of priority(task) when it is given.
+# Returns the start and end time of each task, relative to the start of the run, by task name, and the wall time.
+def run_ingest_tasks(tasks, run_task, concurrency, priority=None):
+    pending = list(tasks)
+    running = {}
+    timings = {}
+    scheduler_start = time.perf_counter()
+
+    def timed_task(task):
+        start = time.perf_counter() - scheduler_start
+        run_task(task)
+        return start, time.perf_counter() - scheduler_start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while pending or running:
+            if priority is not None:
+                pending.sort(key=priority)
+            # Start the tasks whose dependencies are done and that don't share locks with a running task
+            for task in list(pending):
+                if len(running) >= concurrency:
+                    break
+                if not task['depends'] <= timings.keys():
+                    continue
+                if any(task['locks'] & other['locks'] for other in running.values()):
+                    continue
+                pending.remove(task)
+                if concurrency == 1:
+                    # Run the task on this thread, so parquet workers can still be forked (see generate_queries_parallel
+                    # in parse_datasets.py)
+                    timings[task['name']] = timed_task(task)
+                else:
+                    running[executor.submit(timed_task, task)] = task
+
+            if not running:
+                if pending and not any(task['depends'] <= timings.keys() for task in pending):
+                    raise ValueError(f"Query generator dependencies can't be satisfied: {[t['name'] for t in pending]}")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                timings[task['name']] = future.result()
+
+    return timings, time.perf_counter() - scheduler_start
+
+
+# Print the time line of the tasks and the critical path: the chain of dependent tasks with the longest total
+# duration, which is the shortest possible ingest time however many generators run concurrently
+def print_critical_path(tasks, timings, wall_time):
+    tasks_by_name = {task['name']: task for task in tasks}
+    paths = {}
+
+    def critical_path(name):
+        if name not in paths:
+            start, end = timings[name]
+            longest = max((critical_path(dependency) for dependency in tasks_by_name[name]['depends']), default=(0, []))
+            paths[name] = (longest[0] + end - start, longest[1] + [name])
+        return paths[name]
+
+    print(f"\n{'Query generator':64s} {'start':>9s} {'duration':>9s}")
+    for name, (start, end) in sorted(timings.items(), key=lambda item: item[1][0]):
+        print(f"{name:64s} {start:8.1f}s {end - start:8.1f}s")
+
+    if timings:
+        duration, path = max(critical_path(name) for name in timings)
+        print(f"Critical path: {duration:.1f}s of {wall_time:.1f}s wall time")
+        print("  " + " -> ".join(path))
@@ -0,0 +1,148 @@
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+"""
+Parquet reader of the ingest (see parse_datasets.py): reads the columns and rows a query generator declares with
+@reads, in record batches sized to a memory budget, and the figures of a file from its footer only, which the ingest
+estimates (ingest_estimate.py) and the compaction (compaction.py) are based on.
+"""
+
+# Ratio between the memory used to process a row (decoding buffers, Cypher parameters built from it, Bolt encoding)
+# and the decoded size of the row, measured on the baseExpressions files
+PAYLOAD_EXPANSION = 96
+MIN_BATCH_ROWS = 1000
+
+
+# Read a parquet file as Arrow tables. In streaming mode the file is read with ParquetFile.iter_batches and each
+# record batch is returned as its own table, otherwise the whole file is returned as a single table.
+# Only the given columns are decoded (see resolve_parquet_columns) and the rows not matching row_filter, a
+# pyarrow.compute expression, are dropped before the tables are returned. If a stats dictionary is given, the
+# number of bytes and rows read and skipped is added to it.
+# Files that can't be read are reported and skipped.
+def read_parquet_tables(file_path, memory_mb, stream=True, columns=None, row_filter=None, stats=None):
+    try:
+        parquet_file = pq.ParquetFile(file_path)
+        column_paths = resolve_parquet_columns(parquet_file.schema, columns)
+        if stats is not None:
+            add_read_stats(stats, parquet_file.metadata, column_paths)
+
+        if stream:
+            batch_size = stream_batch_rows(parquet_file.metadata, memory_mb, column_paths)
+            tables = (pa.Table.from_batches([batch]) for batch in parquet_file.iter_batches(batch_size=batch_size, columns=column_paths))
+        else:
+            tables = [parquet_file.read(columns=column_paths)]
+
+        for table in tables:
+            rows_read = table.num_rows
+            if row_filter is not None:
+                table = table.filter(row_filter)
+            if stats is not None:
+                stats['rows_read'] += rows_read
+                stats['rows_kept'] += table.num_rows
+            yield table
+    except Exception as e:
+        print(f"Error reading file {os.path.basename(file_path)}: {e}")
+        if stats is not None:
+            stats.setdefault('failed_files', []).append(os.path.basename(file_path))
+
+
+# Map the columns declared by a query generator to the leaf column paths of a parquet file. A declared column
+# selects every leaf below it: 'pathways' selects all the fields of the pathway structs, 'tissues.rna.value' only
+# the RNA value of each tissue. Returns None (read everything) when no columns were declared.
+def resolve_parquet_columns(schema, columns):
+    if columns is None:
+        return None
+    column_paths = []
+    for i in range(len(schema)):
+        path = schema.column(i).path
+        name = logical_column_name(path)
+        if any(name == column or name.startswith(column + '.') for column in columns):
+            column_paths.append(path)
+    return column_paths
+
+
+# Remove the list levels from a parquet leaf path, e.g. 'tissues.list.element.efo_code' -> 'tissues.efo_code'.
+# Spark writes list items as 'list.element' and PyArrow as 'list.item'.
+def logical_column_name(path):
+    parts = path.split('.')
+    names = []
+    i = 0
+    while i < len(parts):
+        if parts[i] == 'list' and i + 1 < len(parts) and parts[i + 1] in ('element', 'item'):
+            i += 2
+            continue
+        names.append(parts[i])
+        i += 1
+    return '.'.join(names)
+
+
+# Add the compressed (I/O) and uncompressed (decode) sizes of the columns read from a file, and of the whole file,
+# to the read statistics
+def add_read_stats(stats, metadata, column_paths):
+    for key in ('files', 'columns_read', 'columns_total', 'io_read', 'io_total', 'decoded_read', 'decoded_total', 'rows_read', 'rows_kept'):
+        stats.setdefault(key, 0)
+    stats['files'] += 1
+    stats['columns_total'] += metadata.num_columns
+    stats['columns_read'] += metadata.num_columns if column_paths is None else len(column_paths)
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            stats['io_total'] += column.total_compressed_size
+            stats['decoded_total'] += column.total_uncompressed_size
+            if column_paths is None or column.path_in_schema in column_paths:
+                stats['io_read'] += column.total_compressed_size
+                stats['decoded_read'] += column.total_uncompressed_size
+
+
+# Figures of the columns a query generator reads from a parquet file, read from the file footer only: rows, row groups,
+# compressed and decoded sizes, and rows per record batch of memory_mb when streaming (see stream_batch_rows)
+def parquet_footer(file_path, memory_mb, query_generator=None):
+    metadata = pq.read_metadata(file_path)
+    column_paths = resolve_parquet_columns(metadata.schema, getattr(query_generator, 'columns', None))
+    footer = {'rows': metadata.num_rows, 'row_groups': metadata.num_row_groups, 'io_bytes': 0, 'decoded_bytes': 0,
+              'batch_rows': stream_batch_rows(metadata, memory_mb, column_paths)}
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            if column_paths is None or column.path_in_schema in column_paths:
+                footer['io_bytes'] += column.total_compressed_size
+                footer['decoded_bytes'] += column.total_uncompressed_size
+    return footer
+
+
+# Print how much I/O and decoding the column projection and row filters of a query generator saved
+def print_read_stats(data_type, query_generator, stats):
+    def saved(read, total):
+        return f"{read / 1024 / 1024:.1f}/{total / 1024 / 1024:.1f} MB ({100 - 100 * read / max(total, 1):.0f}% saved)"
+
+    print(f"{data_type} {query_generator.__name__}: "
+          f"columns {stats['columns_read'] // stats['files']}/{stats['columns_total'] // stats['files']}, "
+          f"read {saved(stats['io_read'], stats['io_total'])}, "
+          f"decoded {saved(stats['decoded_read'], stats['decoded_total'])}, "
+          f"rows kept {stats['rows_kept']}/{stats['rows_read']}")
+
+
+# Number of parquet rows to read per record batch so that the decoded batch and the Cypher parameters built from it
+# stay within memory_mb. The decoded size of a row is taken from the column chunk metadata of the columns that are
+# read, and multiplied by PAYLOAD_EXPANSION to account for the Python dictionaries the query generators build from it
+# (flattened lists such as 'tissues' produce many entries per row).
+def stream_batch_rows(metadata, memory_mb, column_paths=None):
+    if metadata.num_rows == 0:
+        return MIN_BATCH_ROWS
+    row_bytes = max(1.0, decoded_column_bytes(metadata, column_paths) / metadata.num_rows) * PAYLOAD_EXPANSION
+    return max(MIN_BATCH_ROWS, int(memory_mb * 1024 * 1024 / row_bytes))
+
+
+# Decoded size of the given columns (all of them if None) of a parquet file, from its column chunk metadata
+def decoded_column_bytes(metadata, column_paths=None):
+    decoded_bytes = 0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            if column_paths is None or column.path_in_schema in column_paths:
+                decoded_bytes += column.total_uncompressed_size
+    return decoded_bytes
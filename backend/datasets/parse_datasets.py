@@ -1,8 +1,64 @@
+import argparse
+import hashlib
+import multiprocessing
 import os
+import queue
+import threading
 import time
-import pyarrow.parquet as pq
+import tracemalloc
+from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from neomodel import config, db
 from neo4j import GraphDatabase
+from neo4j.exceptions import DriverError, Neo4jError
+
+try:
+    from bulk_import import BulkImportWriter
+except ImportError:
+    from datasets.bulk_import import BulkImportWriter
+try:
+    from parquet_reader import parquet_footer, print_read_stats, read_parquet_tables
+except ImportError:
+    from datasets.parquet_reader import parquet_footer, print_read_stats, read_parquet_tables
+try:
+    from ingest_scheduler import ingest_task_dependencies, print_critical_path, run_ingest_tasks
+except ImportError:
+    from datasets.ingest_scheduler import ingest_task_dependencies, print_critical_path, run_ingest_tasks
+try:
+    from ingest_manifest import (feed_task_files, file_fingerprint, fingerprint_task_files, forget_removed_files,
+                                 load_ingest_manifest, manifest_lock, new_ingest_manifest, record_ingest_manifest,
+                                 record_ingested_file, save_ingest_manifest, select_changed_tasks)
+except ImportError:
+    from datasets.ingest_manifest import (feed_task_files, file_fingerprint, fingerprint_task_files,
+                                          forget_removed_files, load_ingest_manifest, manifest_lock,
+                                          new_ingest_manifest, record_ingest_manifest, record_ingested_file,
+                                          save_ingest_manifest, select_changed_tasks)
+try:
+    from ingest_report import (INGEST_REPORT, INGEST_TRACE_MEMORY, WRITE_COUNTERS, add_write_counters,
+                               clear_ingest_report, count_query_entries, finish_file_metrics, new_file_metrics,
+                               print_progress, record_generator_timings, write_ingest_report)
+except ImportError:
+    from datasets.ingest_report import (INGEST_REPORT, INGEST_TRACE_MEMORY, WRITE_COUNTERS, add_write_counters,
+                                        clear_ingest_report, count_query_entries, finish_file_metrics,
+                                        new_file_metrics, print_progress, record_generator_timings,
+                                        write_ingest_report)
+try:
+    from ingest_cache import (cache_queries, commit_cache_writer, evict_ingest_cache, ingest_cache_entry,
+                              new_cache_writer, read_cached_queries)
+except ImportError:
+    from datasets.ingest_cache import (cache_queries, commit_cache_writer, evict_ingest_cache, ingest_cache_entry,
+                                       new_cache_writer, read_cached_queries)
+try:
+    from ingest_estimate import estimate_ingest
+except ImportError:
+    from datasets.ingest_estimate import estimate_ingest
+try:
+    from compaction import compact_datasets
+except ImportError:
+    from datasets.compaction import compact_datasets
 
 """
 Open Targets Neo4j Importer
@@ -16,37 +72,109 @@ How this file uses the data retrieved by the 'get_datasets.py' file:
 1. The script reads data from parquet files stored in the 'opentarget' folder. Parquet files are a columnar storage file
    format optimized for use with big data processing frameworks. Each data type is stored in its own subfolder.
 
-2. The data in the parquet files is converted to tables using the PyArrow library. These tables are then converted
-   to pandas DataFrames for easier manipulation.
+2. The data in the parquet files is converted to tables using the PyArrow library. The tables are never converted
+   to pandas DataFrames or walked row by row: the generators work on whole Arrow columns with pyarrow.compute.
 
 3. The script processes the data using node and edge query generator functions defined for each data type. These
-   generator functions take the DataFrames as input, extract the required properties, and create Cypher queries to
+   generator functions take the Arrow tables as input, extract the required properties, and create Cypher queries to
    create or update nodes and edges in the Neo4j database.
 
-4. The script uses the APOC library for parallelized batch processing of Neo4j Cypher queries. Make sure to have the
-   APOC plugin installed in your Neo4j instance before running the script.
+4. The generated queries are plain UNWIND statements. The writer sends their data in batches of INGEST_BATCH_SIZE
+   entries, each batch in its own write transaction on a session of a driver shared by all the writer threads
+   (see write_batch). The driver retries a transaction failing with a transient error, and MERGE makes the retries
+   safe. The APOC plugin is only used by the edge writer benchmark.
 
 Main function overview:
 
-- The script first sets the dataset name and checks if the data files are up-to-date.
-- It then defines a dictionary called 'data_type_query_generators', which maps data types to lists of node and edge
-  query generator functions.
-- It creates indexes for nodes to improve query performance.
-- The script iterates over each data type for the node query generators, and then does the same for edge query
-  generators, executing them in two separate loops to ensure all node generators are run before the edge generators.
+- The script first sets the dataset name and checks if the data files are up-to-date. The ingest manifest
+  (ingest_manifest.json, next to platform.conf) records the size, modification time and hash of every parquet file
+  loaded and the query generators that read it, saved as soon as a query generator is done with a file. A new data
+  version is loaded in full, otherwise only the query generators whose input files changed are run, on those files.
+  This also resumes an interrupted ingest, on startup or with 'make send-data', from the last file written; use
+  --restart to reload every file. The skipped generators and the reason the others run are printed
+  (see ingest_manifest.py).
+- Data versions are loaded blue/green: every node has a data_version property, and a new data version is loaded into
+  its own nodes, relationships and disabled Dataset nodes next to the live one, which keeps serving the API. Once
+  every file is loaded and the node counts are validated against the live version (INGEST_MIN_NODE_RATIO), a single
+  transaction enables the new Dataset nodes and disables the old ones (see switch_data_version). The relationships
+  uploaded as CSV files are created again between the new nodes, and the nodes of the other versions are then deleted
+  in the background, INGEST_CLEANUP_BATCH nodes at a time.
+- The dictionary called 'data_type_query_generators' (at the end of this file) maps data types to lists of node and
+  edge query generator functions.
+- It creates a uniqueness constraint on the data version and key of each node label (NODE_KEYS), which nodes are
+  merged on and relationships match their nodes on.
+- The query generators form a small DAG: each generator declares the node labels it creates and the node labels its
+  relationships require (@graph_labels), and an edge generator depends on the generators creating its labels.
+  schedule_query_generators runs the generators whose dependencies are done, up to INGEST_CONCURRENCY (or
+  --concurrency) at a time on separate Neo4j sessions, and prints a critical path report at the end. Two generators
+  writing relationships on the same node label never run at the same time. With the default concurrency of 1 all
+  node generators run before the edge generators (see ingest_scheduler.py).
+- By default the parquet files are streamed: each file is read in record batches (ParquetFile.iter_batches), the query
+  generators are applied to one batch at a time and the resulting rows are written in chunks before the next batch is
+  read. The batch size is derived from INGEST_MEMORY_MB, so peak memory doesn't depend on the size of the input files
+  (see parquet_reader.py). Set INGEST_STREAM=false to read each file whole.
+- With INGEST_WORKERS (or --workers) greater than 1, the part files of a data type are decoded and turned into write
+  batches by a pool of worker processes. The batches reach the Neo4j writer through a bounded queue, and a query
+  generator finishes all of its files before the next one starts, so node generators still run before edge generators.
+  'python ingest_benchmark.py --workers 1,2,4,8' measures how the decoding throughput scales with the number of
+  workers without writing to Neo4j.
+- On startup the files are loaded while they are downloaded (INGEST_PIPELINE, see gradvekbackend/startup.py):
+  get_datasets hands each completed parquet file to a download feed, and each query generator reads the files of its
+  data type from the feed as they arrive instead of listing its directory. The data types with node generators
+  (node_data_types) are downloaded first, so the edge generators waiting for their nodes are not held up by them, and
+  the startup takes about the longer of the download and the ingest rather than their sum.
+- With INGEST_EDGE_WRITERS (or --edge-writers) greater than 1, each relationship batch is split into partitions by
+  the hash of its start and end node keys, and the partitions that share no node are written at the same time on
+  separate sessions, so they never wait on each other's locks. A batch hitting a transient error is written again
+  for up to INGEST_RETRY_SECONDS. 'python ingest_benchmark.py --edge-writers 1,2,4,8' measures the write throughput
+  against Neo4j.
+- Relationships are written by node element id: once the node generators of a label are done, the keys and element
+  ids of its nodes are read once into two Arrow arrays, and the relationship entries are mapped to the ids before
+  they are sent, so writing a relationship doesn't look up the key properties of its nodes.
+- Each ingest writes a report (INGEST_REPORT, ingest_report.json and .csv) with the read, transform and write time,
+  rows in and out, payload size, write counters and memory of every file and query generator. Batches failing to
+  write are reported and their file is loaded again by the next ingest. INGEST_PROGRESS=true prints a live progress
+  line, INGEST_TRACE_MEMORY=true traces the peak memory of each file (see ingest_report.py).
+- The queries generated from each parquet file are cached (see ingest_cache.py) as Arrow IPC files in INGEST_CACHE_DIR,
+  keyed by the hash of the file, the version of the query generator and the data version. Reloading unchanged files,
+  e.g. after the database was cleared, reads the memory-mapped cache instead of decoding and transforming them. The
+  cache is kept under INGEST_CACHE_MB and INGEST_CACHE_DAYS, INGEST_CACHE=false disables it.
+- 'python parse_datasets.py --estimate' (make estimate-ingest) estimates the duration, peak memory, entries and payload
+  of a reload without decoding any data: it reads the parquet footers of every input file and applies a cost model of
+  each query generator calibrated from the file metrics of the last ingest report (see ingest_estimate.py).
+- With INGEST_COMPACT=true the files are compacted before they are loaded: the part files of each data type are
+  rewritten into a few files of about INGEST_COMPACT_FILE_MB (INGEST_COMPACT_DIR, opentarget_compact), with only the
+  columns the query generators of the data type read and row groups of one streaming batch, so the ingest reads a few
+  large files instead of hundreds of small ones. The compaction manifest (compaction_manifest.json in that folder)
+  records the input files of each data type, which is only compacted again when they change (see compaction.py).
+  'python parse_datasets.py --compact' (make compact-datasets) only runs the compaction.
+- 'python parse_datasets.py --import-files DIR' (make bulk-import) writes the same nodes and relationships as CSV
+  files for 'neo4j-admin database import' instead, with an import.sh script running the import. This is the
+  fastest way to load an empty database; the indexes are created on the next start.
 
 Adding a new data type to the 'data_type_query_generators' dictionary:
 
-1. Define the node and edge query generator functions for the new data type.
+1. Define the node and edge query generator functions for the new data type, declaring the node labels they create
+   or require with @graph_labels.
 2. Add the data type name as the key and a tuple containing the node and edge query generator functions as the value.
 
 Creating query generator functions (for nodes and relationships):
 
 1. Define a function that takes a 'table' as its argument. This table is obtained by converting a parquet file to a
-   table using PyArrow (handled in main you don't need to define this) and then the function converts that table to a pandas DataFrame.
-2. Extract the required properties from the DataFrame and prepare the data for the Cypher query.
-3. Create an APOC query for creating or merging nodes or relationships in batch, using the prepared data.
-4. Return a list of queries to be executed, including the dataset creation query and the node/relationship creation query.
+   table using PyArrow (handled in main you don't need to define this).
+2. Declare the columns the function reads and the rows it keeps with the @reads decorator, e.g.
+   @reads(['id', 'pathways.pathwayId'], valid_rows('id', 'pathways')). Only these columns are decoded from the
+   parquet files and the other rows are dropped at read time, so the function receives a filtered table.
+3. Extract the required properties from the table columns and prepare the data for the Cypher query. Use the column
+   helpers below (drop_null_rows, flatten_list_column, struct_field) instead of iterating rows: nested lists such
+   as 'pathways' or 'tissues' are flattened with list_flatten/list_parent_indices, and the parent row values are
+   repeated with take.
+4. Create the queries merging the nodes or relationships in batch with create_cypher_query_node_batch or
+   create_cypher_query_relationships, passing them the prepared Arrow columns. They drop the duplicate entries
+   (or average them, for averaged relationship properties) so each node and relationship is sent once. Besides the
+   UNWIND query and its parameters they describe what is written, which the bulk import writer uses. A generator
+   averaging relationship properties is declared with @averaged_over_files.
+5. Return a list of queries to be executed, including the dataset creation query and the node/relationship creation query.
 
 As long at the function is defined and added to the 'data_type_query_generators' dictionary, the script will run it.
 
@@ -82,6 +210,45 @@ def ensure_neo4j_connection():
 # Dataset name
 data_version = None
 
+# Streaming ingestion settings, they can be overridden with environment variables.
+# INGEST_STREAM: read the parquet files in record batches instead of loading each file whole
+# INGEST_MEMORY_MB: memory budget for one record batch and the Cypher parameters built from it
+# INGEST_BATCH_SIZE: number of entries of the $data parameter written in one transaction
+INGEST_STREAM = os.getenv("INGEST_STREAM", "true").lower() == "true"
+INGEST_MEMORY_MB = int(os.getenv("INGEST_MEMORY_MB", 512))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 10000))
+# Parallel decoding settings.
+# INGEST_WORKERS: number of processes decoding parquet files and building the Cypher parameters
+# INGEST_QUEUE_SIZE: maximum number of decoded batches waiting to be written to Neo4j
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 1))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 4))
+# INGEST_CONCURRENCY: number of query generators run at the same time, each on its own Neo4j session
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", 1))
+# INGEST_EDGE_WRITERS: number of sessions writing the partitions of a relationship batch (and the batches of a node
+# query) at the same time
+# INGEST_RETRY_SECONDS: how long a write transaction failing with a transient error, a deadlock for example, is retried
+INGEST_EDGE_WRITERS = int(os.getenv("INGEST_EDGE_WRITERS", 1))
+INGEST_RETRY_SECONDS = float(os.getenv("INGEST_RETRY_SECONDS", 30))
+# INGEST_RESOLVE_IDS: match the nodes of the relationships on their element ids, resolved once per label and ingest,
+# instead of looking up their key property for every relationship
+INGEST_RESOLVE_IDS = os.getenv("INGEST_RESOLVE_IDS", "true").lower() == "true"
+# INGEST_RESUME: resume from the checkpoints of the ingest manifest, set to false to reload every file
+INGEST_RESUME = os.getenv("INGEST_RESUME", "true").lower() == "true"
+# INGEST_CACHE: keep the queries generated from each parquet file and reuse them when the file and the query generator
+# didn't change, instead of decoding and transforming the file again (see ingest_cache.py for its settings)
+INGEST_CACHE = os.getenv("INGEST_CACHE", "true").lower() == "true"
+# Data version switchover settings.
+# INGEST_MIN_NODE_RATIO: a new data version is only switched to if it has at least this fraction of the live version's
+# nodes for every label
+# INGEST_CLEANUP_BATCH, INGEST_CLEANUP_PAUSE: nodes of the old data versions deleted per transaction, and seconds
+# between two of these transactions, so the cleanup doesn't slow the API down
+INGEST_MIN_NODE_RATIO = float(os.getenv("INGEST_MIN_NODE_RATIO", 0.5))
+INGEST_CLEANUP_BATCH = int(os.getenv("INGEST_CLEANUP_BATCH", 1000))
+INGEST_CLEANUP_PAUSE = float(os.getenv("INGEST_CLEANUP_PAUSE", 0.5))
+# INGEST_COMPACT: rewrite the part files of each data type into a few large files in INGEST_COMPACT_DIR, keeping only
+# the columns the query generators read, and load those instead (see compaction.py for its settings)
+INGEST_COMPACT = os.getenv("INGEST_COMPACT", "false").lower() == "true"
+
 def set_dataset_name():
     global data_version
 
@@ -109,33 +276,21 @@ def set_dataset_name():
 
 def update_check():
     try:
-        # Query the first entry in Neo4j
-        results, _ = db.cypher_query("MATCH (n) RETURN n LIMIT 1")
-        
-        # Check if there is any result
-        if results and len(results) > 0:
-            # Get the dataset from the first entry if it exists
-            node = results[0][0]
-            dataset = node.get('dataset', None)
-            
-            if dataset is not None:
-                # Get the dataset version from that entry
-                first_7_digits = dataset[:7]
-                print("Neo4J Dataset version:", first_7_digits)
-
-                # If the dataset version from the entry in neo4j matches that from our conf file, there's no need to update the neo4j db
-                if first_7_digits == data_version:
-                    return False
-                else:
-                    print("Data version in neo4j doesnt match the data version in conf file. Clearing neo4j db and reloading db")
-                    return True
+        # Get the data version the API is serving
+        live_version = live_data_version()
+
+        if live_version is not None:
+            print("Neo4J Dataset version:", live_version)
+
+            # If the live data version matches that from our conf file, there's no need to update the neo4j db
+            if live_version == data_version:
+                return False
             else:
-                # Node does not have a dataset property
-                print("Node does not have a dataset property")
+                print("Data version in neo4j doesnt match the data version in conf file. Loading it next to the live version")
                 return True
         else:
-            # No nodes found in neo4j
-            print("No nodes found in neo4j. Reloading data")
+            # No Dataset switched to in neo4j
+            print("No data version found in neo4j. Reloading data")
             return True
         
     except Exception as e:
@@ -145,7 +300,12 @@ def update_check():
         return True
 
 
-def parse_datasets():
+# Load the data files into Neo4j. With a download feed (see get_datasets.DownloadFeed) the files are loaded while they
+# are downloaded: each query generator reads the files of its data type as they are completed.
+def parse_datasets(workers=None, concurrency=None, resume=None, edge_writers=None, feed=None):
+    if feed is not None:
+        # platform.conf names the data version being downloaded once the download started
+        feed.wait_started()
     # Check and set the neo4j connection
     ensure_neo4j_connection()
     # Set the dataset name
@@ -155,54 +315,247 @@ def parse_datasets():
     # Set the input directory for the opentarget data
     input_dir = os.path.join(current_dir, "opentarget")
 
-    #Check if data files are updated via platform.conf file data version. If so, clear the neo4j db and reload data from files
-    if update_check(): # change this to 'if True:' when doing dev work
-        # clear_neo4j_database()
+    # Create indexes for nodes - this significantly improves performance in edge query generation. They are created
+    # even when the data is up to date, as a database loaded from import files (see write_import_files) has none.
+    create_indexes()
 
-        # Define data_type_query_generators, a dictionary that maps data types to lists of query generators.
-        # Each list contains multiple node or edge query generator functions for the respective data type.
-        data_type_query_generators = {
-            # Key: data type name, Value: tuple([node query generators], [edge query generators])
-            "targets": ([create_cypher_query_targets, create_cypher_query_pathways], [create_cypher_query_participates]),
-            "fda": ([create_cypher_query_adverse_events], [create_cypher_query_associated_with]),
-            "molecule": ([create_cypher_query_drugs], []),
-            "mechanismOfAction": ([], [create_cypher_query_mechanism_of_action]),
-            "mousePhenotypes": ([create_cypher_query_mouse_phenotypes], [create_cypher_query_associated_mouse_phenotypes]),
-            "diseases": ([create_cypher_query_diseases], []),
-            "interactions":([],[create_cypher_query_interactions]),
-            "baseExpressions":([create_cypher_query_baseline_expression],[create_cypher_query_hgene, create_cypher_query_hprotein]),
-            "pathways":([create_cypher_query_pathway_types],[create_cypher_query_pathways_relation]),
-            # "gwasTraitProfile":([create_cypher_query_gwas],[create_cypher_query_gwas_relation])
-        }
+    # Load the compacted files instead of the downloaded ones. A data type is compacted once all its files are there.
+    if INGEST_COMPACT:
+        if feed is not None:
+            print("Compacting the files once they are all downloaded")
+            feed.wait_closed()
+            feed = None
+        try:
+            input_dir = compact_datasets(input_dir, data_type_columns(), INGEST_MEMORY_MB, INGEST_WORKERS)
+        except Exception as e:
+            print(f"Compaction failed, loading the downloaded files: {e}")
+
+    options = {'workers': workers}
+    if edge_writers is not None:
+        options['writer'] = lambda queries: execute_queries(queries, edge_writers=edge_writers)
+    if INGEST_TRACE_MEMORY:
+        tracemalloc.start()
+
+    if resume is None:
+        resume = INGEST_RESUME
+    if not resume:
+        print("Ignoring the ingest checkpoints, reloading every file")
+        schedule_query_generators(input_dir, concurrency, manifest=new_ingest_manifest(data_version), feed=feed, **options)
+        write_ingest_report(data_version)
+        switch_data_version(input_dir)
+        return
 
+    # The ingest manifest holds a checkpoint for each file and query generator done. An interrupted ingest, or one
+    # with new or changed files, resumes from it. It doesn't apply to an empty database.
+    manifest = load_ingest_manifest(data_version)
+    if manifest is not None and neo4j_database_is_empty():
+        print("Neo4j database is empty, ignoring the ingest checkpoints")
+        manifest = None
 
-        # Create indexes for nodes - this significantly improves performance in edge query generation
-        create_indexes()
+    if manifest is not None:
+        # Only run the query generators on the files they didn't read in their current version
+        schedule_query_generators(input_dir, concurrency, manifest=manifest, feed=feed, **options)
+        write_ingest_report(data_version)
+        switch_data_version(input_dir)
 
-        # Iterate over each data type in the input directory for node query generators
-        for data_type in os.listdir(input_dir):
-            # Check if the data_type is in the data_type_query_generators dictionary
-            if data_type not in data_type_query_generators:
-                print(f"Ignoring '{data_type}' folder. No matching function found.")
-                continue
+    #Check if data files are updated via platform.conf file data version. If so, clear the neo4j db and reload data from files
+    elif update_check(): # change this to 'if True:' when doing dev work
+        # clear_neo4j_database()
 
-            # Set the data_type_path
-            data_type_path = os.path.join(input_dir, data_type)
-            # Check if the path is a directory
-            if not os.path.isdir(data_type_path):
-                continue
+        # Run the query generators of every data type. An edge generator only starts once the node generators
+        # creating the labels it needs are done. The files are checkpointed in a new ingest manifest as they are loaded.
+        # The new data version is loaded next to the live one and switched to once it is complete.
+        schedule_query_generators(input_dir, concurrency, manifest=new_ingest_manifest(data_version), feed=feed, **options)
+        write_ingest_report(data_version)
+        switch_data_version(input_dir)
 
-            # Run the node query generators for the current data type
-            for node_query_generator in data_type_query_generators[data_type][0]:
-                if node_query_generator is not None:
-                    generate_queries(data_type, data_type_path, node_query_generator)
-        
+    else:
+        # Loaded before the ingest manifest existed, record the current files as the loaded ones
+        print("Data up to date. Will not update neo4j db, recording the current files in the ingest manifest")
+        if feed is not None:
+            feed.wait_closed()
+        record_ingest_manifest(find_ingest_tasks(input_dir), data_version)
+        start_data_version_cleanup()
+
+
+# Check if the Neo4j database has no nodes
+def neo4j_database_is_empty():
+    results, _ = db.cypher_query("MATCH (n) RETURN n LIMIT 1")
+    return len(results) == 0
+
+
+# Blue/green data versions: the nodes of each data version are separate (they are merged on their data_version and
+# NODE_KEYS properties), and the Dataset nodes of a new version are created disabled, so the API queries, which only
+# follow the enabled datasets, keep serving the live version while the new one loads. The live version is the one
+# whose Dataset nodes were switched to last.
+
+# Data version of the Dataset nodes switched to last, None if there is none
+def live_data_version():
+    results, _ = db.cypher_query(
+        "MATCH (d:Dataset) WHERE d.activated IS NOT NULL RETURN d.data_version ORDER BY d.activated DESC LIMIT 1")
+    return results[0][0] if results else None
+
+# Switch the API to the data version just loaded, once it is validated (see validate_data_version), and delete the
+# nodes of the other versions in the background. A version failing validation stays disabled next to the live one,
+# the next ingest resumes loading it from the ingest manifest. A version without Dataset nodes (nothing was loaded)
+# is never switched to, it would disable every dataset of the live version.
+def switch_data_version(input_dir):
+    live_version = live_data_version()
+    results, _ = db.cypher_query("MATCH (d:Dataset {data_version: $data_version}) RETURN count(d)",
+                                 {'data_version': data_version})
+    if not results[0][0]:
+        print(f"Data version {data_version} has no datasets, the API keeps serving data version {live_version}")
+        return
+    if live_version is not None and live_version != data_version and not validate_data_version(input_dir, live_version):
+        print(f"Data version {data_version} is not complete, the API keeps serving data version {live_version}")
+        start_data_version_cleanup(keep=(live_version, data_version))
+        return
 
-        # Iterate over each data type in the input directory for edge query generators
+    # In a single transaction: the Dataset nodes of the new version are enabled unless the user disabled the same
+    # source in the live version, and the Dataset nodes of the other versions are disabled. The Dataset nodes already
+    # switched to keep their status.
+    db.cypher_query("""
+    MATCH (new:Dataset {data_version: $data_version})
+    OPTIONAL MATCH (old:Dataset {source: new.source, data_version: $live_version})
+    WHERE old.data_version <> $data_version
+    WITH new, collect(old) AS old
+    SET new.enabled = CASE WHEN new.activated IS NULL THEN all(d IN old WHERE d.enabled) ELSE new.enabled END,
+        new.activated = coalesce(new.activated, timestamp())
+    WITH collect(new) AS switched
+    WHERE size(switched) > 0
+    MATCH (d:Dataset) WHERE d.data_version <> $data_version
+    SET d.enabled = false
+    """, {'data_version': data_version, 'live_version': live_version})
+    if live_version != data_version:
+        print(f"Switched from data version {live_version} to {data_version}")
+        attach_csv_uploads()
+        drop_graph_projections()
+    start_data_version_cleanup()
+
+# Create the relationships uploaded as CSV files (see search/csv_service.py) between the nodes of the new data version.
+# Each upload is recorded in a CsvUpload node, which doesn't belong to a data version and is kept by the cleanup.
+def attach_csv_uploads():
+    results, _ = db.cypher_query("MATCH (u:CsvUpload) RETURN DISTINCT u.start_label, u.end_label")
+    for start_label, end_label in results:
+        if start_label not in NODE_KEYS or end_label not in NODE_KEYS:
+            continue
+        attached, _ = db.cypher_query(f"""
+        MATCH (u:CsvUpload {{start_label: $start_label, end_label: $end_label}})
+        MATCH (start:{start_label} {{data_version: $data_version, {NODE_KEYS[start_label]}: u.start_id}})
+        MATCH (end:{end_label} {{data_version: $data_version, {NODE_KEYS[end_label]}: u.end_id}})
+        MERGE (start)-[:ASSOCIATED_WITH {{dataset: u.dataset, critval: 0, llr: 0}}]->(end)
+        RETURN count(*)
+        """, {'start_label': start_label, 'end_label': end_label, 'data_version': data_version})
+        print(f"Attached {attached[0][0]} uploaded {start_label} to {end_label} relationships to data version {data_version}")
+
+# Descriptors of the similarity step (see descriptors in search/queries/node_similarity.py), their GDS graph
+# projections are named after the descriptor and the data version they were made for
+SIMILARITY_DESCRIPTORS = ['mousepheno', 'hgene', 'hprotein', 'intact', 'pathway', 'reactome', 'signor']
+
+# Drop the GDS graph projections of the similarity step, they hold the nodes of the previous data version. The next
+# similarity step computes the similarity relationships of the new version. Only the projections named after a
+# descriptor are dropped, as in node_similarity.py, the other projections of the GDS catalog are left alone.
+def drop_graph_projections():
+    try:
+        db.cypher_query("""
+        CALL gds.graph.list()
+        YIELD graphName
+        WHERE any(descriptor IN $descriptors WHERE graphName = descriptor OR graphName STARTS WITH descriptor + '_')
+          AND NOT graphName IN [descriptor IN $descriptors | descriptor + '_' + $data_version]
+        CALL gds.graph.drop(graphName, false)
+        YIELD graphName AS dropped
+        RETURN count(dropped)
+        """, {'descriptors': SIMILARITY_DESCRIPTORS, 'data_version': data_version})
+    except Exception as e:
+        print(f"Could not drop the graph projections: {e}")
+
+# Check that a data version is complete before switching to it: every query generator read every input file (see the
+# ingest manifest) without failed batches, and each node label has at least INGEST_MIN_NODE_RATIO times the nodes of
+# the live version.
+def validate_data_version(input_dir, live_version):
+    manifest = load_ingest_manifest(data_version) or new_ingest_manifest(data_version)
+    tasks = find_ingest_tasks(input_dir)
+    fingerprints = fingerprint_task_files(tasks, manifest)
+    missing = [
+        f"{task['query_generator'].__name__} {key}" for task in tasks for key, fingerprint in fingerprints.items()
+        if key.split('/')[0] == task['data_type'] and (
+            key not in manifest['files'] or manifest['files'][key]['hash'] != fingerprint['hash']
+            or task['query_generator'].__name__ not in manifest['files'][key]['generators'])
+    ]
+    if missing:
+        print(f"{len(missing)} input files are not loaded, e.g. {', '.join(missing[:3])}")
+        return False
+
+    valid = True
+    for label in NODE_KEYS:
+        results, _ = db.cypher_query(
+            f"MATCH (n:{label}) WHERE n.data_version IN [$live, $new] RETURN n.data_version, count(n)",
+            {'live': live_version, 'new': data_version})
+        counts = dict(results)
+        live_count, new_count = counts.get(live_version, 0), counts.get(data_version, 0)
+        print(f"{label} nodes: {live_count} in data version {live_version}, {new_count} in {data_version}")
+        if new_count < live_count * INGEST_MIN_NODE_RATIO:
+            valid = False
+    return valid
+
+
+# Thread deleting the nodes of the old data versions
+data_version_cleanup = None
+
+# Delete the nodes and Dataset nodes of the data versions other than keep (the live version by default) in the
+# background, unless a cleanup is already running. Nothing is deleted while no data version is live.
+def start_data_version_cleanup(keep=None):
+    global data_version_cleanup
+    if data_version_cleanup is not None and data_version_cleanup.is_alive():
+        return
+    keep = [version for version in keep or [live_data_version()] if version is not None]
+    if not keep:
+        return
+    results, _ = db.cypher_query(
+        "MATCH (d:Dataset) WHERE NOT d.data_version IN $keep RETURN DISTINCT d.data_version", {'keep': keep})
+    versions = [version for (version,) in results]
+    if versions:
+        data_version_cleanup = threading.Thread(target=delete_data_versions, args=(versions,),
+                                                name="data-version-cleanup", daemon=True)
+        data_version_cleanup.start()
+
+# Delete the nodes of data versions, with their relationships, INGEST_CLEANUP_BATCH nodes per transaction and
+# INGEST_CLEANUP_PAUSE seconds apart, then their Dataset nodes. An interrupted cleanup starts again on the next ingest.
+def delete_data_versions(versions):
+    for version in versions:
+        print(f"Deleting the nodes of data version {version} in the background")
+        deleted = 0
+        try:
+            with get_neo4j_driver().session() as session:
+                for label in NODE_KEYS:
+                    query = (f"MATCH (n:{label}) WHERE n.data_version = $version "
+                             f"WITH n LIMIT $batch DETACH DELETE n RETURN count(*)")
+                    while True:
+                        count = session.execute_write(
+                            lambda tx: tx.run(query, version=version, batch=INGEST_CLEANUP_BATCH).single()[0])
+                        deleted += count
+                        if count < INGEST_CLEANUP_BATCH:
+                            break
+                        time.sleep(INGEST_CLEANUP_PAUSE)
+                session.execute_write(
+                    lambda tx: tx.run("MATCH (d:Dataset {data_version: $version}) DELETE d", version=version).consume())
+        except (DriverError, Neo4jError) as e:
+            print(f"Deleting data version {version} failed after {deleted} nodes: {e}")
+            return
+        print(f"Deleted the {deleted} nodes of data version {version}")
+
+
+# Find the query generators to run for the data type folders in the input directory. Returns one task per query
+# generator, node generators first, each with the names of the tasks it depends on (see ingest_task_dependencies).
+def find_ingest_tasks(input_dir):
+    tasks = []
+    for generator_type in (NODE_GENERATORS, EDGE_GENERATORS):
+        # Iterate over each data type in the input directory
         for data_type in os.listdir(input_dir):
             # Check if the data_type is in the data_type_query_generators dictionary
             if data_type not in data_type_query_generators:
-                print(f"Ignoring '{data_type}' folder. No matching function found.")
+                if generator_type == NODE_GENERATORS:
+                    print(f"Ignoring '{data_type}' folder. No matching function found.")
                 continue
 
             # Set the data_type_path
@@ -211,90 +564,856 @@ def parse_datasets():
             if not os.path.isdir(data_type_path):
                 continue
 
-            # Run the edge query generators for the current data type
-            for edge_query_generator in data_type_query_generators[data_type][1]:
-                if edge_query_generator is not None:
-                    generate_queries(data_type, data_type_path, edge_query_generator)
+            for query_generator in data_type_query_generators[data_type][generator_type]:
+                if query_generator is not None:
+                    tasks.append({
+                        'name': f"{data_type}/{query_generator.__name__}",
+                        'data_type': data_type,
+                        'data_type_path': data_type_path,
+                        'query_generator': query_generator,
+                        # Node labels whose relationships the task writes, two tasks writing relationships of the
+                        # same nodes are not run at the same time to avoid lock conflicts
+                        'locks': set(getattr(query_generator, 'requires', [])),
+                    })
+    ingest_task_dependencies(tasks)
+    return tasks
+
+
+# Run the query generators of the input directory as a DAG (see ingest_scheduler.py). A generator starts as soon as the
+# generators creating the node labels it requires are done, up to 'concurrency' generators at a time, each on its own
+# Neo4j session. With a concurrency of 1 this runs all the node generators and then all the edge generators. A
+# critical path report is printed at the end.
+# With a download feed the tasks read the files of their data type as they are downloaded (see feed_task_files), and
+# the tasks whose data type has the fewest files left to download are started first.
+def schedule_query_generators(input_dir, concurrency=None, manifest=None, feed=None, **options):
+    if concurrency is None:
+        concurrency = INGEST_CONCURRENCY
+
+    tasks = find_ingest_tasks(input_dir)
+    fingerprints = {}
+    # The nodes may change during the ingest, the node ids are resolved again once its node generators are done
+    clear_node_ids()
+    clear_ingest_report()
+    if feed is not None:
+        # The files to read are only known as they are downloaded, every task runs and skips the files it already read
+        print("Running the query generators on the files as they are downloaded")
+        for task in tasks:
+            task['files'] = feed_task_files(task, feed, manifest, fingerprints)
+    elif manifest is not None:
+        # Skip the generators whose input files are unchanged, the others don't wait for them
+        tasks, fingerprints = select_changed_tasks(input_dir, tasks, manifest)
+        ingest_task_dependencies(tasks)
+        if not tasks:
+            print("Data up to date. Will not update neo4j db")
+            return
+
+    def run_task(task):
+        run_ingest_task(task, options, manifest, fingerprints)
+    priority = None
+    if feed is not None:
+        priority = lambda task: feed.remaining(task['data_type_path'])
+    timings, wall_time = run_ingest_tasks(tasks, run_task, concurrency, priority)
+
+    if feed is not None and manifest is not None:
+        forget_removed_files(input_dir, manifest)
+        with manifest_lock:
+            save_ingest_manifest(manifest)
+
+    print_critical_path(tasks, timings, wall_time)
+    record_generator_timings(timings, wall_time)
+    evict_ingest_cache()
+
+
+# Run the query generator of a task. With an ingest manifest only the task's remaining files are read, and each file
+# is checkpointed in the manifest as soon as it is written, so an interrupted ingest resumes from the last file
+# written.
+def run_ingest_task(task, options, manifest=None, fingerprints=None):
+    file_done = None
+    if manifest is not None:
+        def file_done(file):
+            record_ingested_file(manifest, task, f"{task['data_type']}/{file}", fingerprints)
+    generate_queries(task['data_type'], task['data_type_path'], task['query_generator'], files=task.get('files'),
+                     file_done=file_done, fingerprints=fingerprints, **options)
 
-    else:
-        print("Data up to date. Will not update neo4j db")  
 
 # Generate queries for the given data type and path
 # This function takes a data_type, data_type_path, and a query_generator function
 # It iterates through all parquet files in the given path and applies the query_generator function to generate
-# Cypher queries for each file.
-def generate_queries(data_type, data_type_path, query_generator):
+# Cypher queries for each file. In streaming mode the query_generator is applied to each record batch of the file
+# instead of the whole file, and the batch is written to Neo4j before the next one is read.
+# With more than one worker the files are decoded and turned into queries in worker processes (see
+# generate_queries_parallel). The queries are passed to writer, which executes them in Neo4j by default.
+# The writer only gets the entries not already written in the run (see DeduplicatingWriter), and the relationships
+# with averaged properties are written once all the files are read, with their averages over the whole run.
+# Only the given files are read when files is set. file_done is called with the name of each file once all of its
+# queries are written, it is not called for the files that could not be read or had batches failing to write. The
+# files whose averaged relationships are held back are only done once these are written.
+# The metrics of each file (see new_file_metrics) are added to the ingest report.
+# fingerprints are the fingerprints of the input files already hashed for the ingest manifest (see
+# fingerprint_task_files), by 'data_type/file' key, the ingest cache reuses their hashes instead of reading the files
+# again.
+# Returns the read statistics, with the names of the files that could not be read under 'failed_files'.
+def generate_queries(data_type, data_type_path, query_generator, stream=None, workers=None, writer=None, files=None,
+                     file_done=None, fingerprints=None):
     if query_generator is None:
-        return
-
-    # List all parquet files in the data_type_path
-    files = [file for file in os.listdir(data_type_path) if file.endswith(".parquet")]
+        return {}
+    if stream is None:
+        stream = INGEST_STREAM
+    if workers is None:
+        workers = INGEST_WORKERS
+    if writer is None:
+        writer = execute_queries
+
+    # List all parquet files in the data_type_path. The files can also be an iterator yielding them as they are
+    # downloaded, whose number is not known in advance.
+    if files is None:
+        files = [file for file in os.listdir(data_type_path) if file.endswith(".parquet")]
+    file_count = len(files) if isinstance(files, list) else "?"
+
+    read_stats = {}
+    fingerprints = fingerprints or {}
+
+    # Hash of a file from its fingerprint, None if it wasn't fingerprinted
+    def file_hash(file):
+        return fingerprints.get(f"{data_type}/{file}", {}).get('hash')
+
+    run_writer = DeduplicatingWriter(writer)
+    held_files = []
+    def file_written(file):
+        if run_writer.averaged:
+            held_files.append(file)
+        elif file_done is not None:
+            file_done(file)
+
+    if workers > 1 and (file_count == "?" or file_count > 1):
+        generate_queries_parallel(data_type, data_type_path, files, query_generator, stream, workers, run_writer,
+                                  read_stats, file_written, file_hash)
+        files = []
 
     for n, file in enumerate(files):
-        print(f"Processing {query_generator.__name__} file {n+1}/{len(files)}")
+        print(f"Processing {query_generator.__name__} file {n+1}/{file_count}")
         file_path = os.path.join(data_type_path, file)
-        try:
-            table = pq.read_table(file_path)
-        except Exception as e:
-            print(f"Error reading file {file}: {e}")
-            continue
+        metrics = new_file_metrics(data_type, query_generator.__name__, file)
+
+        for queries in transform_file(file_path, query_generator, stream, read_stats, metrics, file_hash(file)):
+            # Write the queries generated for the current table
+            write_file_queries(run_writer, queries, metrics)
+            print_progress(metrics, n + 1, file_count)
+
+        finish_file_metrics(metrics)
+        if file not in read_stats.get('failed_files', []) and not metrics['failed_batches']:
+            file_written(file)
+
+    # Write the relationships averaged over the run, their metrics are reported under AVERAGED_METRICS_FILE
+    if run_writer.averaged:
+        metrics = new_file_metrics(data_type, query_generator.__name__, AVERAGED_METRICS_FILE)
+        for queries in run_writer.averaged_queries():
+            write_file_queries(writer, queries, metrics)
+        finish_file_metrics(metrics)
+        if file_done is not None and not metrics['failed_batches']:
+            for file in held_files:
+                file_done(file)
+
+    if 'files' in read_stats:
+        print_read_stats(data_type, query_generator, read_stats)
+    return read_stats
+
+
+# Name of the ingest report entry of the relationships averaged over a query generator run
+AVERAGED_METRICS_FILE = "(averaged relationships)"
+
+# Read a parquet file and apply the query generator to its tables, yielding the queries of each table. The time spent
+# reading and transforming, the rows read and the entries and estimated payload bytes generated are added to metrics.
+# With INGEST_CACHE the queries are read from the ingest cache when the file and the generator didn't change since
+# they were cached, otherwise they are added to it once the whole file is transformed (see ingest_cache_entry). The
+# file is hashed for its cache entry unless its hash is given.
+def transform_file(file_path, query_generator, stream, read_stats, metrics, file_hash=None):
+    # Parquet figures of the file, which the ingest estimates are calibrated on (see ingest_estimate.py)
+    try:
+        footer = parquet_footer(file_path, INGEST_MEMORY_MB, query_generator)
+        metrics['file_rows'], metrics['decoded_bytes'] = footer['rows'], footer['decoded_bytes']
+    except (OSError, pa.ArrowException):
+        pass
+
+    entry = None
+    if INGEST_CACHE:
+        entry = ingest_cache_entry(file_hash or file_fingerprint(file_path)['hash'], query_generator, data_version)
+    if entry is not None and os.path.isdir(entry):
+        metrics['cache'] = 'hit'
+        for rows_in, queries in read_cached_queries(entry, metrics):
+            metrics['rows_in'] += rows_in
+            count_query_entries(queries, metrics)
+            yield queries
+        return
 
-        # Generate queries for the current table
+    cache = new_cache_writer(entry) if entry is not None else None
+    metrics['cache'] = 'miss' if entry is not None else None
+    tables = read_parquet_tables(file_path, INGEST_MEMORY_MB, stream,
+                                 columns=getattr(query_generator, 'columns', None),
+                                 row_filter=getattr(query_generator, 'row_filter', None), stats=read_stats)
+    while True:
+        start = time.perf_counter()
+        table = next(tables, None)
+        metrics['read_seconds'] += time.perf_counter() - start
+        if table is None:
+            break
+
+        start = time.perf_counter()
         queries = query_generator(table)
+        metrics['transform_seconds'] += time.perf_counter() - start
+        metrics['rows_in'] += table.num_rows
+        count_query_entries(queries, metrics)
+        if cache is not None:
+            cache_queries(cache, table.num_rows, queries)
+        del table
+        yield queries
+
+    if cache is not None and os.path.basename(file_path) not in read_stats.get('failed_files', []):
+        commit_cache_writer(cache)
+
+
+# Pass the queries of a file to the writer, adding the write time and the write counters it returns to metrics.
+# Writers that don't report counters (see BulkImportWriter) return None.
+def write_file_queries(writer, queries, metrics):
+    start = time.perf_counter()
+    counters = writer(queries)
+    metrics['write_seconds'] += time.perf_counter() - start
+    for key, value in (counters or {}).items():
+        metrics[key] += value
+
+
+# Writer passing the queries of a query generator run on to another writer, without the entries already passed on in
+# the run. The query generators deduplicate the entries of each batch (see unique_rows and average_rows), but the same
+# node or relationship can come in several batches and files. A node is passed on again only if its properties
+# changed, as the last value is the one MERGE ... SET leaves, and a Dataset node or relationship only once. Only the
+# node keys and the digests of the other values passed on are kept (see entry_digest).
+# The relationships with averaged properties are held back: the sums and counts of their values are kept in Arrow
+# tables, compacted as they grow, and averaged_queries returns the queries writing each of them once with its average
+# over the whole run, at the end of the run (see generate_queries).
+class DeduplicatingWriter:
+    def __init__(self, writer):
+        self.writer = writer
+        self.datasets = set()
+        # Node label -> {key: digest of the properties}, relationship type -> digests of the relationships
+        self.nodes = {}
+        self.relationships = {}
+        # (relationship type, dataset) -> the query, parameters and writes of the held back relationships, the tables
+        # of their sums and counts and the number of rows in the tables
+        self.averaged = {}
+
+    def __call__(self, queries):
+        new_queries = []
+        for query, params, writes in queries:
+            if 'dataset' in writes:
+                if writes['dataset'] in self.datasets:
+                    continue
+                self.datasets.add(writes['dataset'])
+            elif 'node' in writes:
+                params = {**params, 'data': self.new_nodes(writes, params['data'])}
+            elif writes['averaged']:
+                self.hold_averaged(query, params, writes)
+                continue
+            else:
+                params = {**params, 'data': self.new_relationships(writes, params)}
+            if 'data' not in params or params['data']:
+                new_queries.append((query, params, writes))
+        return self.writer(new_queries) if new_queries else None
+
+    def new_nodes(self, writes, data):
+        props_to_keys = writes['properties']
+        key = props_to_keys[NODE_KEYS[writes['node']]]
+        columns = list(props_to_keys.values())
+        passed = self.nodes.setdefault(writes['node'], {})
+        rows = []
+        for row in data:
+            row_digest = entry_digest(row[column] for column in columns)
+            if passed.get(row[key]) != row_digest:
+                passed[row[key]] = row_digest
+                rows.append(row)
+        return rows
+
+    def new_relationships(self, writes, params):
+        columns = relationship_merge_keys(writes)
+        passed = self.relationships.setdefault(writes['relationship'], set())
+        rows = []
+        for row in params['data']:
+            row_digest = entry_digest([params['dataset']] + [row[column] for column in columns])
+            if row_digest not in passed:
+                passed.add(row_digest)
+                rows.append(row)
+        return rows
+
+    # Add the sums and counts of the averaged properties of a batch to the held back relationships. The tables are
+    # compacted, summing the rows of the same relationship, once they hold twice the rows of the last compaction.
+    def hold_averaged(self, query, params, writes):
+        held = self.averaged.setdefault((writes['relationship'], params['dataset']), {
+            'query': query, 'params': {**params, 'data': []}, 'writes': writes, 'tables': [], 'rows': 0,
+            'compacted_rows': 0})
+        if not params['data']:
+            return
+        table = pa.Table.from_pylist(params['data'])
+        columns = {key: table.column(key) for key in relationship_merge_keys(writes)}
+        for prop in writes['averaged']:
+            count = table.column(f"{prop}_count")
+            columns[f"{prop}_sum"] = pc.multiply(pc.fill_null(pc.cast(table.column(prop), pa.float64()), 0), count)
+            columns[f"{prop}_count"] = count
+        held['tables'].append(pa.table(columns))
+        held['rows'] += table.num_rows
+        if held['rows'] > 2 * max(held['compacted_rows'], INGEST_BATCH_SIZE):
+            self.compact(held)
+
+    def compact(self, held):
+        keys = relationship_merge_keys(held['writes'])
+        table = pa.concat_tables(held['tables'], promote=True).combine_chunks()
+        values = [column for column in table.column_names if column not in keys]
+        sums = table.group_by(keys).aggregate([(value, 'sum') for value in values])
+        table = pa.table({**{key: sums.column(key) for key in keys},
+                          **{value: sums.column(f"{value}_sum") for value in values}})
+        held.update(tables=[table], rows=table.num_rows, compacted_rows=table.num_rows)
+        return table
+
+    # Queries writing the held back relationships with their averages, in lists of batch_size entries
+    def averaged_queries(self, batch_size=None):
+        batch_size = batch_size or INGEST_BATCH_SIZE
+        for held in self.averaged.values():
+            if not held['tables']:
+                continue
+            table = self.compact(held)
+            columns = {key: table.column(key) for key in relationship_merge_keys(held['writes'])}
+            for prop in held['writes']['averaged']:
+                count = table.column(f"{prop}_count")
+                columns[prop] = pc.if_else(pc.greater(count, 0),
+                                           pc.divide(table.column(f"{prop}_sum"), pc.cast(count, pa.float64())), None)
+                columns[f"{prop}_count"] = count
+            table = pa.table(columns)
+            for start in range(0, table.num_rows, batch_size):
+                data = table.slice(start, batch_size).to_pylist()
+                yield [(held['query'], {**held['params'], 'data': data}, held['writes'])]
+        self.averaged.clear()
+
+# Digest of the values of an entry: the 128-bit BLAKE2b of their repr, which can be kept for every entry of a run
+# without the collisions of hash()
+def entry_digest(values):
+    return hashlib.blake2b(repr(tuple(values)).encode(), digest_size=16).digest()
+
+# Data keys identifying the relationships of a relationship query: the keys of its start and end nodes and of the
+# properties of its MERGE pattern
+def relationship_merge_keys(writes):
+    return list(dict.fromkeys([writes['start'][1], writes['end'][1]] + list(writes['properties'].values())))
+
+
+# Decode the parquet files of a query generator in a pool of worker processes. Each worker reads one file at a time,
+# applies the query generator to its batches and puts the resulting queries on a bounded queue. This process takes
+# them off the queue and passes them to the writer, so at most INGEST_QUEUE_SIZE batches wait in memory while the
+# workers run ahead of Neo4j. Files given as an iterator (see feed_task_files) are submitted by a separate thread as
+# they come, so the batches of the files already submitted are written while the next file is awaited. file_hash
+# returns the hash of a file if it was already fingerprinted, for its ingest cache entry (see transform_file).
+def generate_queries_parallel(data_type, data_type_path, files, query_generator, stream, workers, writer, read_stats,
+                              file_done=None, file_hash=None):
+    # Forking a process with several threads can leave locks held in the child, so when other threads run, e.g. when
+    # generate_queries runs on a scheduler thread or while the files are downloaded, the workers are forked by a fork
+    # server instead: a single threaded process started once, which imports this module before forking them. Where
+    # there is no fork server the workers are spawned, which is slower as every worker imports this module again.
+    if threading.active_count() == 1 and isinstance(files, list):
+        context = multiprocessing.get_context()
+    elif "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+    else:
+        context = multiprocessing.get_context("spawn")
+    work_queue = context.Queue(maxsize=INGEST_QUEUE_SIZE)
+    max_workers = min(workers, len(files)) if isinstance(files, list) else workers
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                             initializer=init_ingest_worker, initargs=(work_queue, data_version)) as executor:
+        futures = []
+        # Metrics of the files being processed, the workers send their read and transform metrics with the last batch
+        file_metrics = {}
+        submitted = threading.Event()
+        submit_errors = []
+
+        def submit_files():
+            try:
+                for file in files:
+                    file_metrics[file] = new_file_metrics(data_type, query_generator.__name__, file)
+                    futures.append(executor.submit(generate_file_queries, data_type, os.path.join(data_type_path, file),
+                                                   query_generator.__name__, stream,
+                                                   file_hash(file) if file_hash is not None else None))
+            except Exception as e:
+                submit_errors.append(e)
+            finally:
+                submitted.set()
+                if not isinstance(files, list):
+                    # Wake up the loop below, which may be waiting for the batches of files that were all processed
+                    work_queue.put(('submitted', None))
+
+        if isinstance(files, list):
+            submit_files()
+            file_count = len(files)
+        else:
+            submitter = threading.Thread(target=submit_files, name=f"submit-{query_generator.__name__}", daemon=True)
+            submitter.start()
+            file_count = "?"
+
+        completed_files = 0
+        while not submitted.is_set() or completed_files < len(futures):
+            try:
+                message, payload = work_queue.get(timeout=1)
+            except queue.Empty:
+                # A worker that died (e.g. killed for using too much memory) never reports its file as done
+                for future in list(futures):
+                    if future.done() and future.exception() is not None:
+                        raise future.exception()
+                continue
+
+            if message == 'submitted':
+                continue
+            elif message == 'queries':
+                file, queries = payload
+                write_file_queries(writer, queries, file_metrics[file])
+                print_progress(file_metrics[file], completed_files + 1, file_count)
+            else:
+                file, file_stats, worker_metrics = payload
+                completed_files += 1
+                print(f"Processed {query_generator.__name__} file {completed_files}/{file_count}")
+                for key, value in file_stats.items():
+                    read_stats[key] = read_stats[key] + value if key in read_stats else value
+                metrics = file_metrics[file]
+                for key in ('read_seconds', 'transform_seconds', 'rows_in', 'rows_out', 'payload_bytes'):
+                    metrics[key] = worker_metrics[key]
+                finish_file_metrics(metrics, worker_metrics)
+                if file_done is not None and 'failed_files' not in file_stats and not metrics['failed_batches']:
+                    file_done(file)
+
+        if submit_errors:
+            raise submit_errors[0]
+
+
+# Queue shared with the parent process, set in each worker process by init_ingest_worker
+worker_queue = None
+
+def init_ingest_worker(work_queue, version):
+    global worker_queue, data_version
+    worker_queue = work_queue
+    data_version = version
+    if INGEST_TRACE_MEMORY:
+        tracemalloc.start()
+
+# Worker process task: decode one parquet file and put the queries generated for each of its batches on the queue,
+# with the file name, followed by a 'done' message with the file name, read statistics and metrics of the file
+def generate_file_queries(data_type, file_path, generator_name, stream, file_hash=None):
+    query_generator = globals()[generator_name]
+    file = os.path.basename(file_path)
+    read_stats = {}
+    metrics = new_file_metrics(data_type, generator_name, file)
+    try:
+        for queries in transform_file(file_path, query_generator, stream, read_stats, metrics, file_hash):
+            worker_queue.put(('queries', (file, queries)))
+    finally:
+        finish_file_metrics(metrics, report=False)
+        worker_queue.put(('done', (file, read_stats, metrics)))
+
+
+# Split the 'data' parameter of a query into batches of at most batch_size entries
+def batch_query_params(params, batch_size):
+    data = params.get('data')
+    if data is None or len(data) <= batch_size:
+        yield params
+        return
+    for start in range(0, len(data), batch_size):
+        yield {**params, 'data': data[start:start + batch_size]}
+
+
+# Execute the queries generated for one table in order. The 'data' parameter of a query is written in batches of
+# INGEST_BATCH_SIZE entries, one write transaction each, so neither the client nor the server ever holds more than a
+# batch of a file in a single message or transaction. The relationships are written by node element id
+# (see resolve_relationship_ids) unless INGEST_RESOLVE_IDS is false.
+# Returns the write counters of the queries (see add_write_counters).
+# With more than one edge writer (INGEST_EDGE_WRITERS) the batches of a node query, whose keys are unique, are written
+# concurrently, and relationship queries are split into partitions written concurrently (see
+# write_relationship_partitions).
+def execute_queries(queries, batch_size=None, edge_writers=None):
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    edge_writers = edge_writers or INGEST_EDGE_WRITERS
+    counters = dict.fromkeys(WRITE_COUNTERS, 0)
+    for query, params, writes in queries:
+        if INGEST_RESOLVE_IDS and 'relationship' in writes:
+            query, params, writes = resolve_relationship_ids(params, writes)
+        if edge_writers > 1 and 'relationship' in writes:
+            results = write_relationship_partitions(query, params, writes, edge_writers, batch_size)
+        elif edge_writers > 1 and 'node' in writes:
+            pool = edge_writer_pool(edge_writers)
+            results = [future.result() for future in [pool.submit(try_write_batch, query, batch_params, writes)
+                                                      for batch_params in batch_query_params(params, batch_size)]]
+        else:
+            results = [try_write_batch(query, batch_params, writes)
+                       for batch_params in batch_query_params(params, batch_size)]
+        for result in results:
+            add_write_counters(counters, result)
+    return counters
+
+
+# Neo4j driver shared by the writer threads: its connection pool provides the sessions of write_batch, where neomodel
+# opens a connection per thread. It connects to the neomodel database URL (see ensure_neo4j_connection).
+neo4j_driver = None
+neo4j_driver_lock = threading.Lock()
+
+def get_neo4j_driver():
+    global neo4j_driver
+    with neo4j_driver_lock:
+        if neo4j_driver is None:
+            url = urlparse(config.DATABASE_URL)
+            neo4j_driver = GraphDatabase.driver(f"{url.scheme}://{url.hostname}:{url.port or 7687}",
+                                                auth=(url.username, url.password),
+                                                max_transaction_retry_time=INGEST_RETRY_SECONDS)
+        return neo4j_driver
+
+
+# Write one batch of a query in its own write transaction. execute_write retries the transaction on transient errors
+# (deadlocks, leader changes) for up to INGEST_RETRY_SECONDS, which is safe as the queries MERGE what they write.
+# Returns the update counters of the transaction.
+def write_batch(query, params):
+    with get_neo4j_driver().session() as session:
+        return session.execute_write(run_write_query, query, params)
+
+def run_write_query(tx, query, params):
+    return tx.run(query, params).consume().counters
+
+# Write one batch with write_batch, reporting it instead of raising when it fails. Returns the counters of the
+# transaction, or None when it failed.
+def try_write_batch(query, params, writes):
+    try:
+        return write_batch(query, params)
+    except (DriverError, Neo4jError) as e:
+        target = writes.get('node') or writes.get('relationship') or 'Dataset'
+        entries = len(params['data']) if 'data' in params else 1
+        print(f"Failed to write a batch of {entries} {target} entries: {e}")
+        return None
+
+
+# Split the entries of a relationship query into cells by the hash of their start and end node keys, and group the
+# cells into rounds whose cells share no start or end node. MERGE locks both nodes of a relationship, so the cells of
+# a round can be written at the same time without waiting on each other's locks or deadlocking. When both ends have
+# the same label a node can be the start of one cell and the end of another, so the buckets of both ends must be
+# distinct within a round. Entries with a null key are dropped, MATCH wouldn't find their nodes.
+def partition_relationship_rows(data, writes, partitions):
+    (start_label, start_key), (end_label, end_key) = writes['start'], writes['end']
+    cells = {}
+    for row in data:
+        start, end = row[start_key], row[end_key]
+        if start is None or end is None:
+            continue
+        cells.setdefault((hash(start) % partitions, hash(end) % partitions), []).append(row)
 
-        # Execute the queries concurrently within a single transaction
-        with db.transaction:
-            for query, params in queries:
-                db.cypher_query(query, params=params)
+    # Largest cells first, each in the first round it doesn't conflict with
+    rounds = []
+    for (start_bucket, end_bucket), rows in sorted(cells.items(), key=lambda cell: -len(cell[1])):
+        if start_label == end_label:
+            buckets = {start_bucket, end_bucket}
+        else:
+            buckets = {('start', start_bucket), ('end', end_bucket)}
+        for used, cells_in_round in rounds:
+            if not used & buckets:
+                used |= buckets
+                cells_in_round.append(rows)
+                break
+        else:
+            rounds.append((buckets, [rows]))
+    return [cells_in_round for _, cells_in_round in rounds]
+
+
+# Element ids of the nodes by label: an Arrow array of the NODE_KEYS values of the nodes, and the list of their
+# element ids at the same positions. They are read from Neo4j the first time a relationship needs the label, which is
+# after the node generators creating the label are done (see schedule_query_generators), and kept until the next
+# ingest. The keys are only used as the value set of index_in, so they stay in Arrow buffers instead of a dictionary;
+# the ids are sent as they are, so they are kept as the Python strings put in the Cypher parameters.
+node_ids = {}
+node_ids_lock = threading.Lock()
+
+def clear_node_ids():
+    with node_ids_lock:
+        node_ids.clear()
+
+def get_node_ids(label):
+    with node_ids_lock:
+        if label not in node_ids:
+            key = NODE_KEYS[label]
+            query = (f"MATCH (n:{label}) WHERE n.data_version = $data_version AND n.{key} IS NOT NULL "
+                     f"RETURN n.{key}, elementId(n)")
+            with get_neo4j_driver().session() as session:
+                records = session.execute_read(lambda tx: tx.run(query, data_version=data_version).values())
+            node_ids[label] = (pa.array([record[0] for record in records]), [record[1] for record in records])
+            print(f"Resolved the element ids of {len(records)} {label} nodes")
+        return node_ids[label]
+
+# Element ids of the nodes of a label with the given keys, None for the keys without a node
+def lookup_node_ids(label, values):
+    keys, ids = get_node_ids(label)
+    if len(keys) == 0:
+        return [None] * len(values)
+    positions = pc.index_in(pa.array(values).cast(keys.type), value_set=keys).fill_null(-1).to_numpy()
+    return [ids[position] if position >= 0 else None for position in positions.tolist()]
+
+# Replace the start and end node keys of a relationship query's entries by the element ids of the nodes, and the query
+# by one matching the nodes on their ids (see relationship_query). The entries without a start or end node are
+# dropped, as MATCH wouldn't find them. Returns the new query, parameters and writes.
+def resolve_relationship_ids(params, writes):
+    (start_label, start_key), (end_label, end_key) = writes['start'], writes['end']
+    data = params['data']
+    start_ids = lookup_node_ids(start_label, [row[start_key] for row in data])
+    end_ids = lookup_node_ids(end_label, [row[end_key] for row in data])
+    fields = list(dict.fromkeys(list(writes['properties'].values()) + writes['averaged']))
+    resolved = [
+        {'start_id': start_id, 'end_id': end_id, **{field: row[field] for field in fields}}
+        for row, start_id, end_id in zip(data, start_ids, end_ids)
+        if start_id is not None and end_id is not None
+    ]
+    writes = {**writes, 'start': (start_label, 'start_id'), 'end': (end_label, 'end_id')}
+    return relationship_query(writes, by_id=True), {**params, 'data': resolved}, writes
+
+
+# Thread pools of the edge writers by number of writers, they live as long as the process
+edge_writer_pools = {}
+edge_writer_pools_lock = threading.Lock()
+
+def edge_writer_pool(writers):
+    with edge_writer_pools_lock:
+        if writers not in edge_writer_pools:
+            edge_writer_pools[writers] = ThreadPoolExecutor(max_workers=writers, thread_name_prefix="edge-writer")
+        return edge_writer_pools[writers]
+
+
+# Write a relationship query with 'writers' concurrent sessions: the entries are partitioned with
+# partition_relationship_rows and the cells of each round are written in parallel, one round after the other.
+# Hashing into twice as many buckets as writers keeps the writers busy: with as many buckets as writers a round of
+# Target-Target relationships only has writers / 2 cells, and the rounds are less even.
+# Returns the results of try_write_batch for every batch.
+def write_relationship_partitions(query, params, writes, writers, batch_size=None):
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    pool = edge_writer_pool(writers)
+    results = []
+    for cells in partition_relationship_rows(params['data'], writes, 2 * writers):
+        futures = [pool.submit(try_write_batch, query, batch_params, writes)
+                   for rows in cells for batch_params in batch_query_params({**params, 'data': rows}, batch_size)]
+        results += [future.result() for future in futures]
+    return results
+
+
+# Generate the neo4j-admin import files for the input directory instead of writing to Neo4j (see BulkImportWriter).
+# A cold load of an empty database with these files skips the transactions and MERGE lookups of the Cypher path.
+def write_import_files(input_dir, output_dir, workers=None, concurrency=None):
+    set_dataset_name()
+    start = time.perf_counter()
+    writer = BulkImportWriter(output_dir, data_version, NODE_KEYS)
+    schedule_query_generators(input_dir, concurrency, workers=workers, writer=writer)
+    writer.close()
+    print(f"Import files written in {time.perf_counter() - start:.1f}s")
 
 
 # Generate Cypher query for Dataset nodes
 def create_dataset_cypher_query(node_label):
     dataset_name = f"{data_version} {node_label}"
-    enabled = True
+    enabled = False
     source = node_label
     timestamp = round(time.time() * 1000)
 
+    # The Dataset nodes of a data version are enabled once it is switched to (see switch_data_version)
     query = f"""
     MERGE (d:Dataset {{ dataset: '{dataset_name}' }})
     ON CREATE SET d.enabled = {enabled},
                   d.source = '{source}',
-                  d.timestamp = {timestamp}
+                  d.timestamp = {timestamp},
+                  d.data_version = '{data_version}'
     RETURN d
     """
     return query
 
 
+# Declare the parquet columns a query generator reads and the rows it needs. Columns are field names, nested fields
+# are separated by dots ('tissues.efo_code'); row_filter is a pyarrow.compute expression. The reader only decodes
+# these columns and drops the rows not matching row_filter before the table is passed to the generator.
+def reads(columns, row_filter=None):
+    def decorator(query_generator):
+        query_generator.columns = columns
+        query_generator.row_filter = row_filter
+        return query_generator
+    return decorator
+
+# Declare the node labels a query generator creates and the node labels its relationships need. The ingest scheduler
+# runs a generator once every generator creating one of its required labels is done (see schedule_query_generators).
+def graph_labels(creates=(), requires=()):
+    def decorator(query_generator):
+        query_generator.creates = list(creates)
+        query_generator.requires = list(requires)
+        return query_generator
+    return decorator
+
+# Declare that a query generator averages relationship properties over the entries of all its files (see
+# DeduplicatingWriter). When one of its files is new or changed it reads all of them again, as the averages can't be
+# updated from the changed files alone.
+def averaged_over_files(query_generator):
+    query_generator.averaged_over_files = True
+    return query_generator
+
+# Row filter keeping the rows where none of the given columns is null
+def valid_rows(*columns):
+    expression = pc.field(columns[0]).is_valid()
+    for column in columns[1:]:
+        expression = expression & pc.field(column).is_valid()
+    return expression
+
+
+# Column helpers used by the query generators. They work on whole Arrow columns so the generators never have to
+# convert a table to pandas or iterate over its rows in Python.
+
+# Drop the rows of a table where any of the given columns is null
+def drop_null_rows(table, columns):
+    mask = None
+    for column in columns:
+        valid = pc.is_valid(table.column(column))
+        mask = valid if mask is None else pc.and_(mask, valid)
+    return table if mask is None else table.filter(mask)
+
+# Flatten a list column of a table. Returns the flattened values and, for each value, the index of the row it came
+# from, which can be passed to pc.take to repeat the row's other columns. Null lists are skipped.
+def flatten_list_column(table, column):
+    values = table.column(column)
+    return pc.list_flatten(values), pc.list_parent_indices(values)
+
+# Get a child field of a struct array by name, nested fields are separated by dots (e.g. 'rna.value')
+def struct_field(values, name):
+    for field_name in name.split('.'):
+        values = pc.struct_field(values, [values.type.get_field_index(field_name)])
+    return values
+
+
+# Property identifying the nodes of each label, unique in the database. Nodes are merged on it, relationships match
+# their start and end nodes on it, and the bulk import files use it as node id.
+NODE_KEYS = {
+    'Target': 'ensembleId',
+    'Pathway': 'pathwayId',
+    'AdverseEvent': 'meddraId',
+    'Drug': 'chemblId',
+    'MousePhenotype': 'mousePhenotypeId',
+    'Disease': 'diseaseId',
+    'TargetPathway': 'id',
+    'Gwas': 'id',
+    'Baseline_Expression': 'efo_code',
+}
+
+# Query generators return a list of (query, params, writes) tuples. writes describes what the query merges, so the
+# writers that don't run the Cypher query (see BulkImportWriter) map the data to the same nodes and relationships:
+# - {'dataset': name, 'source': node_label} for a Dataset node,
+# - {'node': label, 'properties': {property: data key}} for one node per entry of params['data'],
+# - {'relationship': type, 'start': (label, data key), 'end': (label, data key), 'properties': {property: data key},
+#   'averaged': [property]} for one relationship per entry of params['data'] between the nodes whose NODE_KEYS
+#   property equals the given data keys. The averaged properties are not part of the MERGE, they hold the average
+#   of the value over the duplicate entries, whose number is in the '<property>_count' data key.
+# Every node and relationship also gets the params['dataset'] value as 'dataset' property.
+# The entries are deduplicated within each batch, and across the batches and files of a query generator run by
+# DeduplicatingWriter, so each node and relationship is written once.
+
+# Keep a single row of a table for each distinct value of the key columns: the last one, which is the one successive
+# MERGE ... SET statements would leave in the database. The rows keep their order.
+# The columns are combined into single chunks first: the columns of a table built from filtered or flattened columns
+# can be chunked differently, which group_by doesn't handle in PyArrow 10 (it returns wrong groups or crashes).
+def unique_rows(table, keys):
+    table = table.combine_chunks()
+    rows = table.append_column('row_index', pa.array(np.arange(table.num_rows)))
+    last_rows = rows.group_by(keys).aggregate([('row_index', 'max')]).column('row_index_max')
+    return table.take(last_rows.take(pc.sort_indices(last_rows)))
+
+# Average the value columns of a table over the rows with the same key columns, keeping one row per key. The
+# '<value>_count' columns hold the number of values averaged, so the averages of several tables can be combined.
+def average_rows(table, keys, values):
+    averages = table.combine_chunks().group_by(keys).aggregate(
+        [(value, 'mean') for value in values] + [(value, 'count') for value in values])
+    return pa.table({
+        **{key: averages.column(key) for key in keys},
+        **{value: averages.column(f"{value}_mean") for value in values},
+        **{f"{value}_count": averages.column(f"{value}_count") for value in values}
+    })
+
+# Generate the Dataset node query of a node label
+def create_dataset_query(node_label):
+    return (create_dataset_cypher_query(node_label), {}, {'dataset': f"{data_version} {node_label}", 'source': node_label})
 
 # Generate Cypher queries for node creation based on a given table, node_label, and properties to columns mapping
 def create_cypher_query_nodes(table, node_label, props_to_columns):
-    # Convert the table to a pandas DataFrame
-    df = table.to_pandas()
-
-    dataset = f"{data_version} {node_label}"
-    # Prepare data for the Cypher query
-    data = []
-    for _, row in df.iterrows():
-        entry_data = {column: row[column] for _, column in props_to_columns.items()}
-        # Skip the entry if any of the values are null
-        if any(value is None for value in entry_data.values()):
-            continue
-        data.append(entry_data)
-
-    # APOC query for creating or merging nodes in batch
+    # Prepare data for the Cypher query, skipping the entries where any of the values are null
+    columns = list(props_to_columns.values())
+    table = drop_null_rows(table, columns)
+    return create_cypher_query_node_batch(node_label, props_to_columns,
+                                          {column: table.column(column) for column in columns})
+
+# Generate Cypher queries merging one node per distinct key of the columns (a dictionary of key -> Arrow column),
+# props_to_keys maps the node properties to the column keys. The nodes are merged on their NODE_KEYS property,
+# backed by a uniqueness constraint (see create_indexes), and the other properties and the dataset are set on them.
+# Entries without a key are skipped. dataset_label names the Dataset node, it defaults to the node label.
+def create_cypher_query_node_batch(node_label, props_to_keys, columns, dataset_label=None):
+    dataset_label = dataset_label or node_label
+    dataset = f"{data_version} {dataset_label}"
+    node_key = NODE_KEYS[node_label]
+    set_props = ''.join(f"n.{prop} = prop.{key}, " for prop, key in props_to_keys.items() if prop != node_key)
+    # Send each node once, so no two batches merge the same key
+    data = unique_rows(pa.table(columns), [props_to_keys[node_key]]).to_pylist()
+
+    # Query merging the nodes of a batch
     query = f"""
-    CALL apoc.periodic.iterate(
-        'UNWIND $props as prop RETURN prop',
-        'MERGE (:{node_label} {{{', '.join([f"{prop}: prop.{column}" for prop, column in props_to_columns.items()])}, dataset: $dataset}})',
-        {{params: {{props: $data, dataset: $dataset}}, batchSize: 1000, parallel: true}}
-    )
+    UNWIND $data AS prop
+    WITH prop WHERE prop.{props_to_keys[node_key]} IS NOT NULL
+    MERGE (n:{node_label} {{data_version: $data_version, {node_key}: prop.{props_to_keys[node_key]}}})
+    SET {set_props}n.dataset = $dataset
+    """
+    writes = {'node': node_label, 'properties': props_to_keys}
+    params = {'data': data, 'dataset': dataset, 'data_version': data_version}
+    # Include the dataset creation query and return a list of queries to be executed
+    return [create_dataset_query(dataset_label), (query, params, writes)]
+
+# Generate the Cypher query merging one relationship per distinct entry of the columns (a dictionary of key -> Arrow
+# column). start and end are the (label, column key) of the nodes to connect, matched on their NODE_KEYS property.
+# props_to_keys maps the relationship properties that are part of the MERGE to column keys. The averaged properties
+# are averaged over the entries with the same nodes and MERGE properties, and set on the relationship. As a
+# relationship can come in several batches and files, the query generator should be declared with
+# @averaged_over_files, see DeduplicatingWriter.
+def create_cypher_query_relationships(relationship_type, start, end, columns, dataset, props_to_keys=None,
+                                      averaged=()):
+    props_to_keys = props_to_keys or {}
+    (_, start_key), (_, end_key) = start, end
+
+    # Send each relationship once, with the average of its averaged properties and the number of values averaged
+    table = pa.table(columns)
+    keys = list(dict.fromkeys([start_key, end_key] + list(props_to_keys.values())))
+    if averaged:
+        table = average_rows(table, keys, list(averaged))
+    else:
+        table = unique_rows(table.select(keys), keys)
+    data = table.to_pylist()
+
+    writes = {'relationship': relationship_type, 'start': start, 'end': end, 'properties': props_to_keys,
+              'averaged': list(averaged)}
+    return (relationship_query(writes), {'data': data, 'dataset': dataset, 'data_version': data_version}, writes)
+
+# Query merging the relationships described by writes for a batch of entries. The start and end nodes are matched on
+# their data version and NODE_KEYS property, or on their element id with by_id (see resolve_relationship_ids).
+def relationship_query(writes, by_id=False):
+    (start_label, start_key), (end_label, end_key) = writes['start'], writes['end']
+    merge_props = ''.join(f", {prop}: item.{key}" for prop, key in writes['properties'].items())
+    set_props = ''.join(f"\n    SET rel.{prop} = item.{prop}" for prop in writes['averaged'])
+    if by_id:
+        match = f"""MATCH (from:{start_label}) WHERE elementId(from) = item.{start_key}
+    MATCH (to:{end_label}) WHERE elementId(to) = item.{end_key}"""
+    else:
+        match = (f"MATCH (from:{start_label} {{data_version: $data_version, {NODE_KEYS[start_label]}: item.{start_key}}}), "
+                 f"(to:{end_label} {{data_version: $data_version, {NODE_KEYS[end_label]}: item.{end_key}}})")
+    return f"""
+    UNWIND $data AS item
+    {match}
+    MERGE (from)-[rel:{writes['relationship']} {{dataset: $dataset{merge_props}}}]->(to){set_props}
     """
-    # Include the dataset creation query
-    dataset_query = create_dataset_cypher_query(node_label)
-    # Return a list of queries to be executed
-    return [(dataset_query, {}), (query, {'data': data, 'dataset': dataset})]
 
 # Generate Cypher queries for Target nodes
+@graph_labels(creates=['Target'])
+@reads(['id', 'approvedSymbol', 'approvedName'])
 def create_cypher_query_targets(table):
     return create_cypher_query_nodes(table, 'Target', {
         'name': 'approvedName',
@@ -303,37 +1422,25 @@ def create_cypher_query_targets(table):
     })
 
 # From legacy code -- not sure function or data that corresponds to this
+@graph_labels(creates=['Pathway'])
+@reads(['pathways'], valid_rows('pathways'))
 def create_cypher_query_pathways(table):
-    # Convert the table to a pandas DataFrame
-    df = table.to_pandas()
-    node_label = 'Pathway'
-    dataset = f"{data_version} {node_label}"
-    # Prepare data for the Cypher query
-    data = []
-    for _, row in df.iterrows():
-        if row['pathways'] is None:
-            continue
-        for pathway in row['pathways']:
-            data.append({
-                'pathwayCode': pathway['pathway'],
-                'pathwayId': pathway['pathwayId'],
-                'topLevelTerm': pathway['topLevelTerm']
-            })
-
-    # APOC query for creating Pathway nodes in batch
-    query = """
-    CALL apoc.periodic.iterate(
-        'UNWIND $props as prop RETURN prop',
-        'MERGE (:Pathway {pathwayCode: prop.pathwayCode, pathwayId: prop.pathwayId, topLevelTerm: prop.topLevelTerm, dataset: $dataset})',
-        {params: {props: $data, dataset: $dataset}, batchSize: 1000, parallel: true}
-    )
-    """
-    # Include the dataset creation query
-    dataset_query = create_dataset_cypher_query(node_label)
-    # Return a list of queries to be executed
-    return [(dataset_query, {}), (query, {'data': data, 'dataset': dataset})]
+    # Prepare data for the Cypher query, one entry per pathway of every target
+    pathways, _ = flatten_list_column(table, 'pathways')
+    columns = {
+        'pathwayCode': struct_field(pathways, 'pathway'),
+        'pathwayId': struct_field(pathways, 'pathwayId'),
+        'topLevelTerm': struct_field(pathways, 'topLevelTerm')
+    }
+    return create_cypher_query_node_batch('Pathway', {
+        'pathwayCode': 'pathwayCode',
+        'pathwayId': 'pathwayId',
+        'topLevelTerm': 'topLevelTerm'
+    }, columns)
 
 # Generate Cypher queries for AdverseEvent nodes
+@graph_labels(creates=['AdverseEvent'])
+@reads(['meddraCode', 'event'])
 def create_cypher_query_adverse_events(table):
     return create_cypher_query_nodes(table, 'AdverseEvent', {
         'meddraId': 'meddraCode',
@@ -341,6 +1448,8 @@ def create_cypher_query_adverse_events(table):
     })
 
 # Generate Cypher queries for Drug nodes
+@graph_labels(creates=['Drug'])
+@reads(['name', 'id'])
 def create_cypher_query_drugs(table):
     return create_cypher_query_nodes(table, 'Drug', {
         'drugId': 'name',
@@ -348,6 +1457,8 @@ def create_cypher_query_drugs(table):
     })
 
 # Generate Cypher queries for MousePhenotype nodes
+@graph_labels(creates=['MousePhenotype'])
+@reads(['modelPhenotypeLabel', 'modelPhenotypeId'])
 def create_cypher_query_mouse_phenotypes(table):
     return create_cypher_query_nodes(table, 'MousePhenotype', {
         'mousePhenotypeLabel': 'modelPhenotypeLabel',
@@ -355,6 +1466,8 @@ def create_cypher_query_mouse_phenotypes(table):
     })
 
 # Generate Cypher queries for Disease nodes
+@graph_labels(creates=['Disease'])
+@reads(['name', 'id'])
 def create_cypher_query_diseases(table):
     return create_cypher_query_nodes(table, 'Disease', {
         'name': 'name',
@@ -362,403 +1475,346 @@ def create_cypher_query_diseases(table):
     })
 
 # Generate Cypher queries for Disease nodes
+@graph_labels(creates=['TargetPathway'])
+@reads(['pathways.id', 'pathways.name'], valid_rows('pathways'))
 def create_cypher_query_pathway_types(table):
-    df = table.to_pandas()
-    node_label = 'TargetPathway'
-
-    dataset = f"{data_version} {node_label}"
-    # Prepare data for the Cypher query
-    data = []
-    for _, row in df.iterrows():
-        if row['pathways'] is None:
-            continue
-        for pathway in row['pathways']:
-            data.append({
-                'id': pathway['id'],
-                'name': pathway['name']
-            })
-
-    # APOC query for creating Evidence nodes in batch
-    query = """
-    CALL apoc.periodic.iterate(
-        'UNWIND $props as prop RETURN prop',
-        'MERGE (:TargetPathway {id: prop.id, name: prop.name, dataset: $dataset})',
-        {params: {props: $data, dataset: $dataset}, batchSize: 1000, parallel: true}
-    )
-    """
-    # Include the dataset creation query
-    dataset_query = create_dataset_cypher_query(node_label)
-    # Return a list of queries to be executed
-    return [(dataset_query, {}), (query, {'data': data, 'dataset': dataset})]
+    # Prepare data for the Cypher query, one entry per pathway of every evidence
+    pathways, _ = flatten_list_column(table, 'pathways')
+    columns = {
+        'id': struct_field(pathways, 'id'),
+        'name': struct_field(pathways, 'name')
+    }
+    return create_cypher_query_node_batch('TargetPathway', {'id': 'id', 'name': 'name'}, columns)
 
 # Generate Cypher queries for GWAS nodes
+@graph_labels(creates=['Gwas'])
+@reads(['trait_efos'], valid_rows('trait_efos'))
 def create_cypher_query_gwas(table):
-    df = table.to_pandas()
     # large data volume, filter to speed it up
-    df = df['trait_efos'].explode('trait_efos').drop_duplicates()
-
-    node_label = 'Gwas'
-    dataset = f"{data_version} {node_label}"
+    trait_efos, _ = flatten_list_column(table, 'trait_efos')
     # Prepare data for the Cypher query
-    data = [{'id': x} for x in df]
-
-    # APOC query for creating Evidence nodes in batch
-    query = """
-    CALL apoc.periodic.iterate(
-        'UNWIND $props as prop RETURN prop',
-        'MERGE (:Gwas {id: prop.id, dataset: $dataset})',
-        {params: {props: $data, dataset: $dataset}, batchSize: 1000, parallel: true}
-    )
-    """
-    # Include the dataset creation query
-    dataset_query = create_dataset_cypher_query(node_label)
-    # Return a list of queries to be executed
-    return [(dataset_query, {}), (query, {'data': data, 'dataset': dataset})]
+    columns = {'id': pc.unique(trait_efos)}
+    return create_cypher_query_node_batch('Gwas', {'id': 'id'}, columns)
 
 
 # Generate Cypher queries for hGene nodes
+@graph_labels(creates=['Baseline_Expression'])
+@reads(['tissues.efo_code', 'tissues.label'], valid_rows('tissues'))
 def create_cypher_query_baseline_expression(table):
-    # Convert the table to a pandas DataFrame
-    df = table.to_pandas()
-
-    node_label = 'baseline_expression'
-    dataset = f"{data_version} {node_label}"
-    # Prepare data for the Cypher query
-    data = []
-    for _, row in df.iterrows():
-        for i in row['tissues']:
-            data.append({
-                'efo_code': i['efo_code'],
-                'label': i['label']
-            })
-
-    # APOC query for creating Pathway nodes in batch
-    query = """
-    CALL apoc.periodic.iterate(
-        'UNWIND $props as prop RETURN prop',
-        'MERGE (:Baseline_Expression {efo_code: prop.efo_code, label: prop.label, dataset: $dataset})',
-        {params: {props: $data, dataset: $dataset}, batchSize: 1000, parallel: true}
-    )
-    """
-    # Include the dataset creation query
-    dataset_query = create_dataset_cypher_query(node_label)
-    # Return a list of queries to be executed
-    return [(dataset_query, {}), (query, {'data': data, 'dataset': dataset})]
+    # Prepare data for the Cypher query, one entry per tissue of every target
+    tissues, _ = flatten_list_column(table, 'tissues')
+    columns = {
+        'efo_code': struct_field(tissues, 'efo_code'),
+        'label': struct_field(tissues, 'label')
+    }
+    return create_cypher_query_node_batch('Baseline_Expression', {'efo_code': 'efo_code', 'label': 'label'}, columns,
+                                          dataset_label='baseline_expression')
 
 
 
-# Create indexes in the database for the nodes before running edge queries
+# Create a uniqueness constraint on the key of every node label (NODE_KEYS) before running the node and edge queries.
+# The node queries MERGE on the key only and the edge queries MATCH on it, the constraint's index serves both.
 def create_indexes():
-    db.cypher_query("CREATE INDEX chemblId_index IF NOT EXISTS FOR (d:Drug) ON (d.chemblId)")
-    db.cypher_query("CREATE INDEX ensembleId_index IF NOT EXISTS FOR (t:Target) ON (t.ensembleId)")
-    db.cypher_query("CREATE INDEX pathwayId_index IF NOT EXISTS FOR (p:Pathway) ON (p.pathwayId)")
-    db.cypher_query("CREATE INDEX meddraId_index IF NOT EXISTS FOR (a:AdverseEvent) ON (a.meddraId)")
-    db.cypher_query("CREATE INDEX mousePhenotypeId_index IF NOT EXISTS FOR (a:MousePhenotype) ON (a.mousePhenotypeId)")
-    db.cypher_query("CREATE INDEX diseaseId_index IF NOT EXISTS FOR (a:Disease) ON (a.diseaseId)")
+    for node_label, key in NODE_KEYS.items():
+        create_key_constraint(node_label, key)
     db.cypher_query("CREATE INDEX dataset_index IF NOT EXISTS FOR (a:Dataset) ON (a.dataset)")
-    db.cypher_query("CREATE INDEX baseline_expression_index IF NOT EXISTS FOR (a:Baseline_Expression) ON (a.efo_code)")
-    db.cypher_query("CREATE INDEX targetpathway_index IF NOT EXISTS FOR (a:TargetPathway) ON (a.id)")
-    db.cypher_query("CREATE INDEX gwas_index IF NOT EXISTS FOR (a:Gwas) ON (a.id)")
+    # The API looks up the targets of the live data version by symbol
+    db.cypher_query("CREATE INDEX Target_symbol_version_index IF NOT EXISTS FOR (n:Target) ON (n.data_version, n.symbol)")
+    # Dataset nodes created before data versions were loaded blue/green belong to the version they are named after,
+    # and were live
+    db.cypher_query("MATCH (d:Dataset) WHERE d.data_version IS NULL "
+                    "SET d.data_version = split(d.dataset, ' ')[0], d.activated = coalesce(d.timestamp, 0)")
+
+# Create the uniqueness constraint on the data version and key of a node label, which also serves the lookups of the
+# nodes of a data version. The constraint or plain index on the key alone created by earlier versions is dropped
+# first, once their nodes got the data_version property (see set_node_data_versions). If the database already has
+# several nodes with the same key (loaded before the constraints existed), an index is created instead.
+def create_key_constraint(node_label, key):
+    results, _ = db.cypher_query(
+        "SHOW INDEXES YIELD name, labelsOrTypes, properties, owningConstraint "
+        "WHERE labelsOrTypes = [$label] AND properties = [$key] RETURN name, owningConstraint",
+        {'label': node_label, 'key': key})
+    if results:
+        set_node_data_versions(node_label)
+    for name, constraint in results:
+        if constraint is None:
+            db.cypher_query(f"DROP INDEX {name} IF EXISTS")
+        else:
+            db.cypher_query(f"DROP CONSTRAINT {constraint} IF EXISTS")
+    try:
+        db.cypher_query(f"CREATE CONSTRAINT {node_label}_{key}_version_unique IF NOT EXISTS "
+                        f"FOR (n:{node_label}) REQUIRE (n.data_version, n.{key}) IS UNIQUE")
+    except Exception as e:
+        print(f"Could not create the uniqueness constraint on {node_label}.{key}, creating an index instead: {e}")
+        db.cypher_query(f"CREATE INDEX {node_label}_{key}_version_index IF NOT EXISTS "
+                        f"FOR (n:{node_label}) ON (n.data_version, n.{key})")
+
+# Set the data_version property of the nodes of a label loaded before it existed, from their dataset property
+# ('<data version> <label>'), in transactions of 10000 nodes
+def set_node_data_versions(node_label):
+    with get_neo4j_driver().session() as session:
+        session.run(f"MATCH (n:{node_label}) WHERE n.data_version IS NULL AND n.dataset IS NOT NULL "
+                    f"CALL {{ WITH n SET n.data_version = split(n.dataset, ' ')[0] }} IN TRANSACTIONS OF 10000 ROWS").consume()
 
 
 
 # Parse the Gwas data and create a list of Cypher queries to insert the data into the database
+@graph_labels(requires=['Target', 'Gwas'])
+@reads(['gene_id', 'trait_efos'], valid_rows('trait_efos'))
 def create_cypher_query_gwas_relation(table):
-    df = table.to_pandas()
-    df = df[['gene_id','trait_efos']].explode('trait_efos').drop_duplicates()
+    trait_efos, parents = flatten_list_column(table, 'trait_efos')
     node_label = 'GwasRelation'
     dataset = f"{data_version} {node_label}"
-    data = []
-    for _, row in df.iterrows():
-        data.append({
-            'gwas': row['trait_efos'],
-            'ensembleId': row['gene_id'],
-        })
-    # APOC query for merging relationships between Drug and Target nodes
-    query = """
-    CALL apoc.periodic.iterate(
-        'UNWIND $data as item RETURN item',
-        'MATCH (from:Target {ensembleId: item.ensembleId}), (to:Gwas {id: item.gwas})
-         MERGE (from)-[:GWAS_RELATION {dataset: $dataset}]->(to)',
-        {params: {data: $data, dataset: $dataset}, batchSize: 1000, parallel: false}
-    )
-    """
-    # Include the dataset creation query
-    dataset_query = create_dataset_cypher_query(node_label)
-    # Return a list of queries to be executed
-    return [(dataset_query, {}), (query, {'data': data, 'dataset': dataset})]
+    # One entry per (gene, trait) pair, the duplicates are dropped when the query is created
+    columns = {
+        'gwas': trait_efos,
+        'ensembleId': pc.take(table.column('gene_id'), parents)
+    }
+    # Query for merging relationships between Target and Gwas nodes, with the dataset creation query
+    return [create_dataset_query(node_label), create_cypher_query_relationships(
+        'GWAS_RELATION', ('Target', 'ensembleId'), ('Gwas', 'gwas'), columns, dataset)]
 
 # Parse the mechanism of action data and create a list of Cypher queries to insert the data into the database
+@graph_labels(requires=['Drug', 'Target'])
+@reads(['chemblIds', 'targets', 'actionType'], valid_rows('chemblIds', 'targets'))
 def create_cypher_query_mechanism_of_action(table):
-    df = table.to_pandas()
     node_label = 'MechanismOfAction'
     dataset = f"{data_version} {node_label}"
-    data = []
-    for _, row in df.iterrows():
-        if row['chemblIds'] is None or row['targets'] is None:
-            continue
-        for chemblId in row['chemblIds']:
-            for target in row['targets']:
-                 # Append data for each combination of chemblId and target
-                 data.append({
-                    'chemblId': chemblId,
-                    'ensembleId': target,
-                    'actionType': row['actionType']
-                })
-    # APOC query for merging relationships between Drug and Target nodes
-    query = """
-    CALL apoc.periodic.iterate(
-        'UNWIND $data as item RETURN item',
-        'MATCH (from:Drug {chemblId: item.chemblId}), (to:Target {ensembleId: item.ensembleId})
-         MERGE (from)-[:TARGETS {dataset: $dataset, actionType: item.actionType}]->(to)',
-        {params: {data: $data, dataset: $dataset}, batchSize: 1000, parallel: false}
-    )
-    """
-    # Include the dataset creation query
-    dataset_query = create_dataset_cypher_query(node_label)
-    # Return a list of queries to be executed
-    return [(dataset_query, {}), (query, {'data': data, 'dataset': dataset})]
+    chembl_ids, _ = flatten_list_column(table, 'chemblIds')
+    targets, _ = flatten_list_column(table, 'targets')
+
+    # Build an entry for each combination of chemblId and target of a row. A row with m chemblIds and n targets
+    # gives m * n entries, entry k of the row pairs chemblIds[k // n] with targets[k % n]
+    chembl_counts = pc.list_value_length(table.column('chemblIds')).to_numpy()
+    target_counts = pc.list_value_length(table.column('targets')).to_numpy()
+    pair_counts = chembl_counts * target_counts
+    rows = np.repeat(np.arange(len(pair_counts)), pair_counts)
+    pair_index = np.arange(pair_counts.sum()) - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts)
+    chembl_index = np.repeat(np.cumsum(chembl_counts) - chembl_counts, pair_counts) + pair_index // target_counts[rows]
+    target_index = np.repeat(np.cumsum(target_counts) - target_counts, pair_counts) + pair_index % target_counts[rows]
+    columns = {
+        'chemblId': pc.take(chembl_ids, chembl_index),
+        'ensembleId': pc.take(targets, target_index),
+        'actionType': pc.take(table.column('actionType'), rows)
+    }
+    # Query for merging relationships between Drug and Target nodes, with the dataset creation query
+    return [create_dataset_query(node_label), create_cypher_query_relationships(
+        'TARGETS', ('Drug', 'chemblId'), ('Target', 'ensembleId'), columns, dataset, {'actionType': 'actionType'})]
 
 # Parse the targets data and create a list of Cypher queries to add participates relationships to the database
+@graph_labels(requires=['Target', 'Pathway'])
+@reads(['id', 'pathways.pathwayId'], valid_rows('id', 'pathways'))
 def create_cypher_query_participates(table):
-    df = table.to_pandas()
     node_label = 'Participates'
     dataset = f"{data_version} {node_label}"
-    data = []
-    for _, row in df.iterrows():
-        if row['id'] is None or row['pathways'] is None:
-            continue
-        for pathway in row['pathways']:
-            # Append data for each combination of target and pathway
-            data.append({
-                'ensembleId': row['id'],
-                'pathwayId': pathway['pathwayId'],
-                'id': pathway['pathwayId']
-            })
-    # APOC query for creating relationships between Target and Pathway nodes
-    query = """
-    CALL apoc.periodic.iterate(
-        'UNWIND $data as item RETURN item',
-        'MATCH (from:Target {ensembleId: item.ensembleId}), (to:Pathway {pathwayId: item.pathwayId})
-         MERGE (from)-[:PARTICIPATES_IN {dataset: $dataset, id: item.pathwayId}]->(to)',
-        {params: {data: $data, dataset: $dataset}, batchSize: 1000, parallel: true}
-    )
-    """
-    # Include the dataset creation query
-    dataset_query = create_dataset_cypher_query(node_label)
-    # Return a list of queries to be executed
-    return [(dataset_query, {}), (query, {'data': data, 'dataset': dataset})]
+    # Append data for each combination of target and pathway
+    pathways, parents = flatten_list_column(table, 'pathways')
+    columns = {
+        'ensembleId': pc.take(table.column('id'), parents),
+        'pathwayId': struct_field(pathways, 'pathwayId')
+    }
+    # Query for creating relationships between Target and Pathway nodes, with the dataset creation query
+    return [create_dataset_query(node_label), create_cypher_query_relationships(
+        'PARTICIPATES_IN', ('Target', 'ensembleId'), ('Pathway', 'pathwayId'), columns, dataset, {'id': 'pathwayId'})]
 
 # Parse the targets data and create a list of Cypher queries to add associatedWith relationships to the database
+@graph_labels(requires=['Drug', 'AdverseEvent'])
+@reads(['chembl_id', 'meddraCode', 'critval', 'llr'], valid_rows('chembl_id', 'meddraCode'))
 def create_cypher_query_associated_with(table):
-    df = table.to_pandas()
     node_label = 'AssociatedWith'
     dataset = f"{data_version} {node_label}"
-    data = []
-    for _, row in df.iterrows():
-        if row['chembl_id'] is None or row['meddraCode'] is None:
-            continue
-        # Append data for each combination of chembl_id and meddraCode
-        data.append({
-            'chembl_id': row['chembl_id'],
-            'meddraCode': row['meddraCode'],
-            'critval': row['critval'],
-            'llr': row['llr']
-        })
-    # APOC query for creating relationships between Target and Pathway nodes
-    query = """
-    CALL apoc.periodic.iterate(
-        'UNWIND $data as item RETURN item',
-        'MATCH (from:Drug {chemblId: item.chembl_id}), (to:AdverseEvent {meddraId: item.meddraCode})
-         MERGE (from)-[:ASSOCIATED_WITH {dataset: $dataset, critval: item.critval, llr: item.llr}]->(to)',
-        {params: {data: $data, dataset: $dataset}, batchSize: 1000, parallel: false}
-    )
-    """
-    # Include the dataset creation query
-    dataset_query = create_dataset_cypher_query(node_label)
-    # Return a list of queries to be executed
-    return [(dataset_query, {}), (query, {'data': data, 'dataset': dataset})]
+    # Append data for each combination of chembl_id and meddraCode
+    columns = {column: table.column(column) for column in ['chembl_id', 'meddraCode', 'critval', 'llr']}
+    # Query for creating relationships between Drug and AdverseEvent nodes, with the dataset creation query
+    return [create_dataset_query(node_label), create_cypher_query_relationships(
+        'ASSOCIATED_WITH', ('Drug', 'chembl_id'), ('AdverseEvent', 'meddraCode'), columns, dataset,
+        {'critval': 'critval', 'llr': 'llr'})]
 
 def clear_neo4j_database():
     # Delete all nodes and relationships in the database
     db.cypher_query("MATCH (n) DETACH DELETE n")
 
 # Parse the mouse phenotypes data and create a list of Cypher queries to add associatedWith relationships to the database
+@graph_labels(requires=['Target', 'MousePhenotype'])
+@reads(['targetFromSourceId', 'modelPhenotypeId'], valid_rows('targetFromSourceId', 'modelPhenotypeId'))
 def create_cypher_query_associated_mouse_phenotypes(table):
-    df = table.to_pandas()
     node_label = 'mousePhenotypes'
     dataset = f"{data_version} {node_label}"
-    data = []
-    for _, row in df.iterrows():
-        if row['targetFromSourceId'] is None or row['modelPhenotypeId'] is None:
-            continue
-        # Append data for each combination of chembl_id and meddraCode
-        data.append({
-            'targetFromSourceId': row['targetFromSourceId'],
-            'modelPhenotypeId': row['modelPhenotypeId'],
-            'weight': 1
-        })
-    # APOC query for creating relationships between Target and Pathway nodes
-    query = """
-    CALL apoc.periodic.iterate(
-        'UNWIND $data as item RETURN item',
-        'MATCH (from:Target {ensembleId: item.targetFromSourceId}), (to:MousePhenotype {mousePhenotypeId: item.modelPhenotypeId})
-         MERGE (from)-[:MOUSE_PHENOTYPE {dataset: $dataset, weight: item.weight}]->(to)',
-        {params: {data: $data, dataset: $dataset}, batchSize: 1000, parallel: false}
-    )
-    """
-    return [(query, {'data': data, 'dataset': dataset})]
-
+    # Append data for each combination of target and mouse phenotype
+    columns = {
+        'targetFromSourceId': table.column('targetFromSourceId'),
+        'modelPhenotypeId': table.column('modelPhenotypeId'),
+        'weight': pa.repeat(1, table.num_rows)
+    }
+    # Query for creating relationships between Target and MousePhenotype nodes
+    return [create_cypher_query_relationships(
+        'MOUSE_PHENOTYPE', ('Target', 'targetFromSourceId'), ('MousePhenotype', 'modelPhenotypeId'), columns, dataset,
+        {'weight': 'weight'})]
+
+@graph_labels(requires=['Target', 'TargetPathway'])
+@reads(['targetId', 'pathways.id'], valid_rows('targetId', 'pathways'))
 def create_cypher_query_pathways_relation(table):
-    df = table.to_pandas()
     node_label = 'Pathways'
     dataset = f"{data_version} {node_label}"
-    data = []
-    for _, row in df.iterrows():
-        if row['targetId'] is None or row['pathways'] is None:
-            continue
-        # Append data for each combination of chembl_id and meddraCode
-        for j in row['pathways']:
-            data.append({
-                'targetId': row['targetId'],
-                'pathway': j['id'],
-                'weight': 1
-        })
-    # APOC query for creating relationships between Target and Pathway nodes
-    query = """
-    CALL apoc.periodic.iterate(
-        'UNWIND $data as item RETURN item',
-        'MATCH (from:Target {ensembleId: item.targetId}), (to:TargetPathway {id: item.pathway})
-         MERGE (from)-[:PATHWAY {dataset: $dataset, weight: item.weight}]->(to)',
-        {params: {data: $data, dataset: $dataset}, batchSize: 1000, parallel: true}
-    )
-    """
-    return [(query, {'data': data, 'dataset': dataset})]
+    # Append data for each combination of target and pathway
+    pathways, parents = flatten_list_column(table, 'pathways')
+    columns = {
+        'targetId': pc.take(table.column('targetId'), parents),
+        'pathway': struct_field(pathways, 'id'),
+        'weight': pa.repeat(1, len(pathways))
+    }
+    # Query for creating relationships between Target and TargetPathway nodes
+    return [create_cypher_query_relationships(
+        'PATHWAY', ('Target', 'targetId'), ('TargetPathway', 'pathway'), columns, dataset, {'weight': 'weight'})]
 
 # Parse the molecular interaction data and create a list of Cypher queries
 # to add interaction relationships to the database.
+@graph_labels(requires=['Target'])
+@reads(['sourceDatabase', 'targetA', 'targetB'],
+       valid_rows('targetB') & (pc.utf8_lower(pc.field('sourceDatabase')) != 'string'))
 def create_cypher_query_interactions(table):
-    # Convert the input table to a Pandas DataFrame.
-    df = table.to_pandas()
-
     # Set the node_label and dataset string.
     node_label = 'interactions'
     dataset = f"{data_version} {node_label}"
 
-    # Initialize an empty dictionary to group the data by sourceDatabase.
-    data_dict = {}
-
-    # Iterate through the rows of the DataFrame.
-    for _, row in df.iterrows():
-        # Skip the row if targetB is None or sourceDatabase is 'string'.
-        if row['targetB'] is None or row['sourceDatabase'].lower() == 'string':
-            continue
-
-        # Group data by sourceDatabase.
-        source_database = row['sourceDatabase']
-        if source_database not in data_dict:
-            data_dict[source_database] = []
+    # The rows where targetB is None or sourceDatabase is 'string' are dropped by the reader (see @reads).
 
-        # Append targetA and targetB to the corresponding sourceDatabase list.
-        data_dict[source_database].append({
-            'targetA': row['targetA'],
-            'targetB': row['targetB']
-        })
+    # Group targetA and targetB by sourceDatabase, keeping the order in which the databases first appear.
+    data_dict = {}
+    for source_database in pc.unique(table.column('sourceDatabase')).to_pylist():
+        rows = table.filter(pc.equal(table.column('sourceDatabase'), source_database))
+        data_dict[source_database] = {
+            'targetA': rows.column('targetA'),
+            'targetB': rows.column('targetB')
+        }
 
     # Initialize an empty list to store the APOC queries.
     queries = []
 
     # Iterate through the data_dict items.
-    for source_database, data in data_dict.items():
+    for source_database, columns in data_dict.items():
         # Convert the source_database string to uppercase and replace spaces with underscores.
         relationship_type = source_database.upper().replace(" ", "_")
 
-        # Define the Cypher query for creating relationships between Target nodes.
-        query = f"""
-        CALL apoc.periodic.iterate(
-            'UNWIND $data as item RETURN item',
-            'MATCH (from:Target {{ensembleId: item.targetA}}), (to:Target {{ensembleId: item.targetB}})
-             MERGE (from)-[rel:{relationship_type} {{dataset: $dataset}}]->(to)
-             RETURN rel',
-            {{params: {{data: $data, dataset: $dataset}}, batchSize: 1000, parallel: false}}
-        )
-        """
-        # Append the query and its parameters to the queries list.
-        queries.append((query, {'data': data, 'dataset': dataset}))
+        # Append the query creating relationships between Target nodes to the queries list.
+        queries.append(create_cypher_query_relationships(
+            relationship_type, ('Target', 'targetA'), ('Target', 'targetB'), columns, dataset))
 
     # Return the list of queries.
     return queries
 
+@averaged_over_files
+@graph_labels(requires=['Target', 'Baseline_Expression'])
+@reads(['id', 'tissues.efo_code', 'tissues.rna.value'], valid_rows('tissues'))
 def create_cypher_query_hgene(table):
-    # Convert the table to a pandas DataFrame
-    df = table.to_pandas()
-
     node_label = 'hgene'
     dataset = f"{data_version} {node_label}"
-    # Prepare data for the Cypher query
-    data = []
-    for _, row in df.iterrows():
-        for i in row['tissues']:
-            if i['rna']['value'] == 0:
-                continue
-            data.append({
-                'ensembleId': row['id'],
-                'efo_code': i['efo_code'],
-                'rna_value': i['rna']['value']
-            })
-
-    # APOC query for creating Pathway nodes in batch
-    # When there are redundant nodes with different rna_value, the average value is used
-    query = """
-        CALL apoc.periodic.iterate(
-            'UNWIND $data as item RETURN item',
-            'MATCH (from:Target {ensembleId: item.ensembleId}), (to:Baseline_Expression {efo_code: item.efo_code})
-            MERGE (from)-[rel:HGENE {dataset: $dataset}]->(to)
-            ON CREATE SET rel.rna_value = item.rna_value
-            ON MATCH SET rel.rna_value = (rel.rna_value + item.rna_value) / 2',
-            {params: {data: $data, dataset: $dataset}, batchSize: 1000, parallel: false}
-        )
-        """
-    # Include the dataset creation query
-    dataset_query = create_dataset_cypher_query(node_label)
-    # Return a list of queries to be executed
-    return [(dataset_query, {}), (query, {'data': data, 'dataset': dataset})]
-
+    # Prepare data for the Cypher query, one entry per tissue of every target, skipping the tissues without RNA expression
+    tissues, parents = flatten_list_column(table, 'tissues')
+    rna_values = struct_field(tissues, 'rna.value')
+    expressed = pc.fill_null(pc.not_equal(rna_values, 0), True)
+    columns = {
+        'ensembleId': pc.take(table.column('id'), parents.filter(expressed)),
+        'efo_code': struct_field(tissues, 'efo_code').filter(expressed),
+        'rna_value': rna_values.filter(expressed)
+    }
+
+    # When there are redundant relationships with different rna_value, the average value is used
+    return [create_dataset_query(node_label), create_cypher_query_relationships(
+        'HGENE', ('Target', 'ensembleId'), ('Baseline_Expression', 'efo_code'), columns, dataset,
+        averaged=['rna_value'])]
+
+@averaged_over_files
+@graph_labels(requires=['Target', 'Baseline_Expression'])
+@reads(['id', 'tissues.efo_code', 'tissues.protein.level'], valid_rows('tissues'))
 def create_cypher_query_hprotein(table):
-    # Convert the table to a pandas DataFrame
-    df = table.to_pandas()
-
     node_label = 'hprotein'
     dataset = f"{data_version} {node_label}"
-    # Prepare data for the Cypher query
-    data = []
-    for _, row in df.iterrows():
-        for i in row['tissues']:
-            if i['protein']['level'] == -1:
-                continue
-            data.append({
-                'ensembleId': row['id'],
-                'efo_code': i['efo_code'],
-                'protein_level': i['protein']['level']
-            })
-
-    # APOC query for creating Pathway nodes in batch
-    query = """
-        CALL apoc.periodic.iterate(
-            'UNWIND $data as item RETURN item',
-            'MATCH (from:Target {ensembleId: item.ensembleId}), (to:Baseline_Expression {efo_code: item.efo_code})
-            MERGE (from)-[rel:HPROTEIN {dataset: $dataset}]->(to)
-            ON CREATE SET rel.protein_level = item.protein_level
-            ON MATCH SET rel.protein_level = (rel.protein_level + item.protein_level) / 2',
-            {params: {data: $data, dataset: $dataset}, batchSize: 1000, parallel: false}
-        )
-        """
-    # Include the dataset creation query
-    dataset_query = create_dataset_cypher_query(node_label)
-    # Return a list of queries to be executed
-    return [(dataset_query, {}), (query, {'data': data, 'dataset': dataset})]
+    # Prepare data for the Cypher query, one entry per tissue of every target, skipping the tissues without protein level
+    tissues, parents = flatten_list_column(table, 'tissues')
+    protein_levels = struct_field(tissues, 'protein.level')
+    detected = pc.fill_null(pc.not_equal(protein_levels, -1), True)
+    columns = {
+        'ensembleId': pc.take(table.column('id'), parents.filter(detected)),
+        'efo_code': struct_field(tissues, 'efo_code').filter(detected),
+        'protein_level': protein_levels.filter(detected)
+    }
+
+    # When there are redundant relationships with different protein_level, the average value is used
+    return [create_dataset_query(node_label), create_cypher_query_relationships(
+        'HPROTEIN', ('Target', 'ensembleId'), ('Baseline_Expression', 'efo_code'), columns, dataset,
+        averaged=['protein_level'])]
+
+# Define data_type_query_generators, a dictionary that maps data types to lists of query generators.
+# Each list contains multiple node or edge query generator functions for the respective data type.
+NODE_GENERATORS, EDGE_GENERATORS = 0, 1
+data_type_query_generators = {
+    # Key: data type name, Value: tuple([node query generators], [edge query generators])
+    "targets": ([create_cypher_query_targets, create_cypher_query_pathways], [create_cypher_query_participates]),
+    "fda": ([create_cypher_query_adverse_events], [create_cypher_query_associated_with]),
+    "molecule": ([create_cypher_query_drugs], []),
+    "mechanismOfAction": ([], [create_cypher_query_mechanism_of_action]),
+    "mousePhenotypes": ([create_cypher_query_mouse_phenotypes], [create_cypher_query_associated_mouse_phenotypes]),
+    "diseases": ([create_cypher_query_diseases], []),
+    "interactions":([],[create_cypher_query_interactions]),
+    "baseExpressions":([create_cypher_query_baseline_expression],[create_cypher_query_hgene, create_cypher_query_hprotein]),
+    "pathways":([create_cypher_query_pathway_types],[create_cypher_query_pathways_relation]),
+    # "gwasTraitProfile":([create_cypher_query_gwas],[create_cypher_query_gwas_relation])
+}
+
+# Data types whose files feed node generators, downloaded first when the files are loaded as they are downloaded
+def node_data_types():
+    return [data_type for data_type, generators in data_type_query_generators.items() if generators[NODE_GENERATORS]]
+
+# Columns read by the query generators of each data type, None (every column) if one of them didn't declare its
+# columns. The compaction only keeps these columns (see compaction.py).
+def data_type_columns():
+    columns = {}
+    for data_type, generators in data_type_query_generators.items():
+        columns[data_type] = set()
+        for query_generator in generators[NODE_GENERATORS] + generators[EDGE_GENERATORS]:
+            if getattr(query_generator, 'columns', None) is None:
+                columns[data_type] = None
+                break
+            columns[data_type].update(query_generator.columns)
+        if columns[data_type] is not None:
+            columns[data_type] = sorted(columns[data_type])
+    return columns
+
 
 # Main function call
 if __name__ == "__main__":
-    parse_datasets()
+    parser = argparse.ArgumentParser(description="Import the Open Targets parquet files into Neo4j")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes decoding parquet files (default: INGEST_WORKERS or 1)")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="number of query generators run at the same time (default: INGEST_CONCURRENCY or 1)")
+    parser.add_argument("--edge-writers", type=int, default=None,
+                        help="number of sessions writing relationship partitions (default: INGEST_EDGE_WRITERS or 1)")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore the ingest checkpoints and reload every file")
+    parser.add_argument("--estimate", action="store_true",
+                        help="estimate the duration and memory of a reload from the parquet footers and the last "
+                             "ingest report, without reading any data")
+    parser.add_argument("--compact", action="store_true",
+                        help="compact the parquet files of each data type into INGEST_COMPACT_DIR without importing")
+    parser.add_argument("--import-files", metavar="DIR",
+                        help="write neo4j-admin import files to DIR instead of importing into a running Neo4j")
+    args = parser.parse_args()
+
+    input_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opentarget")
+    if args.estimate:
+        estimate_ingest(find_ingest_tasks(input_dir), INGEST_REPORT, INGEST_MEMORY_MB,
+                        workers=args.workers or INGEST_WORKERS, concurrency=args.concurrency or INGEST_CONCURRENCY,
+                        stream=INGEST_STREAM, queue_size=INGEST_QUEUE_SIZE)
+    elif args.compact:
+        compact_datasets(input_dir, data_type_columns(), INGEST_MEMORY_MB, INGEST_WORKERS)
+    elif args.import_files:
+        write_import_files(input_dir, args.import_files, workers=args.workers, concurrency=args.concurrency)
+    else:
+        parse_datasets(workers=args.workers, concurrency=args.concurrency, resume=False if args.restart else None,
+                       edge_writers=args.edge_writers)
+        # Finish deleting the old data versions before exiting, the server does it in the background
+        if data_version_cleanup is not None:
+            data_version_cleanup.join()
 
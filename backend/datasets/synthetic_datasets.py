@@ -0,0 +1,343 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+try:
+    import parse_datasets
+    from ingest_report import ingest_report
+except ImportError:
+    from datasets import parse_datasets
+    from datasets.ingest_report import ingest_report
+
+"""
+Synthetic Open Targets datasets and ingest benchmark
+
+This script writes synthetic parquet files for every data type folder that 'parse_datasets.py' reads, so the ingest
+can be run and timed without downloading the Open Targets release. The files follow the schemas of the release:
+the same column names and types, nested lists of structs such as the 'pathways' of the targets and the 'tissues' of
+the baseline expressions, list items named 'element' as Spark writes them, null lists and null keys in the same
+columns, plus columns the query generators don't read so the column projection has something to skip.
+
+Usage:
+
+- 'python synthetic_datasets.py generate DIR --scale 1' writes the folders (targets, baseExpressions, interactions,
+  fda, molecule, mechanismOfAction, mousePhenotypes, diseases, pathways) into DIR. Scale 1 has 2000 targets and about
+  300k rows in total; the row counts grow linearly with the scale, scale 30 is close to the size of a release.
+- 'python synthetic_datasets.py benchmark DIR' runs every query generator over DIR and prints the read and transform
+  time, rows in and out and payload size of each generator, without writing to Neo4j. With --write the queries are
+  also written to the Neo4j database of NEO4J_DOCKER_URL and the write time is added. Use an empty database, the
+  synthetic nodes are merged on the same keys as the real ones.
+  --output saves the results as JSON and --baseline compares them with a saved run, flagging the generators that got
+  slower by more than --tolerance.
+
+make benchmark-ingest generates a scale 1 dataset in datasets/synthetic and benchmarks it.
+
+Adding a data type: add a function returning the list of tables of the folder to the 'synthetic_data_types'
+dictionary, and the folder to 'data_type_query_generators' in parse_datasets.py.
+"""
+
+# Number of rows of each data type at scale 1
+SCALE_ROWS = {
+    'targets': 2000,
+    'interactions': 20000,
+    'fda': 5000,
+    'molecule': 500,
+    'mechanismOfAction': 1000,
+    'mousePhenotypes': 10000,
+    'diseases': 1500,
+    'pathways': 8000,
+}
+# Number of distinct tissues, adverse events, mouse phenotypes and Reactome pathways, which don't grow with the scale
+TISSUES = 300
+ADVERSE_EVENTS = 800
+MOUSE_PHENOTYPES = 3000
+REACTOME_PATHWAYS = 2000
+
+
+# Identifiers in the formats of the release
+def target_ids(count):
+    return [f"ENSG{i:011d}" for i in range(count)]
+
+def chembl_ids(count):
+    return [f"CHEMBL{i + 1}" for i in range(count)]
+
+def disease_ids(count):
+    return [f"EFO_{i:07d}" for i in range(count)]
+
+def reactome_ids(indices):
+    return pa.array([f"R-HSA-{i}" for i in indices])
+
+def tissue_ids(indices):
+    return pa.array([f"UBERON_{i:07d}" for i in indices])
+
+
+# Null out the values of an array where mask is true
+def with_nulls(values, mask):
+    return pc.if_else(pa.array(mask), pa.nulls(len(values), values.type), values)
+
+# List array with counts[i] items for row i, taken in order from values. Rows where null_mask is true are null.
+def list_array(counts, values, null_mask=None):
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+    lists = pa.ListArray.from_arrays(pa.array(offsets), values)
+    return lists if null_mask is None else with_nulls(lists, null_mask)
+
+def struct_array(**fields):
+    return pa.StructArray.from_arrays(list(fields.values()), names=list(fields))
+
+# Pick 'count' values at random, with the given probability of a null
+def choice(rng, values, count, null_probability=0.0):
+    picked = pa.array(values).take(pa.array(rng.integers(0, len(values), count)))
+    return with_nulls(picked, rng.random(count) < null_probability) if null_probability else picked
+
+
+def synthetic_targets(rng, scale):
+    count = int(SCALE_ROWS['targets'] * scale)
+    ids = target_ids(count)
+    pathway_counts = rng.integers(0, 8, count)
+    pathway_indices = rng.integers(0, REACTOME_PATHWAYS, pathway_counts.sum())
+    pathways = struct_array(
+        pathwayId=reactome_ids(pathway_indices),
+        pathway=pa.array([f"Reactome pathway {i}" for i in pathway_indices]),
+        topLevelTerm=choice(rng, ['Signal Transduction', 'Metabolism', 'Immune System'], len(pathway_indices), 0.1),
+    )
+    synonym_counts = rng.integers(0, 4, count)
+    synonyms = struct_array(
+        label=pa.array([f"SYN{i}" for i in range(synonym_counts.sum())]),
+        source=choice(rng, ['HGNC', 'uniprot'], synonym_counts.sum()),
+    )
+    return pa.table({
+        'id': pa.array(ids),
+        'approvedSymbol': pa.array([f"SYM{i}" for i in range(count)]),
+        'biotype': choice(rng, ['protein_coding', 'lncRNA', 'miRNA'], count),
+        'approvedName': with_nulls(pa.array([f"synthetic gene {i}" for i in range(count)]), rng.random(count) < 0.01),
+        'synonyms': list_array(synonym_counts, synonyms),
+        'functionDescriptions': list_array(np.ones(count, int), pa.array(["Synthetic function."] * count)),
+        'pathways': list_array(pathway_counts, pathways, rng.random(count) < 0.2),
+    })
+
+def synthetic_base_expressions(rng, scale):
+    count = int(SCALE_ROWS['targets'] * scale)
+    tissue_counts = rng.integers(20, 60, count)
+    total = tissue_counts.sum()
+    tissue_indices = rng.integers(0, TISSUES, total)
+    rna_values = np.where(rng.random(total) < 0.3, 0.0, rng.random(total) * 100)
+    tissues = struct_array(
+        efo_code=tissue_ids(tissue_indices),
+        label=pa.array([f"tissue {i}" for i in tissue_indices]),
+        organs=list_array(np.ones(total, int), choice(rng, ['brain', 'liver', 'kidney', 'blood'], total)),
+        anatomical_systems=list_array(np.zeros(total, int), pa.array([], pa.string())),
+        rna=struct_array(value=pa.array(rna_values), zscore=pa.array(rng.integers(-1, 5, total)),
+                         level=pa.array(rng.integers(-1, 4, total)), unit=pa.array(['TPM'] * total)),
+        protein=struct_array(reliability=pa.array(rng.random(total) < 0.5),
+                             level=pa.array(rng.integers(-1, 4, total))),
+    )
+    return pa.table({'id': pa.array(target_ids(count)), 'tissues': list_array(tissue_counts, tissues)})
+
+def synthetic_interactions(rng, scale):
+    count = int(SCALE_ROWS['interactions'] * scale)
+    targets = target_ids(int(SCALE_ROWS['targets'] * scale))
+    return pa.table({
+        'sourceDatabase': choice(rng, ['intact', 'reactome', 'signor', 'string'], count),
+        'targetA': choice(rng, targets, count),
+        'intA': pa.array([f"P{i:05d}" for i in rng.integers(0, 99999, count)]),
+        'targetB': choice(rng, targets, count, 0.05),
+        'intB': pa.array([f"P{i:05d}" for i in rng.integers(0, 99999, count)]),
+        'count': pa.array(rng.integers(1, 10, count)),
+        'scoring': pa.array(rng.random(count)),
+    })
+
+def synthetic_fda(rng, scale):
+    count = int(SCALE_ROWS['fda'] * scale)
+    events = rng.integers(0, ADVERSE_EVENTS, count)
+    return pa.table({
+        'chembl_id': choice(rng, chembl_ids(int(SCALE_ROWS['molecule'] * scale)), count),
+        'event': pa.array([f"adverse event {i}" for i in events]),
+        'count': pa.array(rng.integers(3, 500, count)),
+        'llr': pa.array(rng.random(count) * 100),
+        'critval': pa.array(rng.random(count) * 10),
+        'meddraCode': with_nulls(pa.array([str(10000000 + i) for i in events]), rng.random(count) < 0.02),
+    })
+
+def synthetic_molecules(rng, scale):
+    count = int(SCALE_ROWS['molecule'] * scale)
+    return pa.table({
+        'id': pa.array(chembl_ids(count)),
+        'name': pa.array([f"SYNTHETIC DRUG {i}" for i in range(count)]),
+        'drugType': choice(rng, ['Small molecule', 'Antibody', 'Protein'], count),
+        'isApproved': pa.array(rng.random(count) < 0.3),
+        'maximumClinicalTrialPhase': pa.array(rng.integers(0, 5, count).astype(float)),
+        'synonyms': list_array(np.zeros(count, int), pa.array([], pa.string())),
+    })
+
+def synthetic_mechanisms_of_action(rng, scale):
+    count = int(SCALE_ROWS['mechanismOfAction'] * scale)
+    chembl_counts = rng.integers(0, 3, count)
+    target_counts = rng.integers(0, 4, count)
+    return pa.table({
+        'actionType': choice(rng, ['INHIBITOR', 'AGONIST', 'ANTAGONIST'], count),
+        'mechanismOfAction': pa.array([f"synthetic mechanism {i}" for i in range(count)]),
+        'chemblIds': list_array(chembl_counts, choice(rng, chembl_ids(int(SCALE_ROWS['molecule'] * scale)),
+                                                      chembl_counts.sum()), rng.random(count) < 0.05),
+        'targetName': pa.array([f"target {i}" for i in range(count)]),
+        'targetType': choice(rng, ['single protein', 'protein complex'], count),
+        'targets': list_array(target_counts, choice(rng, target_ids(int(SCALE_ROWS['targets'] * scale)),
+                                                    target_counts.sum()), rng.random(count) < 0.05),
+    })
+
+def synthetic_mouse_phenotypes(rng, scale):
+    count = int(SCALE_ROWS['mousePhenotypes'] * scale)
+    phenotypes = rng.integers(0, MOUSE_PHENOTYPES, count)
+    return pa.table({
+        'modelPhenotypeId': pa.array([f"MP:{i:07d}" for i in phenotypes]),
+        'modelPhenotypeLabel': pa.array([f"mouse phenotype {i}" for i in phenotypes]),
+        'targetFromSourceId': choice(rng, target_ids(int(SCALE_ROWS['targets'] * scale)), count),
+        'targetInModel': pa.array([f"Sym{i}" for i in range(count)]),
+        'targetInModelMgiId': pa.array([f"MGI:{i}" for i in range(count)]),
+    })
+
+def synthetic_diseases(rng, scale):
+    count = int(SCALE_ROWS['diseases'] * scale)
+    parent_counts = rng.integers(0, 3, count)
+    return pa.table({
+        'id': pa.array(disease_ids(count)),
+        'code': pa.array([f"http://www.ebi.ac.uk/efo/EFO_{i:07d}" for i in range(count)]),
+        'name': pa.array([f"synthetic disease {i}" for i in range(count)]),
+        'description': pa.array(["Synthetic disease description."] * count),
+        'parents': list_array(parent_counts, choice(rng, disease_ids(count), parent_counts.sum())),
+    })
+
+def synthetic_pathways(rng, scale):
+    count = int(SCALE_ROWS['pathways'] * scale)
+    pathway_counts = rng.integers(1, 3, count)
+    pathway_indices = rng.integers(0, REACTOME_PATHWAYS, pathway_counts.sum())
+    pathways = struct_array(id=reactome_ids(pathway_indices),
+                            name=pa.array([f"Reactome pathway {i}" for i in pathway_indices]))
+    return pa.table({
+        'datasourceId': pa.array(['reactome'] * count),
+        'targetId': choice(rng, target_ids(int(SCALE_ROWS['targets'] * scale)), count),
+        'diseaseId': choice(rng, disease_ids(int(SCALE_ROWS['diseases'] * scale)), count),
+        'score': pa.array(rng.random(count)),
+        'pathways': list_array(pathway_counts, pathways, rng.random(count) < 0.05),
+    })
+
+
+# Data type folder -> function generating its table from a random generator and the scale
+synthetic_data_types = {
+    "targets": synthetic_targets,
+    "baseExpressions": synthetic_base_expressions,
+    "interactions": synthetic_interactions,
+    "fda": synthetic_fda,
+    "molecule": synthetic_molecules,
+    "mechanismOfAction": synthetic_mechanisms_of_action,
+    "mousePhenotypes": synthetic_mouse_phenotypes,
+    "diseases": synthetic_diseases,
+    "pathways": synthetic_pathways,
+}
+
+
+# Write the synthetic folders into output_dir, each table split into 'files' part files like the release
+def generate_synthetic_datasets(output_dir, scale=1.0, files=4, seed=0):
+    rng = np.random.default_rng(seed)
+    for data_type, generate in synthetic_data_types.items():
+        start = time.perf_counter()
+        table = generate(rng, scale)
+        folder = os.path.join(output_dir, data_type)
+        os.makedirs(folder, exist_ok=True)
+        rows_per_file = -(-table.num_rows // files)
+        for n in range(files):
+            pq.write_table(table.slice(n * rows_per_file, rows_per_file),
+                           os.path.join(folder, f"part-{n:05d}-synthetic.snappy.parquet"),
+                           row_group_size=max(1, rows_per_file // 2), use_compliant_nested_type=True)
+        print(f"Wrote {table.num_rows} {data_type} rows in {files} files ({time.perf_counter() - start:.1f}s)")
+
+
+# Run every query generator over input_dir, writing to Neo4j with write and only counting the entries otherwise,
+# and return the totals of the ingest report metrics for each generator
+def benchmark_ingest(input_dir, write=False, workers=None):
+    if parse_datasets.data_version is None:
+        parse_datasets.data_version = "synthetic"
+    # Measure the transforms, not the ingest cache
+    parse_datasets.INGEST_CACHE = False
+    options = {'workers': workers}
+    if write:
+        parse_datasets.ensure_neo4j_connection()
+        parse_datasets.create_indexes()
+    else:
+        options['writer'] = lambda queries: None
+
+    start = time.perf_counter()
+    parse_datasets.schedule_query_generators(input_dir, 1, **options)
+    wall_time = time.perf_counter() - start
+
+    results = {}
+    for metrics in ingest_report['files']:
+        totals = results.setdefault(f"{metrics['data_type']}/{metrics['generator']}", dict.fromkeys(
+            ['read_seconds', 'transform_seconds', 'write_seconds', 'rows_in', 'rows_out', 'payload_bytes'], 0))
+        for key in totals:
+            totals[key] += metrics[key]
+    return {'wall_seconds': wall_time, 'write': write, 'generators': results}
+
+
+# Print the benchmark results, with the change of each generator's time against a baseline run
+def print_benchmark(results, baseline=None, tolerance=0.2):
+    stage_keys = ['read_seconds', 'transform_seconds'] + (['write_seconds'] if results['write'] else [])
+    print(f"\n{'Query generator':65} {'read':>7} {'transform':>9} {'write':>7} {'rows in':>9} {'rows out':>9} "
+          f"{'MB out':>7} {'rows/s':>9}  vs baseline")
+    regressions = []
+    for name, totals in results['generators'].items():
+        seconds = sum(totals[key] for key in stage_keys)
+        line = (f"{name:65} {totals['read_seconds']:7.2f} {totals['transform_seconds']:9.2f} "
+                f"{totals['write_seconds'] if results['write'] else 0:7.2f} {totals['rows_in']:9d} "
+                f"{totals['rows_out']:9d} {totals['payload_bytes'] / 1024 / 1024:7.1f} "
+                f"{totals['rows_out'] / max(seconds, 1e-9):9.0f}")
+        previous = (baseline or {}).get('generators', {}).get(name)
+        if previous is not None:
+            previous_seconds = sum(previous[key] for key in stage_keys)
+            change = seconds / max(previous_seconds, 1e-9) - 1
+            line += f"  {change:+.0%}"
+            if change > tolerance:
+                line += " SLOWER"
+                regressions.append(name)
+        print(line)
+    print(f"Wall time {results['wall_seconds']:.1f}s")
+    if regressions:
+        print(f"{len(regressions)} query generators are more than {tolerance:.0%} slower than the baseline")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Open Targets datasets and benchmark the ingest")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="write synthetic parquet folders")
+    generate.add_argument("output_dir")
+    generate.add_argument("--scale", type=float, default=1.0, help="size of the dataset, 1 has 2000 targets")
+    generate.add_argument("--files", type=int, default=4, help="number of part files per data type")
+    generate.add_argument("--seed", type=int, default=0)
+    benchmark = commands.add_parser("benchmark", help="time the query generators over a dataset folder")
+    benchmark.add_argument("input_dir")
+    benchmark.add_argument("--write", action="store_true", help="also write to the Neo4j database of NEO4J_DOCKER_URL")
+    benchmark.add_argument("--workers", type=int, default=None, help="number of decoding processes")
+    benchmark.add_argument("--output", help="save the results to this JSON file")
+    benchmark.add_argument("--baseline", help="compare with the results saved in this JSON file")
+    benchmark.add_argument("--tolerance", type=float, default=0.2, help="slowdown flagged against the baseline")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate_synthetic_datasets(args.output_dir, args.scale, args.files, args.seed)
+    else:
+        results = benchmark_ingest(args.input_dir, args.write, args.workers)
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        regressions = print_benchmark(results, baseline, args.tolerance)
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(results, file, indent=2)
+        if regressions:
+            raise SystemExit(1)
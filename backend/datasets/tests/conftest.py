@@ -0,0 +1,15 @@
+import os
+import sys
+import pytest
+
+# The dataset scripts are run from backend/datasets and imported as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest_cache
+
+
+# Keep the ingest cache of the tests in their temporary directory
+@pytest.fixture(autouse=True)
+def ingest_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_cache, 'INGEST_CACHE_DIR', str(tmp_path / "ingest_cache"))
+    return ingest_cache.INGEST_CACHE_DIR
@@ -0,0 +1,103 @@
+import csv
+
+from bulk_import import BulkImportWriter, header_field
+
+NODE_KEYS = {'Target': 'ensembleId', 'Drug': 'chemblId', 'Baseline_Expression': 'efo_code'}
+
+
+def read_csv(path):
+    with open(path, newline='') as file:
+        return list(csv.reader(file))
+
+
+def node_query(label, props_to_keys, data):
+    return ("MERGE", {'data': data, 'dataset': f"test {label}", 'data_version': "test"},
+            {'node': label, 'properties': props_to_keys})
+
+
+def relationship_query(relationship_type, start, end, data, props_to_keys=None, averaged=()):
+    return ("MERGE", {'data': data, 'dataset': f"test {relationship_type}"},
+            {'relationship': relationship_type, 'start': start, 'end': end, 'properties': props_to_keys or {},
+             'averaged': list(averaged)})
+
+
+def test_nodes_are_written_once_per_key_with_their_last_properties(tmp_path):
+    writer = BulkImportWriter(str(tmp_path), "test", NODE_KEYS)
+    writer([("MERGE", {}, {'dataset': "test Target", 'source': 'Target'}),
+            node_query('Target', {'ensembleId': 'id', 'approvedName': 'name'},
+                       [{'id': "t1", 'name': "one"}, {'id': "t2", 'name': "two"}, {'id': None, 'name': "none"}])])
+    writer([node_query('Target', {'ensembleId': 'id', 'approvedName': 'name'}, [{'id': "t1", 'name': "renamed"}])])
+    writer.close()
+
+    assert read_csv(tmp_path / "nodes_Target.csv") == [
+        ["ensembleId:ID(Target)", "approvedName", "dataset", "data_version"], ["t2", "two", "test Target", "test"],
+        ["t1", "renamed", "test Target", "test"]]
+    assert writer.rows == 3
+    # The Dataset nodes of the only data version in the database are switched to
+    dataset = read_csv(tmp_path / "nodes_Dataset.csv")
+    assert dataset[0] == ["dataset:ID(Dataset)", "enabled:boolean", "source", "timestamp:long", "data_version",
+                          "activated:long"]
+    assert dataset[1][:3] == ["test Target", "true", "Target"]
+    assert dataset[1][4:] == ["test", dataset[1][3]]
+
+
+def test_relationships_are_written_once_per_nodes_and_merge_properties(tmp_path):
+    writer = BulkImportWriter(str(tmp_path), "test", NODE_KEYS)
+    data = [{'chemblId': "c1", 'ensembleId': "t1", 'actionType': "INHIBITOR"},
+            {'chemblId': "c1", 'ensembleId': "t1", 'actionType': "AGONIST"},
+            {'chemblId': "c1", 'ensembleId': None, 'actionType': "AGONIST"}]
+    writer([relationship_query('TARGETS', ('Drug', 'chemblId'), ('Target', 'ensembleId'), data,
+                               {'actionType': 'actionType'})])
+    writer([relationship_query('TARGETS', ('Drug', 'chemblId'), ('Target', 'ensembleId'), data[:1],
+                               {'actionType': 'actionType'})])
+    writer.close()
+
+    assert read_csv(tmp_path / "relationships_TARGETS.csv") == [
+        [":START_ID(Drug)", ":END_ID(Target)", "dataset", "actionType"],
+        ["c1", "t1", "test TARGETS", "AGONIST"], ["c1", "t1", "test TARGETS", "INHIBITOR"]]
+
+
+def test_averaged_relationships_are_written_once_with_their_last_value(tmp_path):
+    writer = BulkImportWriter(str(tmp_path), "test", NODE_KEYS)
+    start, end = ('Target', 'ensembleId'), ('Baseline_Expression', 'efo_code')
+    writer([relationship_query('HGENE', start, end, [{'ensembleId': "t1", 'efo_code': "e1", 'rna_value': 3.0},
+                                                     {'ensembleId': "t1", 'efo_code': "e2", 'rna_value': 1.0}],
+                               averaged=['rna_value'])])
+    writer([relationship_query('HGENE', start, end, [{'ensembleId': "t1", 'efo_code': "e1", 'rna_value': 2.0}],
+                               averaged=['rna_value'])])
+    writer.close()
+
+    assert read_csv(tmp_path / "relationships_HGENE.csv") == [
+        [":START_ID(Target)", ":END_ID(Baseline_Expression)", "dataset", "rna_value:double"],
+        ["t1", "e2", "test HGENE", "1.0"], ["t1", "e1", "test HGENE", "2.0"]]
+
+
+def test_import_script_imports_every_file(tmp_path):
+    writer = BulkImportWriter(str(tmp_path), "test", NODE_KEYS)
+    writer([node_query('Target', {'ensembleId': 'id'}, [{'id': "t1"}]),
+            relationship_query('TARGETS', ('Drug', 'chemblId'), ('Target', 'ensembleId'),
+                               [{'chemblId': "c1", 'ensembleId': "t1"}])])
+    writer.close()
+
+    script = (tmp_path / "import.sh").read_text()
+    assert "--nodes=Target=nodes_Target.csv" in script
+    assert "--relationships=TARGETS=relationships_TARGETS.csv" in script
+    assert script.rstrip().endswith("neo4j")
+
+
+def test_header_fields_are_typed_after_the_first_value():
+    data = [{'a': None, 'b': 1, 'c': 1.5, 'd': True, 'e': "x"}, {'a': 2, 'b': 2, 'c': 2.5, 'd': False, 'e': "y"}]
+
+    assert [header_field(column, data, column) for column in "abcde"] == ["a:long", "b:long", "c:double",
+                                                                          "d:boolean", "e"]
+
+
+def test_relationship_keys_of_different_types_are_different_relationships(tmp_path):
+    writer = BulkImportWriter(str(tmp_path), "test", NODE_KEYS)
+    data = [{'chemblId': "c1", 'ensembleId': "t1", 'score': 1}, {'chemblId': "c1", 'ensembleId': "t1", 'score': "1"},
+            {'chemblId': "c1", 'ensembleId': "t1", 'score': 1}]
+    writer([relationship_query('TARGETS', ('Drug', 'chemblId'), ('Target', 'ensembleId'), data, {'score': 'score'})])
+    writer.close()
+
+    assert len(read_csv(tmp_path / "relationships_TARGETS.csv")) == 3
+    assert all(len(key) == 16 for key in writer.written["relationships_TARGETS.csv"])
@@ -0,0 +1,74 @@
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import parse_datasets
+from compaction import compact_data_type, compact_datasets
+
+
+def write_parts(path, parts, rows=100):
+    os.makedirs(path, exist_ok=True)
+    for part in range(parts):
+        ids = [f"t{part}-{n}" for n in range(rows)]
+        pq.write_table(pa.table({'id': ids, 'approvedName': ids, 'approvedSymbol': ids, 'unused': ids}),
+                       os.path.join(path, f"part-{part:05d}.parquet"))
+
+
+def read_rows(path):
+    return sorted(row['id'] for file in sorted(os.listdir(path))
+                  for row in pq.read_table(os.path.join(path, file)).to_pylist())
+
+
+def test_compaction_keeps_every_row_and_only_the_columns_read(tmp_path):
+    write_parts(tmp_path / "targets", 5)
+
+    files = sorted(os.listdir(tmp_path / "targets"))
+    outputs = compact_data_type(str(tmp_path / "targets"), str(tmp_path / "compact"), files,
+                                ['approvedName', 'approvedSymbol', 'id'], 64)
+
+    assert outputs == ["compact-00000.parquet"]
+    assert read_rows(tmp_path / "compact") == read_rows(tmp_path / "targets")
+    assert pq.read_schema(str(tmp_path / "compact" / outputs[0])).names == ['id', 'approvedName', 'approvedSymbol']
+
+
+def test_compaction_writes_a_file_per_worker(tmp_path):
+    write_parts(tmp_path / "targets", 4, rows=5000)
+
+    files = sorted(os.listdir(tmp_path / "targets"))
+    outputs = compact_data_type(str(tmp_path / "targets"), str(tmp_path / "compact"), files, None, 64, workers=2)
+
+    assert len(outputs) >= 2
+    assert read_rows(tmp_path / "compact") == read_rows(tmp_path / "targets")
+
+
+def test_compact_datasets_only_compacts_the_changed_data_types(tmp_path, capsys):
+    input_dir, output_dir = tmp_path / "opentarget", str(tmp_path / "compact")
+    write_parts(input_dir / "targets", 2)
+    write_parts(input_dir / "diseases", 2)
+    os.makedirs(input_dir / "unknown")
+    columns = parse_datasets.data_type_columns()
+
+    assert compact_datasets(str(input_dir), columns, 64, output_dir=output_dir) == output_dir
+    assert sorted(os.listdir(output_dir)) == ['compaction_manifest.json', 'diseases', 'targets']
+    capsys.readouterr()
+
+    write_parts(input_dir / "targets", 3)
+    compact_datasets(str(input_dir), columns, 64, output_dir=output_dir)
+    out = capsys.readouterr().out
+    assert "Compaction of diseases is up to date" in out
+    assert "Compacted targets: 3 files into 1" in out
+    assert len(read_rows(os.path.join(output_dir, "targets"))) == 300
+
+    # The compacted files of a data type gone from the input are removed
+    for file in os.listdir(input_dir / "diseases"):
+        os.remove(input_dir / "diseases" / file)
+    os.rmdir(input_dir / "diseases")
+    compact_datasets(str(input_dir), columns, 64, output_dir=output_dir)
+    assert sorted(os.listdir(output_dir)) == ['compaction_manifest.json', 'targets']
+
+
+def test_data_type_columns_are_the_columns_of_every_generator():
+    columns = parse_datasets.data_type_columns()
+
+    assert set(columns) == set(parse_datasets.data_type_query_generators)
+    assert set(parse_datasets.create_cypher_query_targets.columns) <= set(columns['targets'])
@@ -0,0 +1,303 @@
+import os
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from get_datasets import DownloadFeed, download_datasets, download_file, local_file_state
+
+
+# Serve the files of server.root with HEAD, GET and Range requests like the Open Targets FTP server, and an HTML
+# listing of the directories. server.mode changes how the GET requests are answered:
+# - 'range': honour the Range header
+# - 'ignore-range': always send the whole file with a 200
+# - 'short': close the connection half way through the first file sent
+class FileRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_file(send_body=False)
+
+    def do_GET(self):
+        self.send_file(send_body=True)
+
+    def send_file(self, send_body):
+        path = os.path.join(self.server.root, self.path.lstrip('/'))
+        if self.path.endswith('/'):
+            listing = ''.join(f'<a href="{name}">{name}</a>\n' for name in sorted(os.listdir(path))).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(listing)))
+            self.end_headers()
+            self.wfile.write(listing)
+            return
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        self.server.requests.append((self.command, self.path, self.headers.get('Range')))
+        with open(path, 'rb') as file:
+            data = file.read()
+        start = 0
+        if self.headers.get('Range') and self.server.mode != 'ignore-range':
+            start = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{len(data)}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{len(data) - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+        body = data[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Last-Modified', formatdate(os.path.getmtime(path), usegmt=True))
+        self.end_headers()
+        if not send_body:
+            return
+        if self.server.mode == 'short' and not self.server.shortened:
+            self.server.shortened = True
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path / "server"
+    root.mkdir()
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FileRequestHandler)
+    httpd.root = str(root)
+    httpd.mode = 'range'
+    httpd.shortened = False
+    httpd.requests = []
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}"
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+# Write a small parquet file and return its bytes
+def write_parquet(path, rows=2000, offset=0):
+    pq.write_table(pa.table({'id': [f"ENSG{i:011d}" for i in range(offset, offset + rows)],
+                             'value': list(range(offset, offset + rows))}), str(path))
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def test_download_resumes_a_truncated_part_file(server, tmp_path):
+    data = write_parquet(tmp_path / "server" / "part-0.parquet")
+    output_file = str(tmp_path / "part-0.parquet")
+    with open(output_file + ".part", 'wb') as file:
+        file.write(data[:len(data) // 2])
+
+    result = download_file(f"{server.url}/part-0.parquet", output_file, max_retries=2, delay=0)
+
+    assert result['success']
+    assert result['resumed_bytes'] == len(data) // 2
+    assert result['bytes'] == len(data) - len(data) // 2
+    assert server.requests == [('GET', '/part-0.parquet', f"bytes={len(data) // 2}-")]
+    assert open(output_file, 'rb').read() == data
+    assert not os.path.exists(output_file + ".part")
+
+
+def test_download_restarts_when_the_server_ignores_range(server, tmp_path):
+    data = write_parquet(tmp_path / "server" / "part-0.parquet")
+    server.mode = 'ignore-range'
+    output_file = str(tmp_path / "part-0.parquet")
+    with open(output_file + ".part", 'wb') as file:
+        file.write(b"x" * 100)
+
+    result = download_file(f"{server.url}/part-0.parquet", output_file, max_retries=2, delay=0)
+
+    assert result['success']
+    assert result['resumed_bytes'] == 0
+    assert result['bytes'] == len(data)
+    assert open(output_file, 'rb').read() == data
+
+
+def test_download_restarts_when_the_range_is_not_satisfiable(server, tmp_path):
+    data = write_parquet(tmp_path / "server" / "part-0.parquet")
+    output_file = str(tmp_path / "part-0.parquet")
+    # A partial file longer than the file on the server, which changed since it was downloaded
+    with open(output_file + ".part", 'wb') as file:
+        file.write(b"x" * (len(data) + 100))
+
+    result = download_file(f"{server.url}/part-0.parquet", output_file, max_retries=2, delay=0)
+
+    assert result['success']
+    assert result['resumed_bytes'] == 0
+    assert [range_header for _, _, range_header in server.requests] == [f"bytes={len(data) + 100}-", None]
+    assert open(output_file, 'rb').read() == data
+
+
+def test_a_range_not_satisfiable_counts_as_an_attempt(server, tmp_path):
+    data = write_parquet(tmp_path / "server" / "part-0.parquet")
+    output_file = str(tmp_path / "part-0.parquet")
+    with open(output_file + ".part", 'wb') as file:
+        file.write(b"x" * (len(data) + 100))
+
+    result = download_file(f"{server.url}/part-0.parquet", output_file, max_retries=1, delay=0)
+
+    assert not result['success']
+    assert len(server.requests) == 1
+    assert not os.path.exists(output_file + ".part") and not os.path.exists(output_file)
+
+
+def test_download_resumes_after_the_connection_closed_early(server, tmp_path):
+    data = write_parquet(tmp_path / "server" / "part-0.parquet")
+    server.mode = 'short'
+    output_file = str(tmp_path / "part-0.parquet")
+
+    result = download_file(f"{server.url}/part-0.parquet", output_file, max_retries=3, delay=0)
+
+    assert result['success']
+    assert len(server.requests) == 2
+    assert server.requests[1][2] == f"bytes={result['resumed_bytes']}-"
+    assert 0 < result['resumed_bytes'] < len(data)
+    assert open(output_file, 'rb').read() == data
+
+
+def test_download_fails_without_a_parquet_footer(server, tmp_path):
+    with open(tmp_path / "server" / "part-0.parquet", 'wb') as file:
+        file.write(b"not a parquet file")
+    output_file = str(tmp_path / "part-0.parquet")
+
+    result = download_file(f"{server.url}/part-0.parquet", output_file, max_retries=2, delay=0)
+
+    assert not result['success']
+    assert len(server.requests) == 2
+    assert not os.path.exists(output_file)
+    assert not os.path.exists(output_file + ".part")
+
+
+def test_local_file_state(tmp_path):
+    path = tmp_path / "part-0.parquet"
+    data = write_parquet(path)
+    remote = {'size': len(data), 'last_modified': "Mon, 01 Jan 2024 00:00:00 GMT"}
+
+    assert local_file_state(str(tmp_path / "other.parquet"), remote, remote) == 'missing'
+    assert local_file_state(str(path), remote, remote) == 'present'
+    # Downloaded before the manifest existed, or the server can't be reached
+    assert local_file_state(str(path), None, remote) == 'present'
+    assert local_file_state(str(path), remote, None) == 'present'
+    # Changed on the server since it was downloaded
+    assert local_file_state(str(path), remote, dict(remote, last_modified="Tue, 02 Jan 2024 00:00:00 GMT")) == 'stale'
+    assert local_file_state(str(path), remote, dict(remote, size=len(data) + 1)) == 'stale'
+
+    # Truncated, checked against the server and against the manifest
+    with open(path, 'wb') as file:
+        file.write(data[:-100])
+    assert local_file_state(str(path), None, remote) == 'corrupt'
+    assert local_file_state(str(path), remote, None) == 'corrupt'
+    # The right size, but no readable footer
+    with open(path, 'wb') as file:
+        file.write(b"x" * len(data))
+    assert local_file_state(str(path), remote, remote) == 'corrupt'
+
+
+def test_download_datasets_only_downloads_missing_and_stale_files(server, tmp_path):
+    os.makedirs(tmp_path / "server" / "fda")
+    names = [f"part-{n}.parquet" for n in range(3)]
+    for n, name in enumerate(names):
+        write_parquet(tmp_path / "server" / "fda" / name, rows=500, offset=n * 500)
+    paths = {'fda': ["opentarget/fda", f"{server.url}/fda/"]}
+    output_root = tmp_path / "local"
+    output_dir = str(output_root / "opentarget" / "fda")
+    options = {'max_workers': 2, 'output_root': str(output_root), 'manifest_path': str(tmp_path / "manifest.json")}
+
+    feed = DownloadFeed()
+    report = download_datasets(paths, feed=feed, **options)
+    feed.close()
+    assert report['fda']['downloaded'] == 3
+    assert sorted(feed.files(output_dir)) == names
+    for name in names:
+        assert pq.read_table(os.path.join(output_dir, name)).equals(pq.read_table(tmp_path / "server" / "fda" / name))
+
+    # Complete files are only checked with a HEAD request
+    server.requests.clear()
+    report = download_datasets(paths, **options)
+    assert report['fda']['present'] == 3
+    assert report['fda']['bytes'] == 0
+    assert {command for command, _, _ in server.requests} == {'HEAD'}
+
+    # A file changed on the server is downloaded again
+    data = write_parquet(tmp_path / "server" / "fda" / names[1], rows=700)
+    modified = time.time() + 60
+    os.utime(tmp_path / "server" / "fda" / names[1], (modified, modified))
+    report = download_datasets(paths, **options)
+    assert (report['fda']['present'], report['fda']['refreshed']) == (2, 1)
+    assert open(os.path.join(output_dir, names[1]), 'rb').read() == data
+
+
+# Create empty files in a data type directory
+def touch_files(data_type_path, names):
+    os.makedirs(data_type_path, exist_ok=True)
+    for name in names:
+        open(os.path.join(data_type_path, name), 'wb').close()
+
+
+def test_feed_yields_the_files_in_completion_order(tmp_path):
+    data_type_path = str(tmp_path / "fda")
+    touch_files(data_type_path, ["a.parquet", "b.parquet", "c.parquet"])
+    feed = DownloadFeed()
+    feed.list_files(data_type_path, ["a.parquet", "b.parquet", "c.parquet"])
+    for name in ["c.parquet", "a.parquet", "b.parquet"]:
+        feed.file_done(os.path.join(data_type_path, name))
+
+    assert list(feed.files(data_type_path)) == ["c.parquet", "a.parquet", "b.parquet"]
+    assert feed.progress() == (3, 3)
+
+
+def test_feed_waits_for_the_files_being_downloaded(tmp_path):
+    data_type_path = str(tmp_path / "fda")
+    touch_files(data_type_path, ["a.parquet", "b.parquet"])
+    feed = DownloadFeed()
+    feed.list_files(data_type_path, ["a.parquet", "b.parquet"])
+    yielded = []
+    consumer = threading.Thread(target=lambda: yielded.extend(file for file in feed.files(data_type_path)), daemon=True)
+    consumer.start()
+
+    feed.file_done(os.path.join(data_type_path, "a.parquet"))
+    consumer.join(0.2)
+    assert consumer.is_alive()
+    assert feed.remaining(data_type_path) == 1
+
+    feed.file_done(os.path.join(data_type_path, "b.parquet"))
+    consumer.join(5)
+    assert not consumer.is_alive()
+    assert yielded == ["a.parquet", "b.parquet"]
+    assert feed.remaining(data_type_path) == 0
+
+
+def test_feed_skips_the_files_that_failed_to_download(tmp_path):
+    data_type_path = str(tmp_path / "fda")
+    touch_files(data_type_path, ["a.parquet"])
+    feed = DownloadFeed()
+    feed.list_files(data_type_path, ["a.parquet", "b.parquet"])
+    feed.file_done(os.path.join(data_type_path, "b.parquet"))
+    feed.file_done(os.path.join(data_type_path, "a.parquet"))
+
+    assert list(feed.files(data_type_path)) == ["a.parquet"]
+
+
+def test_feed_yields_the_files_on_disk_of_the_data_types_not_listed(tmp_path):
+    failed_path = str(tmp_path / "fda")
+    touch_files(failed_path, ["b.parquet", "a.parquet", "notes.txt"])
+    feed = DownloadFeed()
+    feed.list_files(failed_path, None)
+    assert list(feed.files(failed_path)) == ["a.parquet", "b.parquet"]
+
+    # A data type that isn't downloaded is complete once the download is over
+    other_path = str(tmp_path / "targets")
+    touch_files(other_path, ["a.parquet"])
+    assert not feed.is_complete("targets")
+    assert feed.remaining(other_path) == float('inf')
+    feed.close()
+    assert list(feed.files(other_path)) == ["a.parquet"]
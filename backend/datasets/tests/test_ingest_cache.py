@@ -0,0 +1,128 @@
+import os
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import ingest_cache
+import ingest_report
+import parse_datasets
+from ingest_cache import (cache_queries, commit_cache_writer, evict_ingest_cache, ingest_cache_entry,
+                          new_cache_writer, read_cached_queries)
+
+
+@pytest.fixture(autouse=True)
+def test_data_version(monkeypatch):
+    monkeypatch.setattr(parse_datasets, 'data_version', "test")
+    monkeypatch.setattr(parse_datasets, 'INGEST_CACHE', True)
+
+
+def read_metrics():
+    return {'read_seconds': 0}
+
+
+def node_queries(ids):
+    return [("MERGE", {'data': [{'id': id, 'score': 0.5} for id in ids], 'dataset': "test Target"},
+             {'node': 'Target', 'properties': {'ensembleId': 'id'}}),
+            ("MERGE", {'dataset': "test Target"}, {'dataset': "test Target", 'source': 'Target'})]
+
+
+def test_cached_queries_are_read_back_once_committed(ingest_cache_dir):
+    entry = ingest_cache_entry("hash", parse_datasets.create_cypher_query_targets, "test")
+    cache = new_cache_writer(entry)
+    cache_queries(cache, 2, node_queries(["t1", "t2"]))
+    cache_queries(cache, 1, node_queries(["t3"]))
+    assert not os.path.isdir(entry)
+
+    commit_cache_writer(cache)
+
+    assert list(read_cached_queries(entry, read_metrics())) == [(2, node_queries(["t1", "t2"])),
+                                                               (1, node_queries(["t3"]))]
+    assert os.listdir(ingest_cache_dir) == [os.path.basename(entry)]
+
+
+def test_data_that_arrow_cannot_store_is_not_cached(ingest_cache_dir, capsys):
+    entry = ingest_cache_entry("hash", parse_datasets.create_cypher_query_targets, "test")
+    cache = new_cache_writer(entry)
+    cache_queries(cache, 2, [("MERGE", {'data': [{'id': "t1"}, {'id': 2}]}, {})])
+
+    commit_cache_writer(cache)
+
+    assert "Not caching" in capsys.readouterr().out
+    assert os.listdir(ingest_cache_dir) == []
+
+
+def test_entries_depend_on_the_file_the_generator_and_the_data_version():
+    targets = parse_datasets.create_cypher_query_targets
+    entry = ingest_cache_entry("hash", targets, "test")
+
+    assert entry == ingest_cache_entry("hash", targets, "test")
+    assert len({entry, ingest_cache_entry("other", targets, "test"), ingest_cache_entry("hash", targets, "next"),
+                ingest_cache_entry("hash", parse_datasets.create_cypher_query_drugs, "test")}) == 4
+
+
+def test_generate_queries_reads_an_unchanged_file_from_the_cache(tmp_path):
+    ids = [f"t{n}" for n in range(10)]
+    pq.write_table(pa.table({'id': ids, 'approvedName': ids, 'approvedSymbol': ids}), str(tmp_path / "part-0.parquet"))
+    calls = []
+
+    def targets(table):
+        calls.append(table.num_rows)
+        return parse_datasets.create_cypher_query_targets(table)
+
+    def generate():
+        written = []
+        parse_datasets.generate_queries("targets", str(tmp_path), targets, writer=written.extend)
+        return [row for _, params, _ in written for row in params.get('data', [])]
+
+    ingest_report.clear_ingest_report()
+    first = generate()
+    second = generate()
+
+    assert calls == [10]
+    assert second == first and len(first) == 10
+    assert [metrics['cache'] for metrics in ingest_report.ingest_report['files']] == ['miss', 'hit']
+
+    # A changed file is transformed again
+    pq.write_table(pa.table({'id': ids[:5], 'approvedName': ids[:5], 'approvedSymbol': ids[:5]}),
+                   str(tmp_path / "part-0.parquet"))
+    assert len(generate()) == 5
+    assert calls == [10, 5]
+
+
+def test_generate_queries_reuses_the_hashes_of_the_manifest_fingerprints(tmp_path, ingest_cache_dir, monkeypatch):
+    ids = [f"t{n}" for n in range(10)]
+    pq.write_table(pa.table({'id': ids, 'approvedName': ids, 'approvedSymbol': ids}), str(tmp_path / "part-0.parquet"))
+
+    def file_fingerprint(file_path, previous=None):
+        raise AssertionError(f"{file_path} is hashed again")
+
+    monkeypatch.setattr(parse_datasets, 'file_fingerprint', file_fingerprint)
+    targets = parse_datasets.create_cypher_query_targets
+    parse_datasets.generate_queries("targets", str(tmp_path), targets, writer=lambda queries: None,
+                                    fingerprints={'targets/part-0.parquet': {'hash': "manifest hash"}})
+
+    assert os.listdir(ingest_cache_dir) == [os.path.basename(ingest_cache_entry("manifest hash", targets, "test"))]
+
+
+def test_evict_ingest_cache_removes_the_old_then_the_least_recently_used_entries(ingest_cache_dir, monkeypatch):
+    entries = []
+    for n in range(3):
+        entry = ingest_cache_entry(str(n), parse_datasets.create_cypher_query_targets, "test")
+        cache = new_cache_writer(entry)
+        cache_queries(cache, 1000, node_queries([f"t{i}" for i in range(1000)]))
+        commit_cache_writer(cache)
+        entries.append(entry)
+    now = time.time()
+    os.utime(entries[0], (now - 40 * 86400, now - 40 * 86400))
+    os.utime(entries[1], (now - 2, now - 2))
+    os.utime(entries[2], (now - 1, now - 1))
+
+    evict_ingest_cache()
+    assert sorted(os.listdir(ingest_cache_dir)) == sorted(os.path.basename(entry) for entry in entries[1:])
+
+    # Room for one and a half entries
+    size = sum(os.path.getsize(os.path.join(entries[2], file)) for file in os.listdir(entries[2]))
+    monkeypatch.setattr(ingest_cache, 'INGEST_CACHE_MB', 1.5 * size / 1024 / 1024)
+    evict_ingest_cache()
+    assert os.listdir(ingest_cache_dir) == [os.path.basename(entries[2])]
@@ -0,0 +1,74 @@
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import ingest_report
+import parse_datasets
+from ingest_estimate import batch_memory_mb, estimate_ingest, ingest_cost_models
+
+
+# File metrics of the ingest report of a generator: 1000 parquet rows, 800 kept, 1600 entries of 50 bytes
+def file_metrics(generator, cache=None, file_rows=1000):
+    return {'generator': generator, 'file_rows': file_rows, 'rows_in': 800, 'rows_out': 1600, 'payload_bytes': 80000,
+            'decoded_bytes': 10000, 'read_seconds': 0.5, 'transform_seconds': 0.5, 'write_seconds': 4.0,
+            'batches': 2, 'cache': cache}
+
+
+def test_ingest_cost_models_are_calibrated_on_the_file_metrics():
+    report = {'files': [file_metrics("create_cypher_query_targets"),
+                        file_metrics("create_cypher_query_targets", cache='hit'),
+                        file_metrics("create_cypher_query_drugs", file_rows=0)]}
+
+    models = ingest_cost_models(report)
+
+    # Reports without the parquet figures can't be calibrated on
+    assert list(models) == ["create_cypher_query_targets"]
+    model = models["create_cypher_query_targets"]
+    assert (model['kept'], model['entries'], model['entry_bytes']) == (0.8, 2.0, 50.0)
+    # The files read from the ingest cache say nothing of the transform time
+    assert model['transform_rate'] == 1.0 / 10000
+    assert model['write_rate'] == 8.0 / 3200
+
+
+def test_estimate_ingest_scales_the_last_ingest_to_the_input_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(parse_datasets, 'data_version', "test")
+    data_type_path = tmp_path / "opentarget" / "targets"
+    data_type_path.mkdir(parents=True)
+    for n in range(2):
+        ids = [f"t{n}-{i}" for i in range(500)]
+        pq.write_table(pa.table({'id': ids, 'approvedName': ids, 'approvedSymbol': ids}),
+                       str(data_type_path / f"part-{n}.parquet"))
+
+    # Calibrated on an ingest of one of the files
+    ingest_report.clear_ingest_report()
+    parse_datasets.generate_queries("targets", str(data_type_path), parse_datasets.create_cypher_query_targets,
+                                    writer=lambda queries: None, files=["part-0.parquet"])
+    report_path = str(tmp_path / "ingest_report.json")
+    ingest_report.write_ingest_report("test", report_path)
+    assert json.load(open(report_path))['files'][0]['file_rows'] == 500
+
+    tasks = parse_datasets.find_ingest_tasks(str(tmp_path / "opentarget"))
+    estimates = estimate_ingest(tasks, report_path, 64)
+
+    estimate = next(e for e in estimates if e['generator'] == "targets/create_cypher_query_targets")
+    assert (estimate['files'], estimate['rows'], estimate['writes']) == (2, 1000, 'nodes')
+    assert estimate['entries'] == 1000
+    assert estimate['transform_seconds'] is not None and estimate['memory_mb'] > 0
+
+
+def test_estimate_ingest_without_a_report_only_reads_the_footers(tmp_path, capsys):
+    (tmp_path / "targets").mkdir()
+    pq.write_table(pa.table({'id': ["t1"], 'approvedName': ["one"], 'approvedSymbol': ["ONE"]}),
+                   str(tmp_path / "targets" / "part-0.parquet"))
+
+    estimates = estimate_ingest(parse_datasets.find_ingest_tasks(str(tmp_path)), str(tmp_path / "none.json"), 64)
+
+    assert {(estimate['rows'], estimate['entries']) for estimate in estimates} == {(1, None)}
+    assert "only the parquet figures are estimated" in capsys.readouterr().out
+
+
+def test_batch_memory_mb_holds_one_record_batch_when_streaming():
+    footer = {'rows': 10000, 'decoded_bytes': 10 * 1024 * 1024, 'batch_rows': 1000}
+
+    assert batch_memory_mb(footer, True) * 10 == batch_memory_mb(footer, False)
+    assert batch_memory_mb({'rows': 0, 'decoded_bytes': 0, 'batch_rows': 0}, True) == 0
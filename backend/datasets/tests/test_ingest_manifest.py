@@ -0,0 +1,148 @@
+import os
+import pytest
+
+import ingest_manifest
+from ingest_manifest import (feed_task_files, file_fingerprint, load_ingest_manifest, new_ingest_manifest,
+                             record_ingested_file, save_ingest_manifest, select_changed_tasks)
+from parse_datasets import find_ingest_tasks
+
+
+# Input directory with two baseExpressions files, read by a node generator and two edge generators, and an ingest
+# manifest in the temporary directory
+@pytest.fixture
+def input_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_manifest, 'INGEST_MANIFEST', str(tmp_path / "ingest_manifest.json"))
+    data_type_path = tmp_path / "opentarget" / "baseExpressions"
+    data_type_path.mkdir(parents=True)
+    for n in range(2):
+        (data_type_path / f"part-{n}.parquet").write_bytes(f"file {n}".encode())
+    return str(tmp_path / "opentarget")
+
+
+# Files left to read by each selected task, by query generator name
+def selected_files(selected):
+    return {task['query_generator'].__name__: task['files'] for task in selected}
+
+
+def tasks_by_generator(input_dir):
+    return {task['query_generator'].__name__: task for task in find_ingest_tasks(input_dir)}
+
+
+def test_select_changed_tasks_resumes_from_the_checkpoints(input_dir):
+    both = ["part-0.parquet", "part-1.parquet"]
+    tasks = tasks_by_generator(input_dir)
+    selected, fingerprints = select_changed_tasks(input_dir, list(tasks.values()), new_ingest_manifest("test"))
+    assert selected_files(selected) == {'create_cypher_query_baseline_expression': both,
+                                        'create_cypher_query_hgene': both, 'create_cypher_query_hprotein': both}
+
+    # Interrupted while create_cypher_query_hprotein was reading its second file
+    manifest = new_ingest_manifest("test")
+    for key in fingerprints:
+        record_ingested_file(manifest, tasks['create_cypher_query_baseline_expression'], key, fingerprints)
+        record_ingested_file(manifest, tasks['create_cypher_query_hgene'], key, fingerprints)
+    record_ingested_file(manifest, tasks['create_cypher_query_hprotein'], "baseExpressions/part-0.parquet",
+                         fingerprints)
+
+    # It reads both files again, as it averages over all of them
+    selected, fingerprints = select_changed_tasks(input_dir, list(tasks.values()), load_ingest_manifest("test"))
+    assert selected_files(selected) == {'create_cypher_query_hprotein': both}
+
+    # A changed file is read again by every generator, and only it by the ones that don't average
+    with open(os.path.join(input_dir, "baseExpressions", "part-1.parquet"), "wb") as file:
+        file.write(b"file 1, new version")
+    selected, fingerprints = select_changed_tasks(input_dir, list(tasks.values()), load_ingest_manifest("test"))
+    assert selected_files(selected) == {'create_cypher_query_baseline_expression': ["part-1.parquet"],
+                                        'create_cypher_query_hgene': both, 'create_cypher_query_hprotein': both}
+
+
+def test_select_changed_tasks_forgets_the_removed_files(input_dir):
+    tasks = find_ingest_tasks(input_dir)
+    manifest = new_ingest_manifest("test")
+    selected, fingerprints = select_changed_tasks(input_dir, tasks, manifest)
+    for task in selected:
+        for key in fingerprints:
+            record_ingested_file(manifest, task, key, fingerprints)
+
+    os.remove(os.path.join(input_dir, "baseExpressions", "part-0.parquet"))
+    manifest = load_ingest_manifest("test")
+    selected, _ = select_changed_tasks(input_dir, tasks, manifest)
+
+    assert selected == []
+    assert list(manifest['files']) == ["baseExpressions/part-1.parquet"]
+    assert list(load_ingest_manifest("test")['files']) == ["baseExpressions/part-1.parquet"]
+
+
+def test_load_ingest_manifest_ignores_other_data_versions(input_dir):
+    assert load_ingest_manifest("test") is None
+    manifest = new_ingest_manifest("test")
+    manifest['files']['baseExpressions/part-0.parquet'] = {'size': 6, 'mtime': 0, 'hash': "0", 'generators': []}
+    save_ingest_manifest(manifest)
+    assert load_ingest_manifest("test") == manifest
+
+    assert load_ingest_manifest("next") == {'data_version': "next", 'files': {}}
+
+    with open(ingest_manifest.INGEST_MANIFEST, "w") as file:
+        file.write("{")
+    assert load_ingest_manifest("test") == {'data_version': "test", 'files': {}}
+
+
+def test_record_ingested_file_resets_the_generators_of_a_changed_file(input_dir):
+    tasks = tasks_by_generator(input_dir)
+    manifest = new_ingest_manifest("test")
+    key = "baseExpressions/part-0.parquet"
+    _, fingerprints = select_changed_tasks(input_dir, list(tasks.values()), manifest)
+    record_ingested_file(manifest, tasks['create_cypher_query_baseline_expression'], key, fingerprints)
+    record_ingested_file(manifest, tasks['create_cypher_query_hgene'], key, fingerprints)
+    record_ingested_file(manifest, tasks['create_cypher_query_hgene'], key, fingerprints)
+    assert manifest['files'][key]['generators'] == ['create_cypher_query_baseline_expression',
+                                                    'create_cypher_query_hgene']
+
+    with open(os.path.join(input_dir, key), "wb") as file:
+        file.write(b"file 0, new version")
+    _, fingerprints = select_changed_tasks(input_dir, list(tasks.values()), manifest)
+    record_ingested_file(manifest, tasks['create_cypher_query_hgene'], key, fingerprints)
+
+    assert manifest['files'][key]['generators'] == ['create_cypher_query_hgene']
+    assert manifest['files'][key]['hash'] == fingerprints[key]['hash']
+
+
+def test_file_fingerprint_reuses_the_hash_of_an_unchanged_file(input_dir):
+    file_path = os.path.join(input_dir, "baseExpressions", "part-0.parquet")
+    fingerprint = file_fingerprint(file_path)
+    assert len(fingerprint['hash']) == 64
+
+    assert file_fingerprint(file_path, {**fingerprint, 'hash': "previous"})['hash'] == "previous"
+    os.utime(file_path, (0, 0))
+    assert file_fingerprint(file_path, {**fingerprint, 'hash': "previous"})['hash'] == fingerprint['hash']
+
+
+# Download feed yielding the files of every data type in the given order
+class ListFeed:
+    def __init__(self, files):
+        self.files_done = files
+
+    def files(self, data_type_path):
+        yield from self.files_done
+
+
+def test_feed_task_files_skips_the_files_already_read(input_dir):
+    tasks = tasks_by_generator(input_dir)
+    manifest = new_ingest_manifest("test")
+    _, fingerprints = select_changed_tasks(input_dir, list(tasks.values()), manifest)
+    for name in ('create_cypher_query_baseline_expression', 'create_cypher_query_hgene'):
+        record_ingested_file(manifest, tasks[name], "baseExpressions/part-0.parquet", fingerprints)
+
+    def feed_files(name, order, manifest=manifest):
+        return list(feed_task_files(tasks[name], ListFeed(order), manifest, {}))
+
+    in_order, reversed_order = ["part-0.parquet", "part-1.parquet"], ["part-1.parquet", "part-0.parquet"]
+    assert feed_files('create_cypher_query_baseline_expression', in_order) == ["part-1.parquet"]
+    assert feed_files('create_cypher_query_baseline_expression', reversed_order) == ["part-1.parquet"]
+    # An averaging generator reads the skipped files again once it has to read one
+    assert feed_files('create_cypher_query_hgene', in_order) == in_order
+    assert feed_files('create_cypher_query_hgene', reversed_order) == reversed_order
+    # Without a manifest every file is read
+    assert feed_files('create_cypher_query_baseline_expression', in_order, manifest=None) == in_order
+
+    record_ingested_file(manifest, tasks['create_cypher_query_hgene'], "baseExpressions/part-1.parquet", fingerprints)
+    assert feed_files('create_cypher_query_hgene', in_order) == []
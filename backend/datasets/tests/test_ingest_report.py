@@ -0,0 +1,75 @@
+import csv
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import ingest_report
+from ingest_report import (WRITE_COUNTERS, add_write_counters, clear_ingest_report, finish_file_metrics,
+                           new_file_metrics, payload_bytes, record_generator_timings, write_ingest_report)
+
+
+@pytest.fixture(autouse=True)
+def empty_report():
+    clear_ingest_report()
+    yield
+    clear_ingest_report()
+
+
+def test_finished_file_metrics_are_added_to_the_report():
+    metrics = new_file_metrics("targets", "create_cypher_query_targets", "part-0.parquet")
+    metrics['read_seconds'] = 0.12345
+
+    finish_file_metrics(metrics)
+    finish_file_metrics(new_file_metrics("targets", "create_cypher_query_targets", "part-1.parquet"), report=False)
+
+    assert ingest_report.ingest_report['files'] == [metrics]
+    assert 'started' not in metrics
+    assert metrics['read_seconds'] == 0.123
+    assert metrics['max_rss_mb'] > 0 and metrics['peak_traced_mb'] is None
+
+
+def test_failed_batches_are_reported(capsys):
+    metrics = new_file_metrics("targets", "create_cypher_query_targets", "part-0.parquet")
+    metrics['failed_batches'] = 2
+
+    finish_file_metrics(metrics, {'peak_traced_mb': 3.0, 'max_rss_mb': 1e9})
+
+    assert "2 batches of create_cypher_query_targets failed to write for part-0.parquet" in capsys.readouterr().out
+    # The memory figures of the worker process are kept when they are higher
+    assert metrics['peak_traced_mb'] == 3.0 and metrics['max_rss_mb'] == 1e9
+
+
+def test_write_ingest_report_writes_the_json_and_csv_reports(tmp_path):
+    path = str(tmp_path / "ingest_report.json")
+    write_ingest_report("test", path)
+    assert not (tmp_path / "ingest_report.json").exists()
+
+    record_generator_timings({"targets/create_cypher_query_targets": (0.5, 2.0)}, 2.5)
+    finish_file_metrics(new_file_metrics("targets", "create_cypher_query_targets", "part-0.parquet"))
+    write_ingest_report("test", path)
+
+    report = json.loads((tmp_path / "ingest_report.json").read_text())
+    assert report['data_version'] == "test"
+    assert report['wall_seconds'] == 2.5
+    assert report['generators'] == {"targets/create_cypher_query_targets": {'start_seconds': 0.5, 'seconds': 1.5}}
+    with open(tmp_path / "ingest_report.csv", newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert [(row['generator'], row['file']) for row in rows] == [("create_cypher_query_targets", "part-0.parquet")]
+
+
+def test_payload_bytes_extrapolates_the_json_size_of_a_sample():
+    data = [{'id': "t1"}] * 1000
+
+    assert payload_bytes({'data': data}, sample_size=10) == len(json.dumps(data))
+    assert payload_bytes({'dataset': "test Target"}) == 0
+
+
+def test_write_counters_add_the_transaction_counters_and_count_the_failed_batches():
+    totals = dict.fromkeys(WRITE_COUNTERS, 0)
+
+    add_write_counters(totals, SimpleNamespace(nodes_created=2, relationships_created=0, properties_set=6))
+    add_write_counters(totals, None)
+
+    assert totals == {'batches': 1, 'failed_batches': 1, 'nodes_created': 2, 'relationships_created': 0,
+                      'properties_set': 6}
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from ingest_scheduler import ingest_task_dependencies, print_critical_path, run_ingest_tasks
+
+
+# Task of a query generator creating and requiring the given node labels, as found by find_ingest_tasks
+def new_task(name, creates=(), requires=()):
+    def query_generator(table):
+        return []
+    query_generator.creates = list(creates)
+    query_generator.requires = list(requires)
+    return {'name': name, 'query_generator': query_generator, 'locks': set(requires)}
+
+
+def new_tasks():
+    tasks = [new_task("targets", creates=['Target']), new_task("drugs", creates=['Drug']),
+             new_task("mechanism", requires=['Drug', 'Target']), new_task("interactions", requires=['Target'])]
+    ingest_task_dependencies(tasks)
+    return tasks
+
+
+def test_a_task_depends_on_the_tasks_creating_the_labels_it_requires():
+    assert [task['depends'] for task in new_tasks()] == [set(), set(), {"targets", "drugs"}, {"targets"}]
+
+
+def test_tasks_run_in_order_after_their_dependencies():
+    tasks = new_tasks()
+    tasks.reverse()
+    ran = []
+
+    timings, wall_time = run_ingest_tasks(tasks, lambda task: ran.append(task['name']), 1)
+
+    assert ran == ["drugs", "targets", "interactions", "mechanism"]
+    assert timings.keys() == {"targets", "drugs", "mechanism", "interactions"}
+    assert all(0 <= start <= end <= wall_time for start, end in timings.values())
+
+
+
+def test_the_ready_tasks_start_in_the_order_of_their_priority():
+    tasks = new_tasks()
+    ran = []
+    # Files left to download of the data type of each task
+    remaining = {"targets": 5, "drugs": 0, "mechanism": 1, "interactions": 0}
+
+    run_ingest_tasks(tasks, lambda task: ran.append(task['name']), 1, lambda task: remaining[task['name']])
+
+    assert ran == ["drugs", "targets", "interactions", "mechanism"]
+
+def test_concurrent_tasks_never_share_a_lock():
+    tasks = new_tasks()
+    running = []
+    overlaps = []
+    lock = threading.Lock()
+
+    def run_task(task):
+        with lock:
+            overlaps.extend((task['name'], other['name']) for other in running if task['locks'] & other['locks'])
+            running.append(task)
+        time.sleep(0.05)
+        with lock:
+            running.remove(task)
+
+    timings, _ = run_ingest_tasks(tasks, run_task, 4)
+
+    assert overlaps == []
+    # The node tasks ran together, the two edge tasks writing Target relationships one after the other
+    assert abs(timings["targets"][0] - timings["drugs"][0]) < 0.04
+    mechanism, interactions = timings["mechanism"], timings["interactions"]
+    assert mechanism[1] <= interactions[0] or interactions[1] <= mechanism[0]
+
+
+def test_unsatisfiable_dependencies_fail_the_run():
+    tasks = [new_task("targets", creates=['Target']), new_task("mechanism", requires=['Drug', 'Target'])]
+    ingest_task_dependencies(tasks)
+    tasks[1]['depends'].add("drugs")
+
+    with pytest.raises(ValueError, match="mechanism"):
+        run_ingest_tasks(tasks, lambda task: None, 1)
+
+
+def test_the_critical_path_is_the_longest_chain_of_dependent_tasks(capsys):
+    tasks = new_tasks()
+    timings = {"targets": (0, 1), "drugs": (0, 3), "interactions": (1, 2.5), "mechanism": (3, 4)}
+
+    print_critical_path(tasks, timings, 4.5)
+
+    output = capsys.readouterr().out
+    assert "Critical path: 4.0s of 4.5s wall time" in output
+    assert "drugs -> mechanism" in output
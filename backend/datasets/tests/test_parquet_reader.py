@@ -0,0 +1,108 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import parquet_reader
+from parquet_reader import (logical_column_name, parquet_footer, read_parquet_tables, resolve_parquet_columns,
+                            stream_batch_rows)
+
+
+# Parquet file of 'rows' targets in row groups of 100 rows
+def write_targets(path, rows=1000):
+    pq.write_table(pa.table({'id': [f"t{n}" for n in range(rows)], 'score': [float(n) for n in range(rows)]}),
+                   str(path), row_group_size=100)
+
+
+def test_stream_batch_rows_follows_the_memory_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(parquet_reader, 'MIN_BATCH_ROWS', 1)
+    write_targets(tmp_path / "part-0.parquet")
+    metadata = pq.read_metadata(tmp_path / "part-0.parquet")
+
+    small, large = stream_batch_rows(metadata, 1), stream_batch_rows(metadata, 4)
+    assert 1 < small < large
+    assert large // small == 4
+    # A budget too small for one row still reads MIN_BATCH_ROWS rows
+    monkeypatch.setattr(parquet_reader, 'MIN_BATCH_ROWS', 50)
+    assert stream_batch_rows(metadata, 0) == 50
+
+
+def test_read_parquet_tables_streams_record_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(parquet_reader, 'MIN_BATCH_ROWS', 150)
+    write_targets(tmp_path / "part-0.parquet")
+
+    streamed = list(read_parquet_tables(str(tmp_path / "part-0.parquet"), 0))
+    whole = list(read_parquet_tables(str(tmp_path / "part-0.parquet"), 0, stream=False))
+
+    assert [table.num_rows for table in streamed] == [150] * 6 + [100]
+    assert [table.num_rows for table in whole] == [1000]
+    assert pa.concat_tables(streamed).equals(whole[0])
+
+
+def test_read_parquet_tables_skips_the_files_it_cannot_read(tmp_path):
+    (tmp_path / "part-0.parquet").write_bytes(b"not a parquet file")
+
+    assert list(read_parquet_tables(str(tmp_path / "part-0.parquet"), 64)) == []
+    assert list(read_parquet_tables(str(tmp_path / "part-0.parquet"), 64, stream=False)) == []
+
+
+def test_logical_column_name_removes_the_list_levels():
+    # Spark writes the list items as 'list.element', PyArrow as 'list.item'
+    assert logical_column_name('tissues.list.element.efo_code') == 'tissues.efo_code'
+    assert logical_column_name('tissues.list.item.rna.value') == 'tissues.rna.value'
+    assert logical_column_name('synonyms.list.element') == 'synonyms'
+    assert logical_column_name('id') == 'id'
+    # A field named 'list' is kept
+    assert logical_column_name('list.value') == 'list.value'
+    assert logical_column_name('list') == 'list'
+
+
+# Parquet file with a list of structs, as the baseExpressions files
+def write_expressions(path):
+    tissues = pa.array([[{'efo_code': "e1", 'rna': {'value': 1.0, 'unit': "TPM"}}],
+                        [{'efo_code': "e2", 'rna': {'value': 2.0, 'unit': "TPM"}}],
+                        None])
+    pq.write_table(pa.table({'id': ["t1", "t2", "t3"], 'tissues': tissues}), str(path))
+
+
+def test_resolve_parquet_columns_selects_the_leaves_below_each_column(tmp_path):
+    write_expressions(tmp_path / "part-0.parquet")
+    schema = pq.read_metadata(tmp_path / "part-0.parquet").schema
+
+    def logical_names(columns):
+        return [logical_column_name(path) for path in resolve_parquet_columns(schema, columns)]
+
+    assert resolve_parquet_columns(schema, None) is None
+    assert logical_names(['id', 'tissues.rna.value']) == ['id', 'tissues.rna.value']
+    assert sorted(logical_names(['tissues'])) == ['tissues.efo_code', 'tissues.rna.unit', 'tissues.rna.value']
+    # A column is not selected by another one that is a prefix of its name
+    assert logical_names(['tissues.rna.val']) == []
+
+
+def test_read_parquet_tables_projects_and_filters(tmp_path):
+    write_expressions(tmp_path / "part-0.parquet")
+    stats = {}
+
+    tables = list(read_parquet_tables(str(tmp_path / "part-0.parquet"), 64, columns=['id', 'tissues.efo_code'],
+                                      row_filter=pc.field('tissues').is_valid(), stats=stats))
+
+    table = pa.concat_tables(tables)
+    assert table.column('id').to_pylist() == ["t1", "t2"]
+    assert table.column('tissues').to_pylist() == [[{'efo_code': "e1"}], [{'efo_code': "e2"}]]
+    assert (stats['files'], stats['columns_read'], stats['columns_total']) == (1, 2, 4)
+    assert (stats['rows_read'], stats['rows_kept']) == (3, 2)
+    assert stats['decoded_read'] < stats['decoded_total']
+
+
+def test_parquet_footer_counts_the_columns_a_generator_reads(tmp_path):
+    write_targets(tmp_path / "part-0.parquet")
+
+    def generator(table):
+        return []
+    generator.columns = ['id']
+    everything = parquet_footer(str(tmp_path / "part-0.parquet"), 64)
+    ids = parquet_footer(str(tmp_path / "part-0.parquet"), 64, generator)
+
+    assert (everything['rows'], everything['row_groups']) == (ids['rows'], ids['row_groups']) == (1000, 10)
+    assert 0 < ids['decoded_bytes'] < everything['decoded_bytes']
+    assert 0 < ids['io_bytes'] < everything['io_bytes']
+    assert ids['batch_rows'] >= everything['batch_rows']
@@ -0,0 +1,569 @@
+import collections
+import os
+import random
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import ingest_manifest
+import ingest_report
+import parse_datasets
+from ingest_manifest import new_ingest_manifest, record_ingested_file, select_changed_tasks
+
+
+@pytest.fixture(autouse=True)
+def test_data_version(monkeypatch):
+    monkeypatch.setattr(parse_datasets, 'data_version', "test")
+
+
+# Entries of the queries generated for a table
+def query_data(queries):
+    return [row for _, params, _ in queries for row in params.get('data', [])]
+
+
+# Run a query generator on a table, without the rows the reader would have dropped (see @reads)
+def generate(query_generator, table):
+    if getattr(query_generator, 'row_filter', None) is not None:
+        table = table.filter(query_generator.row_filter)
+    return query_generator(table)
+
+
+def test_node_generators_skip_the_rows_with_null_properties():
+    table = pa.table({'id': ["t1", "t2", None], 'approvedName': ["one", None, "three"],
+                      'approvedSymbol': ["T1", "T2", "T3"], 'biotype': ["a", "b", "c"]})
+
+    queries = parse_datasets.create_cypher_query_targets(table)
+
+    assert query_data(queries) == [{'approvedName': "one", 'id': "t1", 'approvedSymbol': "T1"}]
+    assert queries[1][1]['dataset'] == "test Target"
+
+
+def test_mechanism_of_action_pairs_every_chembl_id_with_every_target():
+    table = pa.table({'chemblIds': [["c1", "c2"], ["c3"], None, ["c4"]],
+                      'targets': [["t1", "t2", "t3"], ["t4"], ["t5"], []],
+                      'actionType': ["INHIBITOR", "AGONIST", "AGONIST", "AGONIST"]})
+
+    data = query_data(generate(parse_datasets.create_cypher_query_mechanism_of_action, table))
+
+    assert [(row['chemblId'], row['ensembleId'], row['actionType']) for row in data] == [
+        ("c1", "t1", "INHIBITOR"), ("c1", "t2", "INHIBITOR"), ("c1", "t3", "INHIBITOR"),
+        ("c2", "t1", "INHIBITOR"), ("c2", "t2", "INHIBITOR"), ("c2", "t3", "INHIBITOR"),
+        ("c3", "t4", "AGONIST")]
+
+
+def test_list_columns_are_flattened_with_the_values_of_their_row():
+    pathways = [[{'id': "p1", 'name': "P1"}, {'id': "p2", 'name': "P2"}], None, [{'id': "p3", 'name': "P3"}]]
+    table = pa.table({'targetId': ["t1", "t2", "t3"], 'pathways': pathways})
+
+    data = query_data(generate(parse_datasets.create_cypher_query_pathways_relation, table))
+
+    assert [(row['targetId'], row['pathway']) for row in data] == [("t1", "p1"), ("t1", "p2"), ("t3", "p3")]
+
+
+def test_hgene_skips_the_tissues_without_rna_expression():
+    tissues = [[{'efo_code': "e1", 'rna': {'value': 2.5}}, {'efo_code': "e2", 'rna': {'value': 0.0}}],
+               [{'efo_code': "e1", 'rna': {'value': None}}]]
+    table = pa.table({'id': ["t1", "t2"], 'tissues': tissues})
+
+    data = query_data(generate(parse_datasets.create_cypher_query_hgene, table))
+
+    assert data == [{'ensembleId': "t1", 'efo_code': "e1", 'rna_value': 2.5, 'rna_value_count': 1},
+                    {'ensembleId': "t2", 'efo_code': "e1", 'rna_value': None, 'rna_value_count': 0}]
+
+
+def test_interactions_are_grouped_by_source_database():
+    table = pa.table({'targetA': ["a", "b", "c", "d", "e"], 'targetB': ["b", "c", None, "e", "f"],
+                      'sourceDatabase': ["intact", "reactome", "intact", "string", "intact"]})
+
+    queries = generate(parse_datasets.create_cypher_query_interactions, table)
+
+    assert [query.split('[rel:')[1].split(' ')[0] for query, _, _ in queries] == ["INTACT", "REACTOME"]
+    assert [params['data'] for _, params, _ in queries] == [
+        [{'targetA': "a", 'targetB': "b"}, {'targetA': "e", 'targetB': "f"}], [{'targetA': "b", 'targetB': "c"}]]
+
+
+def test_generate_queries_writes_each_record_batch(tmp_path, monkeypatch):
+    pq.write_table(pa.table({'id': [f"t{n}" for n in range(2500)], 'approvedName': ["name"] * 2500,
+                             'approvedSymbol': ["symbol"] * 2500}), str(tmp_path / "part-0.parquet"))
+    monkeypatch.setattr(parse_datasets, 'INGEST_MEMORY_MB', 0)
+    written = []
+    monkeypatch.setattr(parse_datasets, 'execute_queries', lambda queries: written.append(query_data(queries)))
+
+    parse_datasets.generate_queries("targets", str(tmp_path), parse_datasets.create_cypher_query_targets, stream=True)
+
+    # One write per record batch of MIN_BATCH_ROWS rows
+    assert [len(data) for data in written] == [1000, 1000, 500]
+    assert [row['id'] for data in written for row in data] == [f"t{n}" for n in range(2500)]
+
+
+def test_batch_query_params_splits_the_data_parameter():
+    params = {'data': list(range(5)), 'dataset': "test Target"}
+
+    assert list(parse_datasets.batch_query_params(params, 2)) == [
+        {'data': [0, 1], 'dataset': "test Target"}, {'data': [2, 3], 'dataset': "test Target"},
+        {'data': [4], 'dataset': "test Target"}]
+    assert list(parse_datasets.batch_query_params(params, 5)) == [params]
+    assert list(parse_datasets.batch_query_params({}, 2)) == [{}]
+
+
+def test_generators_read_only_their_columns(tmp_path, monkeypatch):
+    tissues = [[{'efo_code': "e1", 'label': "liver", 'rna': {'value': 1.5, 'unit': "TPM"}, 'protein': {'level': 2}}],
+               None]
+    pq.write_table(pa.table({'id': ["t1", "t2"], 'tissues': tissues}), str(tmp_path / "part-0.parquet"))
+    read = []
+    monkeypatch.setattr(parse_datasets, 'execute_queries', lambda queries: None)
+
+    def hgene(table):
+        read.append(table)
+        return parse_datasets.create_cypher_query_hgene(table)
+    parse_datasets.reads(parse_datasets.create_cypher_query_hgene.columns,
+                         parse_datasets.create_cypher_query_hgene.row_filter)(hgene)
+    parse_datasets.generate_queries("baseExpressions", str(tmp_path), hgene)
+
+    # The null tissues are dropped and only the leaves the generator uses are decoded
+    assert [table.to_pylist() for table in read] == [[{'id': "t1", 'tissues': [{'efo_code': "e1", 'rna': {'value': 1.5}}]}]]
+
+
+# Targets split over 'files' parquet files
+def write_target_files(path, files, rows=300):
+    for n in range(files):
+        ids = [f"t{n}-{i}" for i in range(rows)]
+        pq.write_table(pa.table({'id': ids, 'approvedName': ids, 'approvedSymbol': ids}),
+                       str(path / f"part-{n}.parquet"))
+
+
+def test_worker_processes_generate_the_same_entries(tmp_path):
+    write_target_files(tmp_path, 3)
+
+    def entries(workers):
+        written = []
+        parse_datasets.generate_queries("targets", str(tmp_path), parse_datasets.create_cypher_query_targets,
+                                        workers=workers, writer=lambda queries: written.extend(query_data(queries)))
+        return sorted(row['id'] for row in written)
+
+    assert entries(2) == entries(1)
+    assert len(entries(2)) == 900
+
+
+def test_a_worker_process_that_dies_fails_the_generator(tmp_path, monkeypatch):
+    write_target_files(tmp_path, 2)
+
+    # Found by name in the worker processes, which are forked with this module
+    @parse_datasets.reads(['id'])
+    def create_cypher_query_dying_worker(table):
+        os._exit(1)
+    monkeypatch.setattr(parse_datasets, 'create_cypher_query_dying_worker', create_cypher_query_dying_worker,
+                        raising=False)
+
+    with pytest.raises(BrokenProcessPool):
+        parse_datasets.generate_queries("targets", str(tmp_path), create_cypher_query_dying_worker, workers=2,
+                                        writer=lambda queries: None)
+
+
+def test_edge_generators_depend_on_the_node_generators_of_their_labels(tmp_path):
+    for data_type in ("targets", "mechanismOfAction", "molecule", "unknown"):
+        (tmp_path / data_type).mkdir()
+
+    tasks = {task['name']: task for task in parse_datasets.find_ingest_tasks(str(tmp_path))}
+
+    assert tasks["mechanismOfAction/create_cypher_query_mechanism_of_action"]['depends'] == {
+        "targets/create_cypher_query_targets", "molecule/create_cypher_query_drugs"}
+    assert tasks["targets/create_cypher_query_participates"]['depends'] == {
+        "targets/create_cypher_query_targets", "targets/create_cypher_query_pathways"}
+    assert tasks["targets/create_cypher_query_targets"]['depends'] == set()
+    assert not any(name.startswith("unknown/") for name in tasks)
+
+
+def test_generate_queries_checkpoints_each_file_read(tmp_path):
+    write_target_files(tmp_path, 3)
+    (tmp_path / "part-3.parquet").write_bytes(b"not parquet")
+    done = []
+
+    parse_datasets.generate_queries("targets", str(tmp_path), parse_datasets.create_cypher_query_targets,
+                                    writer=lambda queries: None, files=["part-1.parquet", "part-2.parquet",
+                                                                        "part-3.parquet"], file_done=done.append)
+
+    # The unreadable file is not checkpointed, the file not given is not read
+    assert done == ["part-1.parquet", "part-2.parquet"]
+
+
+def test_node_queries_merge_each_key_once():
+    columns = {'id': pa.array(["t1", "t2", "t1"]), 'approvedName': pa.array(["one", "two", "one again"])}
+    query, params, _ = parse_datasets.create_cypher_query_node_batch(
+        'Target', {'ensembleId': 'id', 'approvedName': 'approvedName'}, columns)[1]
+
+    assert "UNWIND $data AS prop" in query
+    assert "WHERE prop.id IS NOT NULL" in query
+    assert "MERGE (n:Target {data_version: $data_version, ensembleId: prop.id})" in query
+    assert "SET n.approvedName = prop.approvedName, n.dataset = $dataset" in query
+    # The last entry of a key is kept, as the last MERGE ... SET would leave it
+    assert params['data'] == [{'id': "t2", 'approvedName': "two"}, {'id': "t1", 'approvedName': "one again"}]
+
+
+def test_unique_rows_keeps_the_last_row_of_each_key_in_order():
+    table = pa.concat_tables([pa.table({'a': ["x", "y"], 'b': [1, 2]}), pa.table({'a': ["x", "z"], 'b': [3, 4]})])
+
+    assert parse_datasets.unique_rows(table, ['a']).to_pylist() == [
+        {'a': "y", 'b': 2}, {'a': "x", 'b': 3}, {'a': "z", 'b': 4}]
+
+
+def test_relationships_are_sent_once_with_their_averaged_properties():
+    columns = {'ensembleId': pa.array(["t1", "t1", "t2", "t1"]), 'efo_code': pa.array(["e1", "e1", "e1", "e2"]),
+               'rna_value': pa.array([1.0, 3.0, 5.0, None])}
+
+    query, params, writes = parse_datasets.create_cypher_query_relationships(
+        'HGENE', ('Target', 'ensembleId'), ('Baseline_Expression', 'efo_code'), columns, "test HGENE",
+        averaged=['rna_value'])
+
+    assert "SET rel.rna_value = item.rna_value" in query
+    assert "ON MATCH" not in query
+    assert params['data'] == [{'ensembleId': "t1", 'efo_code': "e1", 'rna_value': 2.0, 'rna_value_count': 2},
+                              {'ensembleId': "t2", 'efo_code': "e1", 'rna_value': 5.0, 'rna_value_count': 1},
+                              {'ensembleId': "t1", 'efo_code': "e2", 'rna_value': None, 'rna_value_count': 0}]
+    assert writes['averaged'] == ['rna_value']
+
+
+def test_relationships_without_averaged_properties_drop_the_duplicate_entries():
+    columns = {'chemblId': pa.array(["c1", "c1", "c1"]), 'ensembleId': pa.array(["t1", "t1", "t2"]),
+               'actionType': pa.array(["INHIBITOR", "INHIBITOR", "AGONIST"])}
+
+    _, params, _ = parse_datasets.create_cypher_query_relationships(
+        'TARGETS', ('Drug', 'chemblId'), ('Target', 'ensembleId'), columns, "test TARGETS",
+        {'actionType': 'actionType'})
+
+    assert params['data'] == [{'chemblId': "c1", 'ensembleId': "t1", 'actionType': "INHIBITOR"},
+                              {'chemblId': "c1", 'ensembleId': "t2", 'actionType': "AGONIST"}]
+
+
+# Writer recording the queries passed to it
+class RecordingWriter:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, queries):
+        self.queries.extend(queries)
+
+    def data(self, kind):
+        return [row for _, params, writes in self.queries if kind in writes for row in params.get('data', [])]
+
+
+def test_average_rows_averages_the_values_and_counts_them():
+    table = pa.table({'start': ["t1", "t1", "t1", "t1", "t2"],
+                      'end': ["e1", "e1", "e2", "e1", "e1"],
+                      'value': [1.0, 3.0, None, None, 5.0]})
+
+    rows = sorted(parse_datasets.average_rows(table, ['start', 'end'], ['value']).to_pylist(),
+                  key=lambda row: (row['start'], row['end']))
+
+    assert rows == [{'start': "t1", 'end': "e1", 'value': 2.0, 'value_count': 2},
+                    {'start': "t1", 'end': "e2", 'value': None, 'value_count': 0},
+                    {'start': "t2", 'end': "e1", 'value': 5.0, 'value_count': 1}]
+
+
+def test_deduplicating_writer_passes_each_node_on_until_its_properties_change():
+    writer = RecordingWriter()
+    run_writer = parse_datasets.DeduplicatingWriter(writer)
+    props = {'ensembleId': 'id', 'name': 'name'}
+
+    run_writer(parse_datasets.create_cypher_query_node_batch(
+        'Target', props, {'id': pa.array(["a", "b"]), 'name': pa.array(["A", "B"])}))
+    run_writer(parse_datasets.create_cypher_query_node_batch(
+        'Target', props, {'id': pa.array(["a", "b", "c"]), 'name': pa.array(["A", "B2", "C"])}))
+
+    assert [writes['dataset'] for _, _, writes in writer.queries if 'dataset' in writes] == ["test Target"]
+    assert writer.data('node') == [{'id': "a", 'name': "A"}, {'id': "b", 'name': "B"},
+                                   {'id': "b", 'name': "B2"}, {'id': "c", 'name': "C"}]
+
+
+def test_deduplicating_writer_passes_each_relationship_on_once():
+    writer = RecordingWriter()
+    run_writer = parse_datasets.DeduplicatingWriter(writer)
+
+    def batch(starts, ends, dataset="test dataset"):
+        return [parse_datasets.create_cypher_query_relationships(
+            'INTERACTS', ('Target', 'start'), ('Target', 'end'),
+            {'start': pa.array(starts), 'end': pa.array(ends)}, dataset)]
+
+    run_writer(batch(["a", "a"], ["b", "c"]))
+    run_writer(batch(["a", "b", "a"], ["b", "c", "c"]))
+    # The same nodes in another dataset are another relationship
+    run_writer(batch(["a"], ["b"], dataset="other dataset"))
+
+    assert writer.data('relationship') == [{'start': "a", 'end': "b"}, {'start': "a", 'end': "c"},
+                                           {'start': "b", 'end': "c"}, {'start': "a", 'end': "b"}]
+
+
+def test_deduplicating_writer_averages_the_relationships_over_the_run(monkeypatch):
+    # Small batches, so the held back relationships are compacted several times
+    monkeypatch.setattr(parse_datasets, 'INGEST_BATCH_SIZE', 4)
+    writer = RecordingWriter()
+    run_writer = parse_datasets.DeduplicatingWriter(writer)
+    generator = random.Random(1)
+    values = collections.defaultdict(list)
+    pairs = set()
+    for _ in range(30):
+        starts = [f"t{generator.randrange(4)}" for _ in range(6)]
+        ends = [f"e{generator.randrange(3)}" for _ in range(6)]
+        rna = [generator.choice([None, float(generator.randrange(10))]) for _ in range(6)]
+        for start, end, value in zip(starts, ends, rna):
+            pairs.add((start, end))
+            if value is not None:
+                values[(start, end)].append(value)
+        run_writer([parse_datasets.create_cypher_query_relationships(
+            'HAS_EXPRESSION', ('Target', 'start'), ('Baseline_Expression', 'end'),
+            {'start': pa.array(starts), 'end': pa.array(ends), 'rna': pa.array(rna, pa.float64())},
+            "test dataset", averaged=['rna'])])
+
+    # Nothing is written until the end of the run
+    assert writer.queries == []
+    batches = list(run_writer.averaged_queries(batch_size=5))
+    for queries in batches:
+        run_writer.writer(queries)
+
+    rows = writer.data('relationship')
+    assert all(len(params['data']) <= 5 for queries in batches for _, params, _ in queries)
+    assert sorted((row['start'], row['end']) for row in rows) == sorted(pairs)
+    for row in rows:
+        averaged = values.get((row['start'], row['end']), [])
+        assert row['rna_count'] == len(averaged)
+        assert row['rna'] == (pytest.approx(sum(averaged) / len(averaged)) if averaged else None)
+    assert run_writer.averaged == {}
+
+
+# Database recording the Cypher statements, with an index on Target.ensembleId and a constraint on Disease.diseaseId
+# left by earlier versions, and duplicate Drug.chemblId keys
+class FakeDatabase:
+    def __init__(self):
+        self.statements = []
+
+    def cypher_query(self, query, params=None):
+        self.statements.append(query)
+        if query.startswith("SHOW INDEXES"):
+            earlier = {'Target': [("ensembleId_index", None)],
+                       'Disease': [("Disease_diseaseId_unique", "Disease_diseaseId_unique")]}
+            return earlier.get(params['label'], []), None
+        if query.startswith("CREATE CONSTRAINT Drug_"):
+            raise Exception("duplicate chemblId")
+        return [], None
+
+
+def test_create_indexes_replaces_the_key_indexes_with_data_version_constraints(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(parse_datasets, 'db', database)
+    versioned = []
+    monkeypatch.setattr(parse_datasets, 'set_node_data_versions', versioned.append)
+
+    parse_datasets.create_indexes()
+
+    statements = database.statements
+    # The nodes of the earlier versions get their data version before the key index is dropped
+    assert sorted(versioned) == ['Disease', 'Target']
+    assert statements.index("DROP INDEX ensembleId_index IF EXISTS") < statements.index(
+        "CREATE CONSTRAINT Target_ensembleId_version_unique IF NOT EXISTS "
+        "FOR (n:Target) REQUIRE (n.data_version, n.ensembleId) IS UNIQUE")
+    assert "DROP CONSTRAINT Disease_diseaseId_unique IF EXISTS" in statements
+    assert "CREATE INDEX Drug_chemblId_version_index IF NOT EXISTS FOR (n:Drug) ON (n.data_version, n.chemblId)" \
+        in statements
+    assert not any(statement.startswith("CREATE INDEX Target_ensembleId") for statement in statements)
+    assert len([s for s in statements if s.startswith("CREATE CONSTRAINT")]) == len(parse_datasets.NODE_KEYS)
+
+
+def test_the_cells_of_a_partition_round_share_no_node():
+    data = [{'targetA': f"t{n % 7}", 'targetB': f"t{n % 5}"} for n in range(100)] + [{'targetA': None, 'targetB': "t1"}]
+    writes = {'start': ('Target', 'targetA'), 'end': ('Target', 'targetB')}
+
+    rounds = parse_datasets.partition_relationship_rows(data, writes, 4)
+
+    assert sorted(map(str, (row for cells in rounds for rows in cells for row in rows))) == sorted(map(str, data[:100]))
+    for cells in rounds:
+        nodes = [{row['targetA'] for row in rows} | {row['targetB'] for row in rows} for rows in cells]
+        assert all(not a & b for i, a in enumerate(nodes) for b in nodes[i + 1:])
+
+
+# Batches written by write_batch, by query
+def record_batches(monkeypatch):
+    batches = []
+    monkeypatch.setattr(parse_datasets, 'write_batch',
+                        lambda query, params: batches.append((query, params.get('data'))))
+    return batches
+
+
+def test_execute_queries_writes_each_batch_in_order(monkeypatch):
+    batches = record_batches(monkeypatch)
+    queries = [("DATASET", {'dataset': "test Target"}, {'dataset': "test Target", 'source': 'Target'}),
+               ("NODES", {'data': list(range(5)), 'dataset': "test Target"}, {'node': 'Target', 'properties': {}})]
+
+    parse_datasets.execute_queries(queries, batch_size=2)
+
+    assert batches == [("DATASET", None), ("NODES", [0, 1]), ("NODES", [2, 3]), ("NODES", [4])]
+
+
+def test_execute_queries_writes_the_partitions_with_several_edge_writers(monkeypatch):
+    batches = record_batches(monkeypatch)
+    monkeypatch.setattr(parse_datasets, 'INGEST_RESOLVE_IDS', False)
+    data = [{'targetA': f"t{n}", 'targetB': f"t{n + 1}"} for n in range(20)]
+    writes = {'relationship': 'INTACT', 'start': ('Target', 'targetA'), 'end': ('Target', 'targetB'),
+              'properties': {}, 'averaged': []}
+
+    parse_datasets.execute_queries([("RELATIONSHIPS", {'data': data, 'dataset': "test INTACT"}, writes)],
+                                   batch_size=3, edge_writers=2)
+
+    assert sorted(row['targetA'] for _, rows in batches for row in rows) == sorted(row['targetA'] for row in data)
+    assert all(len(rows) <= 3 for _, rows in batches)
+
+
+# Node element ids as get_node_ids reads them from Neo4j
+@pytest.fixture
+def node_ids(monkeypatch):
+    monkeypatch.setattr(parse_datasets, 'node_ids', {
+        'Drug': (pa.array(["c1", "c2"]), ["4:drug:1", "4:drug:2"]),
+        'Target': (pa.array(["t1", "t2", "t3"]), ["4:target:1", "4:target:2", "4:target:3"])})
+
+
+def test_relationship_entries_are_resolved_to_node_element_ids(node_ids):
+    writes = {'relationship': 'TARGETS', 'start': ('Drug', 'chemblId'), 'end': ('Target', 'ensembleId'),
+              'properties': {'actionType': 'actionType'}, 'averaged': []}
+    data = [{'chemblId': "c2", 'ensembleId': "t3", 'actionType': "INHIBITOR"},
+            {'chemblId': "c9", 'ensembleId': "t1", 'actionType': "AGONIST"},
+            {'chemblId': "c1", 'ensembleId': "t9", 'actionType': "AGONIST"}]
+
+    query, params, resolved_writes = parse_datasets.resolve_relationship_ids({'data': data, 'dataset': "test"}, writes)
+
+    # The entries without a start or end node are dropped
+    assert params == {'data': [{'start_id': "4:drug:2", 'end_id': "4:target:3", 'actionType': "INHIBITOR"}],
+                      'dataset': "test"}
+    assert resolved_writes['start'] == ('Drug', 'start_id') and resolved_writes['end'] == ('Target', 'end_id')
+    assert "MATCH (from:Drug) WHERE elementId(from) = item.start_id" in query
+    assert "MATCH (to:Target) WHERE elementId(to) = item.end_id" in query
+    assert "MERGE (from)-[rel:TARGETS {dataset: $dataset, actionType: item.actionType}]->(to)" in query
+
+
+def test_execute_queries_writes_the_relationships_by_element_id(monkeypatch, node_ids):
+    batches = record_batches(monkeypatch)
+    query = parse_datasets.create_cypher_query_relationships(
+        'INTACT', ('Target', 'targetA'), ('Target', 'targetB'),
+        {'targetA': pa.array(["t1", "t2"]), 'targetB': pa.array(["t2", "t4"])}, "test INTACT")
+
+    parse_datasets.execute_queries([query])
+
+    assert [rows for _, rows in batches] == [[{'start_id': "4:target:1", 'end_id': "4:target:2"}]]
+    assert "MATCH (from:Target {data_version: $data_version, ensembleId: item.targetA})" in query[0]
+
+
+def test_a_file_with_a_failed_batch_is_reported_and_not_checkpointed(tmp_path, monkeypatch):
+    write_target_files(tmp_path, 2)
+
+    def write_batch(query, params):
+        if "t1-0" in str(params.get('data')):
+            raise parse_datasets.Neo4jError("unavailable")
+        return SimpleNamespace(nodes_created=len(params.get('data', [])), relationships_created=0, properties_set=0)
+    monkeypatch.setattr(parse_datasets, 'write_batch', write_batch)
+    done = []
+
+    parse_datasets.clear_ingest_report()
+    parse_datasets.generate_queries("targets", str(tmp_path), parse_datasets.create_cypher_query_targets,
+                                    files=["part-0.parquet", "part-1.parquet"], file_done=done.append)
+
+    assert done == ["part-0.parquet"]
+    report = {metrics['file']: metrics for metrics in ingest_report.ingest_report['files']}
+    assert report["part-0.parquet"]['nodes_created'] == 300 and report["part-0.parquet"]['failed_batches'] == 0
+    assert report["part-1.parquet"]['failed_batches'] == 1
+    assert report["part-1.parquet"]['rows_in'] == 300
+
+
+# Database answering the Cypher statements whose text contains a key of results, recording them all
+class ScriptedDatabase:
+    def __init__(self, results):
+        self.results = results
+        self.statements = []
+
+    def cypher_query(self, query, params=None):
+        self.statements.append((query, params))
+        for text, result in self.results.items():
+            if text in query:
+                return (result(params) if callable(result) else result), None
+        return [], None
+
+    def ran(self, text):
+        return any(text in query for query, _ in self.statements)
+
+
+@pytest.fixture
+def switch(monkeypatch):
+    cleanups = []
+    monkeypatch.setattr(parse_datasets, 'start_data_version_cleanup', lambda keep=None: cleanups.append(keep))
+    monkeypatch.setattr(parse_datasets, 'validate_data_version', lambda input_dir, live_version: True)
+
+    def switch(datasets, live_version="live"):
+        database = ScriptedDatabase({"RETURN d.data_version ORDER BY d.activated": [(live_version,)] if live_version else [],
+                                     "RETURN count(d)": [(datasets,)]})
+        monkeypatch.setattr(parse_datasets, 'db', database)
+        parse_datasets.switch_data_version("input")
+        return database, cleanups
+    return switch
+
+
+def test_switch_data_version_enables_the_new_datasets_and_cleans_up_the_others(switch):
+    database, cleanups = switch(3)
+
+    assert database.ran("SET d.enabled = false")
+    assert database.ran("MATCH (u:CsvUpload)") and database.ran("gds.graph.drop")
+    assert cleanups == [None]
+
+
+def test_only_the_graph_projections_of_the_similarity_descriptors_are_dropped(switch):
+    database, _ = switch(3)
+
+    query, params = next(statement for statement in database.statements if "gds.graph.drop" in statement[0])
+    assert "$descriptors" in query
+    assert params['descriptors'] == parse_datasets.SIMILARITY_DESCRIPTORS
+    assert params['data_version'] == parse_datasets.data_version
+
+
+def test_a_data_version_without_datasets_is_never_switched_to(switch):
+    database, cleanups = switch(0)
+
+    assert not database.ran("SET d.enabled = false")
+    assert cleanups == []
+
+
+def test_an_incomplete_data_version_is_kept_next_to_the_live_one(switch, monkeypatch):
+    monkeypatch.setattr(parse_datasets, 'validate_data_version', lambda input_dir, live_version: False)
+    database, cleanups = switch(3)
+
+    assert not database.ran("SET d.enabled = false")
+    assert cleanups == [("live", "test")]
+
+
+def test_validate_data_version_compares_the_node_counts_with_the_live_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_manifest, 'INGEST_MANIFEST', str(tmp_path / "ingest_manifest.json"))
+    (tmp_path / "targets").mkdir()
+    write_target_files(tmp_path / "targets", 1, rows=10)
+    monkeypatch.setattr(parse_datasets, 'db', ScriptedDatabase({}))
+
+    # The file is not loaded yet
+    assert not parse_datasets.validate_data_version(str(tmp_path), "live")
+
+    tasks = parse_datasets.find_ingest_tasks(str(tmp_path))
+    manifest = new_ingest_manifest("test")
+    _, fingerprints = select_changed_tasks(str(tmp_path), tasks, manifest)
+    for task in tasks:
+        record_ingested_file(manifest, task, "targets/part-0.parquet", fingerprints)
+    database = ScriptedDatabase({"MATCH (n:Target)": [("live", 100), ("test", 40)]})
+    monkeypatch.setattr(parse_datasets, 'db', database)
+    assert not parse_datasets.validate_data_version(str(tmp_path), "live")
+
+    database.results["MATCH (n:Target)"] = [("live", 100), ("test", 60)]
+    assert parse_datasets.validate_data_version(str(tmp_path), "live")
+
+
+def test_the_data_versions_are_not_cleaned_up_while_none_is_live(monkeypatch):
+    database = ScriptedDatabase({})
+    monkeypatch.setattr(parse_datasets, 'db', database)
+    monkeypatch.setattr(parse_datasets, 'data_version_cleanup', None)
+
+    parse_datasets.start_data_version_cleanup()
+
+    assert not database.ran("NOT d.data_version IN $keep")
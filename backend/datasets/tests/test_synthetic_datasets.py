@@ -0,0 +1,49 @@
+import os
+
+import pyarrow.parquet as pq
+import pytest
+
+import parse_datasets
+from synthetic_datasets import benchmark_ingest, generate_synthetic_datasets, print_benchmark
+
+
+@pytest.fixture(scope="module")
+def synthetic_dir(tmp_path_factory):
+    output_dir = str(tmp_path_factory.mktemp("synthetic"))
+    generate_synthetic_datasets(output_dir, scale=0.05, files=2)
+    return output_dir
+
+
+def test_every_data_type_read_by_the_ingest_is_generated(synthetic_dir):
+    assert set(os.listdir(synthetic_dir)) == set(parse_datasets.data_type_query_generators)
+    targets = os.path.join(synthetic_dir, "targets")
+    assert len(os.listdir(targets)) == 2
+    # The columns the query generators read are all present, with unread columns next to them
+    schema = pq.read_schema(os.path.join(targets, sorted(os.listdir(targets))[0]))
+    assert {'id', 'approvedName', 'approvedSymbol', 'pathways'} < set(schema.names)
+
+
+def test_generation_is_reproducible(synthetic_dir, tmp_path):
+    generate_synthetic_datasets(str(tmp_path), scale=0.05, files=2)
+
+    for data_type in ("targets", "baseExpressions"):
+        files = sorted(os.listdir(tmp_path / data_type))
+        assert files == sorted(os.listdir(os.path.join(synthetic_dir, data_type)))
+        assert pq.read_table(str(tmp_path / data_type / files[0])).equals(
+            pq.read_table(os.path.join(synthetic_dir, data_type, files[0])))
+
+
+def test_the_benchmark_reports_every_query_generator(synthetic_dir, monkeypatch, capsys):
+    monkeypatch.setattr(parse_datasets, 'data_version', "test")
+    results = benchmark_ingest(synthetic_dir)
+
+    generators = results['generators']
+    assert "targets/create_cypher_query_targets" in generators
+    assert "baseExpressions/create_cypher_query_hgene" in generators
+    assert all(totals['rows_in'] > 0 and totals['rows_out'] > 0 for totals in generators.values())
+
+    slower = {**results, 'generators': {name: {**totals, 'transform_seconds': totals['transform_seconds'] * 2 + 1}
+                                        for name, totals in generators.items()}}
+    assert print_benchmark(results, slower) == []
+    assert sorted(print_benchmark(slower, results)) == sorted(generators)
+    assert "more than 20% slower than the baseline" in capsys.readouterr().out
@@ -0,0 +1,50 @@
+import time
+from django.http import JsonResponse
+from gradvekbackend.startup import STARTUP_RETRY_AFTER, graph_servable, read_startup_status
+
+'''
+ Middleware answering the requests to the data endpoints with a 503 response and a Retry-After header until the graph
+ is ready, while the startup tasks (see gradvekbackend.startup) load it in the background. It is added to MIDDLEWARE
+ in settings.py.
+'''
+
+# Endpoints answering before the graph is ready
+STARTUP_EXEMPT_PATHS = ['/api/ready/', '/api/progress/', '/api/routes/', '/api/info/']
+
+# Seconds the startup status read from the status file is reused for
+STARTUP_STATUS_TTL = 1
+
+
+class StartupMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Once the graph is ready it stays ready, a new data version is loaded next to the live one
+        self.graph_ready = False
+        self.status = None
+        self.status_time = 0
+
+    def __call__(self, request):
+        if not self.graph_ready and request.path.startswith('/api/') and request.path not in STARTUP_EXEMPT_PATHS:
+            status = self.startup_status()
+            # Without a startup status no startup tasks were run, e.g. outside of runserver, see graph_servable
+            if graph_servable(status):
+                self.graph_ready = True
+            else:
+                if status['state'] == 'failed':
+                    detail = "The startup tasks failed before loading the graph, see /api/progress/ for the error."
+                else:
+                    detail = "The graph is being loaded, retry later. See /api/progress/ for the progress."
+                response = JsonResponse({
+                    'detail': detail,
+                    'state': status['state'],
+                }, status=503)
+                response['Retry-After'] = str(STARTUP_RETRY_AFTER)
+                return response
+        return self.get_response(request)
+
+    def startup_status(self):
+        # Read the status file at most once every STARTUP_STATUS_TTL seconds
+        if time.monotonic() - self.status_time > STARTUP_STATUS_TTL:
+            self.status = read_startup_status()
+            self.status_time = time.monotonic()
+        return self.status
@@ -72,6 +72,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # Answer the data endpoints with 503 until the startup tasks made the graph ready
+    "gradvekbackend.middleware.StartupMiddleware",
 ]
 
 ROOT_URLCONF = "gradvekbackend.urls"
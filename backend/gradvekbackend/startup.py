@@ -1,12 +1,16 @@
 import atexit
+import json
 import os
+import threading
 import time
+import traceback
+from datetime import datetime
 from django.conf import settings
 from django.core.management import call_command
 import importlib
 import environ
 from neomodel import config, db
-from datasets.get_datasets import get_datasets
+from search.queries.datasets import invalidate_datasets
 
 '''
  This file contains functions that are run when the Django application starts up. It is imported in
@@ -27,6 +31,19 @@ NEO4J_USERNAME = env("NEO4J_USERNAME", default=NEO4J_DOCKER_USERNAME)
 NEO4J_PASSWORD = env("NEO4J_PASSWORD", default=NEO4J_DOCKER_PASSWORD)
 NEO4J_BOLT_URL = env("NEO4J_BOLT_URL", default=None)
 
+# Load the data files into Neo4j while they are downloaded instead of after the whole download
+INGEST_PIPELINE = os.getenv("INGEST_PIPELINE", "true").lower() == "true"
+
+# The startup tasks run on a background thread (see start_startup_tasks) and record their state and progress in
+# STARTUP_STATUS_FILE, every STARTUP_STATUS_INTERVAL seconds while they run. The file is read by the readiness and
+# progress endpoints and by StartupMiddleware, which may run in another process: with the autoreloader, the startup
+# tasks run in the reloader process and the requests are served by its child process.
+# STARTUP_RETRY_AFTER: seconds a client is asked to wait (Retry-After) before retrying a request made before the graph
+# is ready
+STARTUP_STATUS_FILE = os.getenv("STARTUP_STATUS_FILE", os.path.join(settings.BASE_DIR, "startup_status.json"))
+STARTUP_STATUS_INTERVAL = float(os.getenv("STARTUP_STATUS_INTERVAL", 5))
+STARTUP_RETRY_AFTER = int(os.getenv("STARTUP_RETRY_AFTER", 30))
+
 
 
 # Function to close Neo4j driver when the application exits
@@ -86,13 +103,200 @@ def wait_for_neo4j_connection():
 
 def run_startup_tasks():
     # Function to run startup tasks
-    get_datasets()
-    wait_for_neo4j_connection()
+    if INGEST_PIPELINE:
+        run_pipelined_ingest()
+    else:
+        # Dynamically import get_datasets module, requests and pyarrow are only needed by the process downloading the
+        # datasets, not by the autoreloader child process or the server workers
+        get_datasets_module = importlib.import_module('datasets.get_datasets', package='datasets')
+        startup_sources['feed'] = get_datasets_module.DownloadFeed()
+        run_startup_step('download', get_datasets_module.get_datasets, feed=startup_sources['feed'])
+        wait_for_neo4j_connection()
 
-    # Dynamically import parse_datasets module, this is done to better manage the neo4j connections
-    parse_datasets_module = importlib.import_module('datasets.parse_datasets', package='datasets')
-    parse_datasets_module.parse_datasets()
+        # Dynamically import parse_datasets module, this is done to better manage the neo4j connections
+        parse_datasets_module = importlib.import_module('datasets.parse_datasets', package='datasets')
+        startup_sources['ingest'] = importlib.import_module('datasets.ingest_report', package='datasets')
+        record_live_graph(parse_datasets_module)
+        run_startup_step('ingest', parse_datasets_module.parse_datasets)
+        record_live_graph(parse_datasets_module)
 
     print("Saving similarity results to Neo4j...")
     search_datasets_module = importlib.import_module('search.queries.node_similarity', package='search')
-    search_datasets_module.save_to_db()
+    run_startup_step('similarity', search_datasets_module.save_to_db)
+
+
+def run_pipelined_ingest():
+    # Function to download the datasets on a background thread while they are loaded into Neo4j. Each completed file
+    # is handed to the ingest through a download feed, and the data types with node generators are downloaded first.
+    get_datasets_module = importlib.import_module('datasets.get_datasets', package='datasets')
+    parse_datasets_module = importlib.import_module('datasets.parse_datasets', package='datasets')
+    feed = get_datasets_module.DownloadFeed()
+    startup_sources.update(feed=feed, ingest=importlib.import_module('datasets.ingest_report', package='datasets'))
+    download = threading.Thread(target=run_startup_step, name="download",
+                                args=('download', get_datasets_module.get_datasets),
+                                kwargs={'feed': feed, 'first': parse_datasets_module.node_data_types()})
+    download.start()
+    try:
+        wait_for_neo4j_connection()
+        record_live_graph(parse_datasets_module)
+        run_startup_step('ingest', parse_datasets_module.parse_datasets, feed=feed)
+        record_live_graph(parse_datasets_module)
+    finally:
+        download.join()
+
+
+# State and progress of the startup tasks, saved to STARTUP_STATUS_FILE by save_startup_status:
+# - state: 'running', 'ready' or 'failed', a 'running' state is read as 'interrupted' once the process running
+#   them is gone
+# - graph_ready: whether the API can query the graph, true as soon as a data version is live in Neo4j, so a restart
+#   serves the live data version while a new one is loaded next to it
+# - steps: 'download', 'ingest' and 'similarity', with their state, start and end times and progress
+startup_status = {}
+startup_status_lock = threading.Lock()
+# Download feed and ingest report module (see datasets/ingest_report.py) of the running startup tasks, read for the
+# progress of their steps
+startup_sources = {}
+
+def start_startup_tasks():
+    # Function to run the startup tasks on a background thread, so the server accepts requests right away. Requests to
+    # the data endpoints get a 503 response until the graph is ready (see StartupMiddleware).
+    with startup_status_lock:
+        startup_status.clear()
+        startup_status.update({'state': 'running', 'graph_ready': False, 'data_version': None, 'error': None,
+                               'pid': os.getpid(), 'started': datetime.now().isoformat(timespec='seconds'),
+                               'steps': {}})
+    save_startup_status()
+    threading.Thread(target=track_startup_tasks, name="startup", daemon=True).start()
+
+
+def track_startup_tasks():
+    # Function run by the startup thread: runs the startup tasks and saves their progress every STARTUP_STATUS_INTERVAL
+    # seconds until they are done
+    done = threading.Event()
+
+    def save_progress():
+        while not done.wait(STARTUP_STATUS_INTERVAL):
+            save_startup_status()
+
+    threading.Thread(target=save_progress, name="startup-status", daemon=True).start()
+    try:
+        run_startup_tasks()
+        update_startup_status(state='ready', graph_ready=True)
+    except Exception as e:
+        traceback.print_exc()
+        # A data version loaded by an earlier run is still served when the startup tasks fail
+        try:
+            record_live_graph(importlib.import_module('datasets.parse_datasets', package='datasets'))
+        except ImportError as import_error:
+            print(f"Could not read the live data version: {import_error}")
+        update_startup_status(state='failed', error=str(e))
+    finally:
+        done.set()
+        save_startup_status()
+
+
+def run_startup_step(name, function, *args, **kwargs):
+    # Function to run a startup step, recording when it started and ended and whether it failed
+    update_startup_step(name, state='running', started=datetime.now().isoformat(timespec='seconds'))
+    try:
+        result = function(*args, **kwargs)
+    except Exception as e:
+        update_startup_step(name, state='failed', error=str(e), finished=datetime.now().isoformat(timespec='seconds'))
+        raise
+    update_startup_step(name, state='done', finished=datetime.now().isoformat(timespec='seconds'))
+    return result
+
+
+def record_live_graph(parse_datasets_module):
+    # Function to record the data version the API serves, the graph is ready once there is one
+    try:
+        live_version = parse_datasets_module.live_data_version()
+    except Exception as e:
+        print(f"Could not read the live data version: {e}")
+        return
+    # The ingest switched to a new data version, the cached dataset registry lists the Dataset nodes of the old one
+    if live_version != startup_status.get('data_version'):
+        invalidate_datasets()
+    if live_version is not None:
+        update_startup_status(graph_ready=True, data_version=live_version)
+
+
+def update_startup_status(**changes):
+    with startup_status_lock:
+        startup_status.update(changes)
+    save_startup_status()
+
+
+def update_startup_step(name, **changes):
+    with startup_status_lock:
+        startup_status.setdefault('steps', {}).setdefault(name, {}).update(changes)
+    save_startup_status()
+
+
+def save_startup_status():
+    # Function to write the startup status with the current progress of the steps to STARTUP_STATUS_FILE
+    with startup_status_lock:
+        steps = startup_status.setdefault('steps', {})
+        feed = startup_sources.get('feed')
+        if feed is not None and 'download' in steps:
+            files, completed = feed.progress()
+            steps['download'].update(files=files, completed=completed)
+        ingest = startup_sources.get('ingest')
+        if ingest is not None and 'ingest' in steps:
+            with ingest.ingest_report_lock:
+                files = list(ingest.ingest_report['files'])
+            steps['ingest'].update(files_loaded=len(files), entries_written=sum(file['rows_out'] for file in files))
+        startup_status['updated'] = datetime.now().isoformat(timespec='seconds')
+        with open(STARTUP_STATUS_FILE + ".tmp", "w") as file:
+            json.dump(startup_status, file, indent=1)
+        os.replace(STARTUP_STATUS_FILE + ".tmp", STARTUP_STATUS_FILE)
+
+
+def read_startup_status():
+    # Function to read the startup status saved by the process running the startup tasks. Returns None when no
+    # startup tasks were run, the state is 'interrupted' when the process running them is gone before they finished.
+    try:
+        with open(STARTUP_STATUS_FILE, "r") as file:
+            status = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    if status.get('state') == 'running' and not startup_process_running(status):
+        status['state'] = 'interrupted'
+    return status
+
+
+def startup_process_running(status):
+    # Function to check whether the process that saved a startup status is still running
+    if status.get('pid') is None:
+        return False
+    if status['pid'] == os.getpid():
+        return True
+    try:
+        os.kill(status['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def graph_servable(status):
+    # Function to check whether the API can serve the graph given a startup status: when no startup tasks were run or
+    # the process that ran them is gone, and once a data version is live, including when the startup tasks failed
+    # after an earlier run loaded one. Requests made before that get a 503 response.
+    if status is None or not startup_process_running(status):
+        return True
+    return status['graph_ready'] or (status['state'] == 'failed' and status.get('data_version') is not None)
+
+
+def clear_stale_startup_status():
+    # Function to remove the startup status left by a process that is gone, e.g. a runserver stopped while loading the
+    # graph, so a server started without the startup tasks doesn't read it. The status of a running process is kept, it
+    # is the one the autoreloader child serves the requests by.
+    status = read_startup_status()
+    if status is not None and not startup_process_running(status):
+        print(f"Removing the startup status of process {status.get('pid')}, it is no longer running")
+        try:
+            os.remove(STARTUP_STATUS_FILE)
+        except FileNotFoundError:
+            pass
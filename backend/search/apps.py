@@ -3,7 +3,8 @@ import sys
 from django.apps import AppConfig
 
 from gradvekbackend.startup import wait_for_neo4j_connection
-from gradvekbackend.startup import run_startup_tasks
+from gradvekbackend.startup import start_startup_tasks
+from gradvekbackend.startup import clear_stale_startup_status
 class SearchConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "search"
@@ -11,14 +12,17 @@ class SearchConfig(AppConfig):
     def ready(self):
         # This hooks into the startup process of Django
         # and runs the startup tasks defined in
-        # gradvekbackend.startup
+        # gradvekbackend.startup on a background thread,
+        # so the server accepts requests while they run
 
         # Only run the startup tasks if the application is ready, not during migrations
         # Only run startup tasks in processes not spawned by the autoreloader
         # https://stackoverflow.com/a/28504072
         if ('runserver' in sys.argv) and (os.environ.get('RUN_MAIN') != 'true'):
-            run_startup_tasks()
+            start_startup_tasks()
         else:
+            # A startup status left by a runserver that is gone would keep the API answering 503
+            clear_stale_startup_status()
             # If the application is started by the autoreloader, it still needs the Neo4j connection to be established
             wait_for_neo4j_connection()
 
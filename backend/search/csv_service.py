@@ -1,5 +1,6 @@
 from django.http import HttpResponse
 from neomodel import db
+from search.queries.datasets import get_live_data_version
 
 
 def parse_and_load_csv_file(csv_data):
@@ -26,9 +27,13 @@ def parse_and_load_csv_file(csv_data):
         
     return HttpResponse('CSV Finished loading', status=201)
 
+# The uploaded relationships connect the nodes of the live data version. Each one is also recorded in a CsvUpload
+# node, which doesn't belong to a data version: when a new data version is switched to, the uploaded relationships are
+# created again between its nodes (see attach_csv_uploads in datasets/parse_datasets.py).
 def load_drug_to_ae_data_from_csv(csv_data):
     node_label = 'AssociatedWith'
     dataset = f"{'csv_upload'} {node_label}"
+    data_version = get_live_data_version()
 
     # Iterate over every line in csv file
     for row in csv_data:
@@ -39,44 +44,46 @@ def load_drug_to_ae_data_from_csv(csv_data):
 
         # Confirm drug exists in neo4j db Drug table by looking up the chemblId. Skip the line if it doesn't exist in the db.
         chemblId = row[0].upper()
-        cypher_query = "MATCH (d:Drug {chemblId: $chemblId}) RETURN d"
-        result, _ = db.cypher_query(cypher_query, {"chemblId": chemblId})
+        cypher_query = "MATCH (d:Drug {data_version: $data_version, chemblId: $chemblId}) RETURN d"
+        result, _ = db.cypher_query(cypher_query, {"data_version": data_version, "chemblId": chemblId})
         if len(result) == 0:
             print("Skipping row. No drug found with chemblId: " + chemblId)
             continue
 
         # Confirm adverse event exists in neo4j db adverse event table by looking up the meddraId. Skip the line if it doesn't exist in the db.
         meddraId = row[1].upper()
-        cypher_query = "MATCH (d:AdverseEvent {meddraId: $meddraId}) RETURN d"
-        result, _ = db.cypher_query(cypher_query, {"meddraId": meddraId})
+        cypher_query = "MATCH (d:AdverseEvent {data_version: $data_version, meddraId: $meddraId}) RETURN d"
+        result, _ = db.cypher_query(cypher_query, {"data_version": data_version, "meddraId": meddraId})
         if len(result) == 0:
             print("Skipping row. No adverse event found with meddraId: " + meddraId)
             continue
         
         # Check if a relationship already exists between the drug and adverse event so as not to overwrite it with a 0 weight.
         cypher_query = """
-            MATCH (d:Drug {chemblId: $chemblId})
-            MATCH (a:AdverseEvent {meddraId: $meddraId})
+            MATCH (d:Drug {data_version: $data_version, chemblId: $chemblId})
+            MATCH (a:AdverseEvent {data_version: $data_version, meddraId: $meddraId})
             MATCH (d)-[r:ASSOCIATED_WITH {dataset: $dataset}]->(a)
             RETURN r
         """
-        result, _ = db.cypher_query(cypher_query, {"chemblId": chemblId, "meddraId": meddraId, "dataset": dataset})
+        result, _ = db.cypher_query(cypher_query, {"data_version": data_version, "chemblId": chemblId, "meddraId": meddraId, "dataset": dataset})
 
         if len(result) > 0:
             print("An ASSOCIATED_WITH relationship already exists between drug " + chemblId + " and adverse event " + meddraId)
             continue
         
-        #Create Associated_With query between drug and adverse event
+        #Create Associated_With query between drug and adverse event, and record the upload
         cypher_query = """
-            MATCH (d:Drug {chemblId: $chemblId}), (ae:AdverseEvent {meddraId: $meddraId})
+            MATCH (d:Drug {data_version: $data_version, chemblId: $chemblId}), (ae:AdverseEvent {data_version: $data_version, meddraId: $meddraId})
             MERGE (d)-[:ASSOCIATED_WITH {dataset: $dataset, critval: 0, llr: 0}]->(ae)
+            MERGE (:CsvUpload {dataset: $dataset, start_label: 'Drug', start_id: $chemblId, end_label: 'AdverseEvent', end_id: $meddraId})
         """
-        db.cypher_query(cypher_query, {"chemblId": chemblId, "meddraId": meddraId, "dataset": dataset})
+        db.cypher_query(cypher_query, {"data_version": data_version, "chemblId": chemblId, "meddraId": meddraId, "dataset": dataset})
         print("Associated_With relationship created for chemblId: " + chemblId + "and meddraId " + meddraId)
 
 def load_target_to_disease_from_csv(csv_data):
     node_label = 'AssociatedWith'
     dataset = f"{'csv_upload'} {node_label}"
+    data_version = get_live_data_version()
 
     # Iterate over every line in csv file
     for row in csv_data:
@@ -88,8 +95,8 @@ def load_target_to_disease_from_csv(csv_data):
         # Confirm target exists in neo4j db adverse event table by looking up the EGID/ensembleId. Skip the line if it doesn't exist in the db.
         ensembleId = row[0].upper()
         print(ensembleId)
-        cypher_query = "MATCH (t:Target {ensembleId: $ensembleId}) RETURN t"
-        result, _ = db.cypher_query(cypher_query, {"ensembleId": ensembleId})
+        cypher_query = "MATCH (t:Target {data_version: $data_version, ensembleId: $ensembleId}) RETURN t"
+        result, _ = db.cypher_query(cypher_query, {"data_version": data_version, "ensembleId": ensembleId})
         if len(result) == 0:
             print("Skipping row. No target found with ensembleId: " + ensembleId)
             continue
@@ -97,29 +104,30 @@ def load_target_to_disease_from_csv(csv_data):
         # Confirm disease exists in neo4j db disease table by looking up the diseaseId/EFO_ID. Skip the line if it doesn't exist in the db.
         diseaseId = row[1].upper()
         print(diseaseId)
-        cypher_query = "MATCH (d:Disease {diseaseId: $diseaseId}) RETURN d"
-        result, _ = db.cypher_query(cypher_query, {"diseaseId": diseaseId})
+        cypher_query = "MATCH (d:Disease {data_version: $data_version, diseaseId: $diseaseId}) RETURN d"
+        result, _ = db.cypher_query(cypher_query, {"data_version": data_version, "diseaseId": diseaseId})
         if len(result) == 0:
             print("Skipping row. No drug found with diseaseId: " + diseaseId)
             continue
         
         # Check if a relationship already exists between the target and disease so as not to overwrite it with a 0 weight.
         cypher_query = """
-            MATCH (t:Target {ensembleId: $ensembleId})
-            MATCH (d:Disease {diseaseId: $diseaseId})
+            MATCH (t:Target {data_version: $data_version, ensembleId: $ensembleId})
+            MATCH (d:Disease {data_version: $data_version, diseaseId: $diseaseId})
             MATCH (t)-[r:ASSOCIATED_WITH {dataset: $dataset}]->(d)
             RETURN r
         """
-        result, _ = db.cypher_query(cypher_query, {"ensembleId": ensembleId, "diseaseId": diseaseId, "dataset": dataset})
+        result, _ = db.cypher_query(cypher_query, {"data_version": data_version, "ensembleId": ensembleId, "diseaseId": diseaseId, "dataset": dataset})
 
         if len(result) > 0:
             print("An ASSOCIATED_WITH relationship already exists between target " + ensembleId + " and disease " + diseaseId)
             continue
 
-        #Create Associated_With query between target and disease
+        #Create Associated_With query between target and disease, and record the upload
         cypher_query = """
-            MATCH (t:Target {ensembleId: $ensembleId}), (d:Disease {diseaseId: $diseaseId})
+            MATCH (t:Target {data_version: $data_version, ensembleId: $ensembleId}), (d:Disease {data_version: $data_version, diseaseId: $diseaseId})
             MERGE (t)-[:ASSOCIATED_WITH {dataset: $dataset, critval: 0, llr: 0}]->(d)
+            MERGE (:CsvUpload {dataset: $dataset, start_label: 'Target', start_id: $ensembleId, end_label: 'Disease', end_id: $diseaseId})
         """
-        db.cypher_query(cypher_query, {"ensembleId": ensembleId, "diseaseId": diseaseId, "dataset": dataset})
+        db.cypher_query(cypher_query, {"data_version": data_version, "ensembleId": ensembleId, "diseaseId": diseaseId, "dataset": dataset})
         print("Associated_With relationship created for ensembleId: " + ensembleId + "and diseaseId " + diseaseId)
\ No newline at end of file
@@ -0,0 +1,111 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+'''
+ Profile the start of a backend process: the import time of each module (python -X importtime) and the time of each
+ startup step, including the ready() of each installed app, in a new Python process started the way a server worker
+ or the autoreloader child process is. Run with:
+     python manage.py profile_startup [--top 25]
+'''
+
+# Marker of the line the profiled process prints its step timings on
+TIMINGS_MARKER = "STARTUP_TIMINGS "
+
+# Code run in the profiled process. The ready() of each app config is wrapped to time it, django.setup() then imports
+# the apps and their models and runs their ready(), the URLconf import pulls in the views and the query modules, and
+# the WSGI handler loads the middleware.
+PROFILED_STARTUP = '''
+import json, time
+from importlib import import_module
+steps = []
+
+def step(name, function):
+    start = time.perf_counter()
+    result = function()
+    steps.append([name, time.perf_counter() - start])
+    return result
+
+import django
+from django.apps.config import AppConfig
+create_app_config = AppConfig.create.__func__
+
+def create_timed_app_config(cls, entry):
+    app_config = create_app_config(cls, entry)
+    ready = app_config.ready
+    app_config.ready = lambda: step("ready " + app_config.label, ready)
+    return app_config
+
+AppConfig.create = classmethod(create_timed_app_config)
+
+from django.conf import settings
+step("settings", lambda: settings.INSTALLED_APPS)
+step("django.setup", django.setup)
+step("urlconf", lambda: import_module(settings.ROOT_URLCONF))
+from django.core.handlers.wsgi import WSGIHandler
+step("middleware", WSGIHandler)
+print(%r + json.dumps(steps), flush=True)
+''' % TIMINGS_MARKER
+
+
+class Command(BaseCommand):
+    help = "Report the import time per module and the time per startup step, including each app's ready()"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help="Number of modules and packages to list")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROFILED_STARTUP],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'gradvekbackend.settings')},
+        )
+        process_time = time.perf_counter() - start
+
+        steps = None
+        for line in process.stdout.splitlines():
+            if line.startswith(TIMINGS_MARKER):
+                steps = json.loads(line[len(TIMINGS_MARKER):])
+        imports = parse_import_times(process.stderr)
+        if process.returncode != 0 or steps is None:
+            errors = [line for line in process.stderr.splitlines() if not line.startswith('import time:')]
+            raise CommandError("The profiled process failed:\n" + "\n".join(errors[-20:]))
+
+        top = options['top']
+        self.stdout.write(f"Process start, interpreter included: {process_time * 1000:10.1f} ms")
+        self.stdout.write("\nStartup steps")
+        ready_time = sum(seconds for name, seconds in steps if name.startswith('ready '))
+        for name, seconds in steps:
+            if name == 'django.setup':
+                self.stdout.write(f"  {'apps and models import':40} {(seconds - ready_time) * 1000:10.1f} ms")
+            else:
+                self.stdout.write(f"  {name:40} {seconds * 1000:10.1f} ms")
+
+        self.stdout.write(f"\nSlowest imports (cumulative, self), {len(imports)} modules")
+        for module, cumulative, own in sorted(imports, key=lambda row: row[1], reverse=True)[:top]:
+            self.stdout.write(f"  {module:60} {cumulative / 1000:10.1f} ms {own / 1000:10.1f} ms")
+
+        packages = defaultdict(int)
+        for module, cumulative, own in imports:
+            packages[module.split('.')[0]] += own
+        self.stdout.write("\nImport time per top-level package")
+        for package, own in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+            self.stdout.write(f"  {package:40} {own / 1000:10.1f} ms")
+
+
+# Parse the python -X importtime output into a list of (module, cumulative, self) times in microseconds
+def parse_import_times(output):
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, cumulative, module = line[len('import time:'):].split('|')
+        if own.strip().isdigit():
+            imports.append((module.strip(), int(cumulative), int(own)))
+    return imports
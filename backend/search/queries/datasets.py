@@ -1,12 +1,63 @@
+import os
+import threading
+import time
 from neomodel import db
 
-# This Cypher query retrieves distinct dataset values from all nodes in the Neo4j database
-unique_datasets = db.cypher_query(
-    '''
-    MATCH (n)
-    RETURN DISTINCT n.dataset     
-    '''
-)[0]
+'''
+ Registry of the datasets, read from the Dataset nodes (indexed on their dataset property) the first time it is needed
+ and cached in-process. It is shared by the datasets endpoint and the queries filtering on the enabled datasets, and is
+ invalidated (invalidate_datasets) whenever the dataset state changes: a dataset is enabled or disabled, the database
+ is cleared or an ingest switched to a new data version. Changes made by another process (an ingest run from the
+ command line, another server process) are picked up once the cached registry is older than DATASETS_CACHE_TTL seconds.
+'''
 
-# Create a list of dictionaries containing unique dataset values
-DATASETS = [dataset for subset in unique_datasets for dataset in subset]
\ No newline at end of file
+DATASETS_CACHE_TTL = float(os.getenv("DATASETS_CACHE_TTL", 30))
+
+# Cached registry: list of {'dataset', 'enabled', 'source', 'data_version', 'activated'} and the time it was loaded at
+datasets_cache = {'datasets': None, 'loaded': 0.0}
+datasets_cache_lock = threading.Lock()
+
+
+# Return the registry of the datasets, loading it if it is not cached or too old
+def get_datasets():
+    with datasets_cache_lock:
+        if datasets_cache['datasets'] is None or time.monotonic() - datasets_cache['loaded'] > DATASETS_CACHE_TTL:
+            rows = db.cypher_query(
+                '''
+                MATCH (d:Dataset)
+                RETURN d.dataset, coalesce(d.enabled, false), d.source, d.data_version, d.activated
+                ORDER BY d.dataset
+                '''
+            )[0]
+            datasets_cache['datasets'] = [
+                {'dataset': dataset, 'enabled': enabled, 'source': source, 'data_version': data_version,
+                 'activated': activated}
+                for dataset, enabled, source, data_version, activated in rows
+            ]
+            datasets_cache['loaded'] = time.monotonic()
+        return datasets_cache['datasets']
+
+
+# Names of the datasets of the live data version, enabled or not. The datasets of the other versions are being loaded
+# or cleaned up, and can't be enabled.
+def get_live_dataset_names():
+    live_version = get_live_data_version()
+    return [dataset['dataset'] for dataset in get_datasets() if dataset['data_version'] == live_version]
+
+
+# Names of the enabled datasets, passed as the $enabledSets parameter of the queries
+def get_enabled_datasets():
+    return [dataset['dataset'] for dataset in get_datasets() if dataset['enabled']]
+
+
+# Data version the API serves: the one whose Dataset nodes were switched to last (see switch_data_version in
+# datasets/parse_datasets.py), None before any was loaded
+def get_live_data_version():
+    activated = [dataset for dataset in get_datasets() if dataset['activated'] is not None]
+    return max(activated, key=lambda dataset: dataset['activated'])['data_version'] if activated else None
+
+
+# Drop the cached registry, the next call reloads it
+def invalidate_datasets():
+    with datasets_cache_lock:
+        datasets_cache['datasets'] = None
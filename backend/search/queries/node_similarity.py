@@ -1,6 +1,7 @@
 from neomodel import db
 from django.db import transaction
 from datetime import datetime
+from search.queries.datasets import get_live_data_version, invalidate_datasets
 from search.models import (
     MousePheno,
     Hgene,
@@ -30,69 +31,110 @@ def save_to_db():
     """
     Save Neo4j similarity results to Django db
     """
+    # The similarity relationships are computed for the data version the API serves
+    invalidate_datasets()
+    data_version = get_live_data_version()
+    if data_version is None:
+        print("No data version is live, skipping the node similarity queries")
+        return
     for descriptor, (type_name, edge_name, model_class, similarity_edge) in descriptors.items():
         # Get similarity results and save to database
-        get_node_similarity_results(descriptor)
+        get_node_similarity_results(descriptor, data_version)
 
 
 
-def get_node_similarity_results(descriptor):
+def similarity_graph_name(descriptor, data_version):
+    # Name of the GDS graph projection of a descriptor for a data version
+    return f"{descriptor}_{data_version}"
+
+
+
+def get_node_similarity_results(descriptor, data_version=None):
     """
     Get all node similarity results associated with the descriptor from Neo4j db
     Use the Neo4j Graph Data Science library - write mode
+    Only the nodes of one data version (the live one by default) are projected and compared, so the similarity
+    relationships connect the nodes of that version and are computed again for each new data version
     """
 
     type_name = descriptors.get(descriptor)[0]
     edge_name = descriptors.get(descriptor)[1]
     relationship_type = descriptors.get(descriptor)[3]
+    if data_version is None:
+        data_version = get_live_data_version()
+    graph_name = similarity_graph_name(descriptor, data_version)
 
     try:
-        # Check if the graph already exists in the database
-        exists = db.cypher_query(
-            f'''
-            CALL gds.graph.exists("{descriptor}")
-            YIELD graphName, exists
-            RETURN exists
+        # Drop the projections of the descriptor made for other data versions (or before the projections were named
+        # after their data version), their nodes are deleted once a new data version is live
+        db.cypher_query(
             '''
+            CALL gds.graph.list()
+            YIELD graphName
+            WHERE (graphName = $descriptor OR graphName STARTS WITH $prefix) AND graphName <> $graph_name
+            CALL gds.graph.drop(graphName, false)
+            YIELD graphName AS dropped
+            RETURN count(dropped)
+            ''',
+            {'descriptor': descriptor, 'prefix': f"{descriptor}_", 'graph_name': graph_name}
         )
 
-        # If the graph does not exist, create it using gds.graph.project
-        if exists[0][0][0] == False:
-            db.cypher_query(
-                f'''
-                CALL gds.graph.project(
-                    '{descriptor}',
-                    ['Target', '{type_name}'],
-                    {{
-                        {edge_name}: {{}}
-                    }});
-                '''
-            )
-
-        # Check if the relationship already exists
+        # Check if the relationship already exists between the nodes of the data version
         relationship_exists, _ = db.cypher_query(
             f'''
-            MATCH ()-[r:{relationship_type}]-() 
-            RETURN count(r) > 0 as exists
-            '''
+            MATCH (n:Target)-[r:{relationship_type}]-()
+            WHERE n.data_version = $data_version
+            RETURN true AS exists
+            LIMIT 1
+            ''',
+            {'data_version': data_version}
         )
 
         # If the relationship does not exist, run similarity calculations
-        if not relationship_exists[0][0]:
-            print(f"{descriptor} Running node similarity query...")
+        if not relationship_exists:
+            # Check if the graph already exists in the database
+            exists = db.cypher_query(
+                '''
+                CALL gds.graph.exists($graph_name)
+                YIELD graphName, exists
+                RETURN exists
+                ''',
+                {'graph_name': graph_name}
+            )
+
+            # If the graph does not exist, project the nodes and relationships of the data version
+            if exists[0][0][0] == False:
+                db.cypher_query(
+                    f'''
+                    CALL gds.graph.project.cypher(
+                        $graph_name,
+                        'MATCH (n:Target) WHERE n.data_version = $data_version RETURN id(n) AS id
+                         UNION
+                         MATCH (n:{type_name}) WHERE n.data_version = $data_version RETURN id(n) AS id',
+                        'MATCH (t:Target)-[:{edge_name}]->(n:{type_name})
+                         WHERE t.data_version = $data_version AND n.data_version = $data_version
+                         RETURN id(t) AS source, id(n) AS target',
+                        {{parameters: {{data_version: $data_version}}}}
+                    )
+                    ''',
+                    {'graph_name': graph_name, 'data_version': data_version}
+                )
+
+            print(f"{descriptor} Running node similarity query for data version {data_version}...")
             # Run similarity calculations using the gds.nodeSimilarity.write algorithm
             result, _ = db.cypher_query(
-                f'''
+                '''
                 CALL gds.nodeSimilarity.write(
-                    "{descriptor}",
-                    {{
-                        writeRelationshipType: "{relationship_type}",
+                    $graph_name,
+                    {
+                        writeRelationshipType: $relationship_type,
                         writeProperty: "score",
                         topK: 500
-                    }}
+                    }
                 )
                 YIELD nodesCompared, relationshipsWritten
-                '''
+                ''',
+                {'graph_name': graph_name, 'relationship_type': relationship_type}
             )
 
             nodes_compared = result[0][0]
@@ -100,8 +142,12 @@ def get_node_similarity_results(descriptor):
 
             print(f"{descriptor} Node similarity query completed. Nodes compared: {nodes_compared}, relationships written: {relationships_written}")
 
+            # The projection is only needed to compute the relationships, free its memory
+            db.cypher_query("CALL gds.graph.drop($graph_name, false) YIELD graphName RETURN graphName",
+                            {'graph_name': graph_name})
+
         else:
-            print(f"{descriptor} Relationship {relationship_type} already exists. Skipping node similarity query.")
+            print(f"{descriptor} Relationship {relationship_type} already exists for data version {data_version}. Skipping node similarity query.")
 
     except Exception as e:
         print(f"Error in {descriptor} node similarity query: {e}")
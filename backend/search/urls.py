@@ -116,6 +116,12 @@ urlpatterns = [
     # Health check
     path('api/info/', views.info, name='info'),
 
+    # Readiness check, 503 with Retry-After until the startup tasks made the graph ready
+    path('api/ready/', views.ready, name='ready'),
+
+    # Progress of the startup tasks (download, ingest, similarity)
+    path('api/progress/', views.progress, name='progress'),
+
     # Return an array of suggested entities in response to a hint (beginning of the name)
     path('api/suggest/<str:entity_type>/<str:hint>/', SuggestHintView.as_view(), name='suggest_hint'),
 
@@ -7,8 +7,6 @@ from neomodel import db, config
 from neomodel import NodeSet
 from neomodel.core import NodeMeta
 from neomodel.relationship import RelationshipMeta
-from py2neo import Path
-from neo4j import GraphDatabase
 import json
 from typing import List, Dict, Tuple, Union
 
@@ -17,7 +15,7 @@ from .Cytoscape import Node, Relationship
 
 # Import query functions
 from .queries.actions import get_actions
-from .queries.datasets import DATASETS
+from .queries.datasets import get_enabled_datasets, get_live_dataset_names, invalidate_datasets
 # from .queries.node_similarity import get_node_similarity_results
 
 
@@ -28,7 +26,7 @@ def fetch_actions(target):
 
 
 def fetch_datasets():
-    return DATASETS
+    return get_live_dataset_names()
 
 # TODO ADD to startup instead
 # def fetch_similarity(descriptor):
@@ -39,6 +37,7 @@ def fetch_datasets():
 def update_dataset_status(dataset_name, enabled):
     query = f"MATCH (d:Dataset {{ dataset: '{dataset_name}' }}) SET d.enabled={enabled}"
     db.cypher_query(query)
+    invalidate_datasets()
 
 
 def get_all_routes(urlpatterns, prefix=''):
@@ -128,9 +127,8 @@ def get_weights_by_target(target, adverse_event=None, action_types=None, drug=No
         list: A list of formatted results containing either adverse events or drugs and their associated llr.
     """
 
-    # Find active datasets and store them in the enabledSets variable.
-    # This query will search for nodes labeled 'Dataset' with a property 'enabled' set to true.
-    enabled_datasets_query = "MATCH (nd:Dataset {enabled: true}) WITH COLLECT(nd.dataset) AS enabledSets"
+    # Pass the active datasets, read from the cached dataset registry, in the enabledSets variable.
+    enabled_datasets_query = "WITH $enabledSets AS enabledSets"
 
     # Construct the TARGETS segment of the query to find drugs that target the specified protein.
     # This part of the query searches for relationships labeled 'TARGETS' between Drug nodes and Target nodes.
@@ -186,7 +184,7 @@ def get_weights_by_target(target, adverse_event=None, action_types=None, drug=No
     cypher_query = f"{enabled_datasets_query}{target_query}{associated_query}{return_query}"
 
     # Run the Cypher query and retrieve the results.
-    results, _ = db.cypher_query(cypher_query)
+    results, _ = db.cypher_query(cypher_query, {"enabledSets": get_enabled_datasets()})
 
     # print(cypher_query)
 
@@ -235,8 +233,8 @@ def get_weights_by_ae(adverse_event, target=None, action_types=None, drug=None,
         list: A list of formatted results containing either protein targets or drugs and their associated llr.
     """
 
-    # Find active datasets and store them in the enabledSets variable.
-    enabled_datasets_query = "MATCH (nd:Dataset {enabled: true}) WITH COLLECT(nd.dataset) AS enabledSets"
+    # Pass the active datasets, read from the cached dataset registry, in the enabledSets variable.
+    enabled_datasets_query = "WITH $enabledSets AS enabledSets"
 
     # Construct the ASSOCIATED_WITH segment of the query to find drugs associated with the specified adverse event.
     associated_query = f"""
@@ -295,7 +293,7 @@ def get_weights_by_ae(adverse_event, target=None, action_types=None, drug=None,
     cypher_query = f"{enabled_datasets_query}{associated_query}{target_query}{return_query}"
 
     # Run the Cypher query and retrieve the results.
-    results, _ = db.cypher_query(cypher_query)
+    results, _ = db.cypher_query(cypher_query, {"enabledSets": get_enabled_datasets()})
 
     # print(cypher_query)
 
@@ -345,8 +343,8 @@ def get_paths_target_ae_drug(target, action_types=None, adverse_event=None, drug
     Returns:
         list: A list of paths between the given target, adverse events, and drugs.
     """
-    # Find active datasets and store them in the enabledSets variable.
-    enabled_datasets_query = "MATCH (nd:Dataset {enabled: true}) WITH COLLECT(nd.dataset) AS enabledSets"
+    # Pass the active datasets, read from the cached dataset registry, in the enabledSets variable.
+    enabled_datasets_query = "WITH $enabledSets AS enabledSets"
 
     # Construct the TARGETS segment of the query to find drugs that target the specified protein.
     # This part of the query searches for paths between adverse events, drugs, and the given target.
@@ -415,7 +413,7 @@ def get_paths_target_ae_drug(target, action_types=None, adverse_event=None, drug
     cypher_query = f"{target_query} UNION {path_query} UNION {drug_target_query} UNION {single_target_query}"
 
     # Run the Cypher query and retrieve the results.
-    results, _ = db.cypher_query(cypher_query)
+    results, _ = db.cypher_query(cypher_query, {"enabledSets": get_enabled_datasets()})
 
     # Return the list of paths found.
     return results
@@ -434,8 +432,8 @@ def get_paths_ae_target_drug(adverse_event, action_types=None, target=None, drug
         list: A list of paths between the given adverse event, targets, and drugs.
     """
 
-    # Find active datasets and store them in the enabledSets variable.
-    enabled_datasets_query = "MATCH (nd:Dataset {enabled: true}) WITH COLLECT(nd.dataset) AS enabledSets"
+    # Pass the active datasets, read from the cached dataset registry, in the enabledSets variable.
+    enabled_datasets_query = "WITH $enabledSets AS enabledSets"
 
     # Construct the AE_QUERY segment to find drugs associated with the adverse event and target proteins.
     ae_query = f"""
@@ -508,7 +506,7 @@ def get_paths_ae_target_drug(adverse_event, action_types=None, target=None, drug
     cypher_query = f"{ae_query} UNION {path_query} UNION {drug_target_query} UNION {single_ae_query}"
 
     # Run the Cypher query and retrieve the results.
-    results, _ = db.cypher_query(cypher_query)
+    results, _ = db.cypher_query(cypher_query, {"enabledSets": get_enabled_datasets()})
 
     # Return the list of paths found.
     return results
@@ -601,71 +599,80 @@ def clear_neo4j_database():
     query = "MATCH (n) DETACH DELETE n"
     # Execute the query
     db.cypher_query(query)
+    invalidate_datasets()
 
 def suggestion_by_hint_for_target(hint):
-    # Define the Cypher query to search for target nodes that match the hint
+    # Define the Cypher query to search for target nodes of the enabled datasets that match the hint
     cypher_query = """
+        WITH $enabledSets AS enabledSets
         MATCH (t:Target)
-        WHERE
-            toLower(t.name) CONTAINS toLower($hint) OR
-            toLower(t.symbol) CONTAINS toLower($hint) OR
-            toLower(t.ensembleId) CONTAINS toLower($hint)
+        WHERE t.dataset IN enabledSets AND (
+                toLower(t.name) CONTAINS toLower($hint) OR
+                toLower(t.symbol) CONTAINS toLower($hint) OR
+                toLower(t.ensembleId) CONTAINS toLower($hint)
+        )
         RETURN t.name AS name, t.symbol AS symbol, t.ensembleId AS ensembleId
         LIMIT 12
     """
     # Execute the query with the hint as a parameter
-    result, _ = db.cypher_query(cypher_query, {"hint": hint})
+    result, _ = db.cypher_query(cypher_query, {"hint": hint, "enabledSets": get_enabled_datasets()})
     # Transform the result into a list of dictionaries
     results_list = [{"name": r[0], "symbol": r[1], "ensembleId": r[2]} for r in result]
     # Return the list
     return results_list
 
 def suggestion_by_hint_for_adverse_event(hint):
-    # Define the Cypher query to search for adverse event nodes that match the hint
+    # Define the Cypher query to search for adverse event nodes of the enabled datasets that match the hint
     cypher_query = """
+        WITH $enabledSets AS enabledSets
         MATCH (t:AdverseEvent)
-        WHERE
-            toLower(t.meddraId) CONTAINS toLower($hint) OR
-            toLower(t.adverseEventId) CONTAINS toLower($hint)
+        WHERE t.dataset IN enabledSets AND (
+                toLower(t.meddraId) CONTAINS toLower($hint) OR
+                toLower(t.adverseEventId) CONTAINS toLower($hint)
+        )
         RETURN t.meddraId AS meddraId, t.adverseEventId AS adverseEventId
         LIMIT 12
     """
     # Execute the query with the hint as a parameter
-    result, _ = db.cypher_query(cypher_query, {"hint": hint})
+    result, _ = db.cypher_query(cypher_query, {"hint": hint, "enabledSets": get_enabled_datasets()})
     # Transform the result into a list of dictionaries
     results_list = [{"meddraId": r[0], "adverseEventId": r[1]} for r in result]
     # Return the list
     return results_list
 
 def suggestion_by_hint_for_disease(hint):
-    # Define the Cypher query to search for disease nodes that match the hint
+    # Define the Cypher query to search for disease nodes of the enabled datasets that match the hint
     cypher_query = """
+        WITH $enabledSets AS enabledSets
         MATCH (t:Disease)
-        WHERE
-            toLower(t.name) CONTAINS toLower($hint) OR
-            toLower(t.diseaseId) CONTAINS toLower($hint)
+        WHERE t.dataset IN enabledSets AND (
+                toLower(t.name) CONTAINS toLower($hint) OR
+                toLower(t.diseaseId) CONTAINS toLower($hint)
+        )
         RETURN t.name AS name, t.diseaseId AS diseaseId
         LIMIT 12
     """
     # Execute the query with the hint as a parameter
-    result, _ = db.cypher_query(cypher_query, {"hint": hint})
+    result, _ = db.cypher_query(cypher_query, {"hint": hint, "enabledSets": get_enabled_datasets()})
     # Transform the result into a list of dictionaries
     results_list = [{"name": r[0], "diseaseId": r[1]} for r in result]
     # Return the list
     return results_list
 
 def suggestion_by_hint_for_drug(hint):
-    # Define the Cypher query to search for drug nodes that match the hint
+    # Define the Cypher query to search for drug nodes of the enabled datasets that match the hint
     cypher_query = """
+        WITH $enabledSets AS enabledSets
         MATCH (t:Drug)
-        WHERE
-            toLower(t.chemblId) CONTAINS toLower($hint) OR
-            toLower(t.drugId) CONTAINS toLower($hint)
+        WHERE t.dataset IN enabledSets AND (
+                toLower(t.chemblId) CONTAINS toLower($hint) OR
+                toLower(t.drugId) CONTAINS toLower($hint)
+        )
         RETURN t.chemblId AS chemblId, t.drugId AS drugId
         LIMIT 12
     """
     # Execute the query with the hint as a parameter
-    result, _ = db.cypher_query(cypher_query, {"hint": hint})
+    result, _ = db.cypher_query(cypher_query, {"hint": hint, "enabledSets": get_enabled_datasets()})
     # Transform the result into a list of dictionaries
     results_list = [{"chemblId": r[0], "drugId": r[1]} for r in result]
     # Return the list
@@ -673,35 +680,39 @@ def suggestion_by_hint_for_drug(hint):
 
 
 def suggestion_by_hint_for_mouse_phenotype(hint):
-    # Define the Cypher query to search for mouse phenotype nodes that match the hint
+    # Define the Cypher query to search for mouse phenotype nodes of the enabled datasets that match the hint
     cypher_query = """
+        WITH $enabledSets AS enabledSets
         MATCH (t:MousePhenotype)
-        WHERE
-            toLower(t.mousePhenotypeLabel) CONTAINS toLower($hint) OR
-            toLower(t.mousePhenotypeId) CONTAINS toLower($hint)
+        WHERE t.dataset IN enabledSets AND (
+                toLower(t.mousePhenotypeLabel) CONTAINS toLower($hint) OR
+                toLower(t.mousePhenotypeId) CONTAINS toLower($hint)
+        )
         RETURN t.mousePhenotypeLabel AS mousePhenotypeLabel, t.mousePhenotypeId AS mousePhenotypeId
         LIMIT 12
     """
     # Execute the query with the hint as a parameter
-    result, _ = db.cypher_query(cypher_query, {"hint": hint})
+    result, _ = db.cypher_query(cypher_query, {"hint": hint, "enabledSets": get_enabled_datasets()})
     # Transform the result into a list of dictionaries
     results_list = [{"mousePhenotypeLabel": r[0], "mousePhenotypeId": r[1]} for r in result]
     # Return the list
     return results_list
 
 def suggestion_by_hint_for_pathway(hint):
-    # Define the Cypher query to search for pathway nodes that match the hint
+    # Define the Cypher query to search for pathway nodes of the enabled datasets that match the hint
     cypher_query = """
+        WITH $enabledSets AS enabledSets
         MATCH (t:Pathway)
-        WHERE
-            toLower(t.pathwayCode) CONTAINS toLower($hint) OR
-            toLower(t.pathwayId) CONTAINS toLower($hint) OR
-            toLower(t.topLevelTerm) CONTAINS toLower($hint)
+        WHERE t.dataset IN enabledSets AND (
+                toLower(t.pathwayCode) CONTAINS toLower($hint) OR
+                toLower(t.pathwayId) CONTAINS toLower($hint) OR
+                toLower(t.topLevelTerm) CONTAINS toLower($hint)
+        )
         RETURN t.pathwayCode AS pathwayCode, t.pathwayId AS pathwayId, t.topLevelTerm AS topLevelTerm
         LIMIT 12
     """
     # Execute the query with the hint as a parameter
-    result, _ = db.cypher_query(cypher_query, {"hint": hint})
+    result, _ = db.cypher_query(cypher_query, {"hint": hint, "enabledSets": get_enabled_datasets()})
     # Transform the result into a list of dictionaries
     results_list = [{"pathwayCode": r[0], "pathwayId": r[1], "topLevelTerm": r[2]} for r in result]
     # Return the list
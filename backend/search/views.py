@@ -8,7 +8,6 @@ from django.urls import get_resolver
 from django.views import View
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
-import psutil
 from rest_framework import generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -78,6 +77,10 @@ from .csv_service import(
     parse_and_load_csv_file
 )
 
+from .queries.datasets import get_live_data_version
+
+from gradvekbackend.startup import STARTUP_RETRY_AFTER, graph_servable, read_startup_status
+
 # API view to list all routes in the Django site
 class RoutesListAPIView(generics.GenericAPIView):
     """
@@ -153,11 +156,12 @@ class GetSimilarity(APIView):
         # Execute a Cypher query to retrieve similarity results from the Neo4j database
         results = db.cypher_query(
             f'''
-            MATCH (n1:Target {{symbol: "{target}"}})-[r:{relationship_type}]-(n2:Target)
+            MATCH (n1:Target {{data_version: $data_version, symbol: $target}})-[r:{relationship_type}]-(n2:Target)
             WHERE n1 <> n2
             RETURN n1.symbol, n2.symbol, r.score
             ORDER BY r.score DESC
-            '''
+            ''',
+            {'data_version': get_live_data_version(), 'target': target}
         )[0]
 
         # Initialize an empty list to store response data
@@ -191,14 +195,17 @@ class GetAverageSimilarity(APIView):
         # Initialize defaultdict for storing results
         descriptor_results = defaultdict(lambda: {"total": 0, "count": 0, "descriptors": {}})
 
+        # Only the targets of the live data version
+        data_version = get_live_data_version()
         for descriptor_type, relationship_type in relationship_types.items():
             # Get similarity results from Neo4j using Cypher query
             results = db.cypher_query(
                 f'''
-                MATCH (n1:Target {{symbol: "{target}"}})-[r:{relationship_type}]-(n2:Target)
+                MATCH (n1:Target {{data_version: $data_version, symbol: $target}})-[r:{relationship_type}]-(n2:Target)
                 WHERE n1 <> n2
                 RETURN n1.symbol, n2.symbol, r.score
-                '''
+                ''',
+                {'data_version': data_version, 'target': target}
             )[0]
 
             # Calculate the sum, count, and descriptors with similarity scores for each target2
@@ -256,14 +263,17 @@ class GetWeightedAverageSimilarity(GetAverageSimilarity):
         # Initialize defaultdict for storing results
         descriptor_results = defaultdict(lambda: {"total": 0, "count": 0, "descriptors": {}})
 
+        # Only the targets of the live data version
+        data_version = get_live_data_version()
         for descriptor_type, relationship_type in relationship_types.items():
             # Get similarity results from Neo4j using Cypher query
             results = db.cypher_query(
                 f'''
-                MATCH (n1:Target {{symbol: "{target}"}})-[r:{relationship_type}]-(n2:Target)
+                MATCH (n1:Target {{data_version: $data_version, symbol: $target}})-[r:{relationship_type}]-(n2:Target)
                 WHERE n1 <> n2
                 RETURN n1.symbol, n2.symbol, r.score
-                '''
+                ''',
+                {'data_version': data_version, 'target': target}
             )[0]
 
             # Calculate the sum, count, and descriptors with similarity scores and weights for each target2
@@ -305,16 +315,17 @@ class GetGlobalAverageSimilarity(APIView):
 
     # Define a function for processing a single descriptor type and relationship type
     @staticmethod
-    def process_descriptor(descriptor_type, relationship_type):
+    def process_descriptor(descriptor_type, relationship_type, data_version):
         print(f"Starting {relationship_type} processing")
         
-        # Get similarity results from Neo4j using Cypher query
+        # Get similarity results of the targets of the data version from Neo4j using Cypher query
         results = db.cypher_query(
             f'''
             MATCH (n1:Target)-[r:{relationship_type}]-(n2:Target)
-            WHERE n1 <> n2
+            WHERE n1.data_version = $data_version AND n1 <> n2
             RETURN n1.symbol, n2.symbol, r.score
-            '''
+            ''',
+            {'data_version': data_version}
         )[0]
         print(f"{relationship_type} results pulled from Neo4j")
 
@@ -338,7 +349,9 @@ class GetGlobalAverageSimilarity(APIView):
             min_descriptors = self.kwargs['min_descriptors']
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
-        
+
+        # Imported here, only this view needs psutil
+        import psutil
         available_memory = psutil.virtual_memory().available / (1024 ** 3)  # Get available memory in GB
         if available_memory < 8:
             print("WARNING: Less than 8 GB of memory available. Skipping compute.")
@@ -349,11 +362,13 @@ class GetGlobalAverageSimilarity(APIView):
         # Initialize empty defaultdict for storing final results
         final_descriptor_results = defaultdict(lambda: {"total": 0, "count": 0, "descriptors": {}})
 
+        # Only the targets of the live data version
+        data_version = get_live_data_version()
         # Parallelize the processing of descriptors using ThreadPoolExecutor
         with ThreadPoolExecutor() as executor:
             # Submit tasks to executor for processing each descriptor and relationship type
             futures = {
-                executor.submit(self.process_descriptor, descriptor_type, relationship_type): (descriptor_type, relationship_type)
+                executor.submit(self.process_descriptor, descriptor_type, relationship_type, data_version): (descriptor_type, relationship_type)
                 for descriptor_type, relationship_type in relationship_types.items()
             }
 
@@ -436,7 +451,7 @@ def gene(request, id):
 
 class Datasets(APIView):
     """
-    Return an array of all known datasets (both active and inactive).
+    Return an array of the datasets of the live data version (both active and inactive).
     """
 
     def get(self, request):
@@ -622,6 +637,24 @@ def info(request):
     # Implement the functionality for a health check
     pass
 
+# Readiness check: 200 once the graph can be queried, 503 with a Retry-After header while the startup tasks load it
+@require_http_methods(["GET"])
+def ready(request):
+    status = read_startup_status()
+    if graph_servable(status):
+        return JsonResponse({'ready': True, 'data_version': status and status.get('data_version')})
+    response = JsonResponse({'ready': False, 'state': status['state']}, status=503)
+    response['Retry-After'] = str(STARTUP_RETRY_AFTER)
+    return response
+
+# Progress of the startup tasks: state of the download, ingest and similarity steps, files downloaded and loaded
+@require_http_methods(["GET"])
+def progress(request):
+    status = read_startup_status()
+    if status is None:
+        return JsonResponse({'state': 'not started', 'steps': {}})
+    return JsonResponse(status)
+
 class SuggestHintView(APIView):
     """
     SuggestHintView handles GET requests to return an array of suggested entities in response to a hint (beginning of the name)
@@ -0,0 +1,13 @@
+import os
+import sys
+import django
+from django.conf import settings
+
+# The Django apps are imported from backend, as with manage.py
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Settings for the tests of the modules that don't need a database or Neo4j, settings.py reads them from .env
+if not settings.configured:
+    settings.configure(BASE_DIR=BACKEND_DIR, SECRET_KEY="test", ALLOWED_HOSTS=["testserver"], INSTALLED_APPS=[])
+    django.setup()
@@ -0,0 +1,52 @@
+import pytest
+
+from search.queries import datasets
+
+
+@pytest.fixture
+def dataset_nodes(monkeypatch):
+    nodes = [("24.03 Target", False, "Target", "24.03", "2024-03-20T10:00:00"),
+             ("24.06 Target", True, "Target", "24.06", "2024-06-20T10:00:00"),
+             ("24.06 Drug", False, "Drug", "24.06", "2024-06-20T10:00:00"),
+             ("24.09 Target", True, "Target", "24.09", None)]
+    queries = []
+
+    def cypher_query(query, params=None):
+        queries.append(query)
+        return [list(node) for node in nodes], None
+
+    monkeypatch.setattr(datasets.db, 'cypher_query', cypher_query)
+    datasets.invalidate_datasets()
+    yield queries
+    datasets.invalidate_datasets()
+
+
+def test_the_registry_is_read_once_until_it_is_invalidated(dataset_nodes):
+    assert [dataset['dataset'] for dataset in datasets.get_datasets()] == \
+        ["24.03 Target", "24.06 Target", "24.06 Drug", "24.09 Target"]
+    assert datasets.get_enabled_datasets() == ["24.06 Target", "24.09 Target"]
+    assert len(dataset_nodes) == 1
+
+    datasets.invalidate_datasets()
+    datasets.get_datasets()
+    assert len(dataset_nodes) == 2
+
+
+def test_the_registry_is_read_again_once_it_is_older_than_the_ttl(dataset_nodes, monkeypatch):
+    datasets.get_datasets()
+    monkeypatch.setattr(datasets, 'DATASETS_CACHE_TTL', -1)
+    datasets.get_datasets()
+
+    assert len(dataset_nodes) == 2
+
+
+def test_the_live_data_version_is_the_last_activated_one(dataset_nodes, monkeypatch):
+    assert datasets.get_live_data_version() == "24.06"
+
+    monkeypatch.setattr(datasets.db, 'cypher_query', lambda query, params=None: ([], None))
+    datasets.invalidate_datasets()
+    assert datasets.get_live_data_version() is None
+
+
+def test_only_the_datasets_of_the_live_data_version_are_listed(dataset_nodes):
+    assert datasets.get_live_dataset_names() == ["24.06 Target", "24.06 Drug"]
@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+from search.management.commands.profile_startup import parse_import_times
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_parse_import_times_reads_the_importtime_lines():
+    output = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       120 |        120 |   _io",
+        "import time:      2400 |       5100 | neo4j",
+        "Traceback (most recent call last):",
+    ])
+
+    assert parse_import_times(output) == [("_io", 120, 120), ("neo4j", 5100, 2400)]
+
+
+def test_the_startup_module_does_not_import_the_downloader():
+    code = "\n".join([
+        "import sys",
+        "from django.conf import settings",
+        f"settings.configure(BASE_DIR={BACKEND_DIR!r})",
+        "import gradvekbackend.startup",
+        "print('datasets.get_datasets' in sys.modules)",
+    ])
+    process = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True)
+
+    assert process.returncode == 0, process.stderr
+    assert process.stdout.strip() == "False"
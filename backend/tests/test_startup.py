@@ -0,0 +1,130 @@
+import json
+import subprocess
+import sys
+import pytest
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from gradvekbackend import middleware, startup
+from gradvekbackend.middleware import StartupMiddleware
+
+
+@pytest.fixture(autouse=True)
+def status_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(startup, 'STARTUP_STATUS_FILE', str(tmp_path / "startup_status.json"))
+    monkeypatch.setattr(middleware, 'STARTUP_STATUS_TTL', 0)
+    startup.startup_status.clear()
+    startup.startup_sources.clear()
+    return startup.STARTUP_STATUS_FILE
+
+
+def write_status(path, **status):
+    with open(path, "w") as file:
+        json.dump(status, file)
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_no_status_file_means_no_startup_tasks():
+    assert startup.read_startup_status() is None
+
+
+def test_a_running_status_of_an_exited_process_is_interrupted(status_file):
+    write_status(status_file, state='running', graph_ready=False, pid=exited_pid())
+    assert startup.read_startup_status()['state'] == 'interrupted'
+
+    write_status(status_file, state='running', graph_ready=False, pid=startup.os.getpid())
+    assert startup.read_startup_status()['state'] == 'running'
+
+
+def test_startup_steps_record_their_state(status_file, monkeypatch):
+    def run_startup_tasks():
+        startup.run_startup_step('download', lambda: None)
+        startup.run_startup_step('ingest', lambda: 1 / 0)
+
+    monkeypatch.setattr(startup, 'run_startup_tasks', run_startup_tasks)
+    monkeypatch.setattr(startup, 'record_live_graph', lambda module: None)
+    startup.startup_status.update(state='running', graph_ready=False, steps={})
+    startup.track_startup_tasks()
+
+    status = startup.read_startup_status()
+    assert status['state'] == 'failed' and "division by zero" in status['error']
+    assert status['steps']['download']['state'] == 'done'
+    assert status['steps']['ingest']['state'] == 'failed'
+
+
+def test_middleware_answers_503_until_the_graph_is_ready(status_file):
+    get = StartupMiddleware(lambda request: HttpResponse("data"))
+    factory = RequestFactory()
+    write_status(status_file, state='running', graph_ready=False, pid=startup.os.getpid())
+
+    response = get(factory.get("/api/datasets/"))
+    assert response.status_code == 503
+    assert response['Retry-After'] == str(startup.STARTUP_RETRY_AFTER)
+    assert get(factory.get("/api/progress/")).status_code == 200
+    assert get(factory.get("/admin/")).status_code == 200
+
+    write_status(status_file, state='running', graph_ready=True, data_version="24.06", pid=startup.os.getpid())
+    assert get(factory.get("/api/datasets/")).status_code == 200
+
+
+def test_a_status_of_an_exited_process_does_not_block_the_api(status_file):
+    get = StartupMiddleware(lambda request: HttpResponse("data"))
+    write_status(status_file, state='running', graph_ready=False, pid=exited_pid())
+
+    assert get(RequestFactory().get("/api/datasets/")).status_code == 200
+
+
+def test_a_failed_startup_serves_the_live_data_version(status_file, monkeypatch):
+    def run_startup_tasks():
+        raise RuntimeError("download failed")
+
+    monkeypatch.setattr(startup, 'run_startup_tasks', run_startup_tasks)
+    monkeypatch.setattr(startup, 'record_live_graph',
+                        lambda module: startup.update_startup_status(graph_ready=True, data_version="24.06"))
+    startup.startup_status.update(state='running', graph_ready=False, data_version=None, pid=startup.os.getpid())
+    startup.track_startup_tasks()
+
+    status = startup.read_startup_status()
+    assert status['state'] == 'failed' and status['data_version'] == "24.06"
+    assert startup.graph_servable(status)
+
+    # Without a live data version the API keeps answering 503
+    write_status(status_file, state='failed', graph_ready=False, data_version=None, pid=startup.os.getpid())
+    response = StartupMiddleware(lambda request: HttpResponse("data"))(RequestFactory().get("/api/datasets/"))
+    assert response.status_code == 503 and "failed" in json.loads(response.content)['detail']
+
+
+def test_clear_stale_startup_status_only_removes_the_status_of_an_exited_process(status_file):
+    write_status(status_file, state='running', graph_ready=False, pid=startup.os.getpid())
+    startup.clear_stale_startup_status()
+    assert startup.read_startup_status()['state'] == 'running'
+
+    write_status(status_file, state='failed', graph_ready=False, pid=exited_pid())
+    startup.clear_stale_startup_status()
+    assert startup.read_startup_status() is None
+
+
+def test_the_status_records_the_files_downloaded_and_loaded(status_file, tmp_path):
+    from datasets import ingest_report
+    from datasets.get_datasets import DownloadFeed
+
+    feed = DownloadFeed()
+    feed.list_files(str(tmp_path / "targets"), ["a.parquet", "b.parquet"])
+    feed.file_done(str(tmp_path / "targets" / "a.parquet"))
+    ingest_report.clear_ingest_report()
+    ingest_report.ingest_report['files'].append({'rows_out': 12})
+    startup.startup_sources.update(feed=feed, ingest=ingest_report)
+    startup.startup_status.update(state='running', graph_ready=False, pid=startup.os.getpid(),
+                                  steps={'download': {}, 'ingest': {}})
+
+    startup.save_startup_status()
+
+    steps = startup.read_startup_status()['steps']
+    assert steps['download'] == {'files': 2, 'completed': 1}
+    assert steps['ingest'] == {'files_loaded': 1, 'entries_written': 12}
+    ingest_report.clear_ingest_report()